@@ -65,17 +65,219 @@
 
 # Please install OpenAI SDK first: `pip3 install openai`
 
-from openai import OpenAI
+import argparse
+import json
+import os
+import time
 
-client = OpenAI(api_key="sk-fe8c07ad4d344b65856bb0fe6beed2ac", base_url="https://api.deepseek.com")
+API_KEY = "sk-fe8c07ad4d344b65856bb0fe6beed2ac"
+BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+MODEL = "deepseek-chat"
 
-response = client.chat.completions.create(
-    model="deepseek-chat",
-    messages=[
+# 与 lib/services/deepseek_api_service.dart 中 generateMusicPrompt 使用的系统提示一致
+MUSIC_SYSTEM_PROMPT = """
+You are a professional music prompt engineer, skilled at transforming environmental data and music preferences into high-quality music generation prompts.
+Your task is to create a detailed, creative, and expressive prompt for generating music based on weather data and user preferences.
+
+You should consider the following factors:
+1. How weather conditions (temperature, humidity, wind speed, weather description) affect music mood and atmosphere
+2. User's selected music vibe and genre
+3. Location information (if provided)
+
+Ensure your prompt is:
+- Specific and vivid
+- Includes appropriate music terminology (rhythm, melody, harmony, etc.)
+- Moderate length (about 100-150 words)
+- Stylistically consistent
+- Suitable for AI music generation systems
+
+The output format should be a coherent paragraph without titles or sections. Don't explain your creative process, just provide the final prompt text.
+"""
+
+
+def create_client(api_key=API_KEY, base_url=BASE_URL):
+    """创建 DeepSeek 客户端 (兼容 OpenAI SDK)
+
+    openai 导入较慢 (约0.8秒)，只在创建客户端时导入，使只用到提示词构建的脚本启动更快。
+    """
+    from openai import OpenAI
+
+    return OpenAI(api_key=api_key, base_url=base_url)
+
+
+def create_async_client(api_key=API_KEY, base_url=BASE_URL, max_retries=2):
+    """创建异步 DeepSeek 客户端，用于并发批量请求"""
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries)
+
+
+def build_music_messages(weather, preferences=None):
+    """根据天气数据和音乐偏好构建对话消息
+
+    weather 需包含 description、temperature、humidity、wind_speed，可选 city；
+    preferences 可包含 vibe 和 genre。
+    """
+    preferences = preferences or {}
+    user_prompt = (
+        "Please create a prompt for music generation based on the following information:\n\n"
+        f"Weather condition: {weather['description']}\n"
+        f"Temperature: {weather['temperature']:.1f}°C\n"
+        f"Humidity: {weather['humidity']}%\n"
+        f"Wind speed: {weather['wind_speed']} m/s\n"
+    )
+    if weather.get('city'):
+        user_prompt += f"Location: {weather['city']}\n"
+    if preferences.get('vibe'):
+        user_prompt += f"Music vibe: {preferences['vibe']}\n"
+    if preferences.get('genre'):
+        user_prompt += f"Music genre: {preferences['genre']}\n"
+    user_prompt += ("\nPlease create a concise and powerful music generation prompt, "
+                    "output the final text directly without any explanation or formatting.")
+    return [
+        {"role": "system", "content": MUSIC_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+class StreamingCompletion:
+    """流式对话补全：迭代时逐个产出到达的内容分块
+
+    迭代结束后可读取 text (完整内容) 和 metrics (首token时间、token速率、总延迟)。
+    请求时带 stream_options.include_usage，服务器在 finish_reason 之后再发一个只含 usage 的分块，
+    token数取自其中的 completion_tokens (服务器不返回 usage 时退回按分块计数)；
+    读到 usage 分块即停止，下游无需等待连接关闭。
+    指定 metrics_path 时每次请求的指标追加一行JSON到该文件。
+    """
+
+    def __init__(self, client, messages, metrics_path=None, **kwargs):
+        self.client = client
+        self.messages = messages
+        self.metrics_path = metrics_path
+        self.kwargs = kwargs
+        self.text = None
+        self.metrics = None
+
+    def __iter__(self):
+        pieces = []
+        chunks = 0
+        usage = None
+        first_token_at = None
+        finish_reason = None
+        last_token_at = None
+        start = time.perf_counter()
+        stream = self.client.chat.completions.create(
+            model=MODEL, messages=self.messages, stream=True, stream_options={"include_usage": True},
+            **self.kwargs
+        )
+        try:
+            for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    if usage is not None:
+                        break  # usage 分块是最后一个
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta and choice.delta.content:
+                    last_token_at = time.perf_counter()
+                    if first_token_at is None:
+                        first_token_at = last_token_at
+                    chunks += 1
+                    pieces.append(choice.delta.content)
+                    yield choice.delta.content
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+        finally:
+            stream.close()
+
+        end = time.perf_counter()
+        # 速率按首个到最后一个内容分块之间的时间计算，不包括等待 usage 分块的时间
+        generation_time = (last_token_at or end) - (first_token_at or end)
+        tokens = usage.completion_tokens if usage is not None else chunks
+        self.text = "".join(pieces)
+        self.metrics = {
+            "timestamp": time.time(),
+            "model": MODEL,
+            "ttft": round((first_token_at or end) - start, 3),
+            "total_latency": round(end - start, 3),
+            "tokens": tokens,
+            "chunks": chunks,
+            "tokens_per_second": round(tokens / generation_time, 1) if generation_time > 0 else None,
+            "finish_reason": finish_reason,
+        }
+        if self.metrics_path:
+            with open(self.metrics_path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(self.metrics) + "\n")
+
+
+def stream_music_prompt(client, weather, preferences=None, metrics_path=None, temperature=0.7, max_tokens=300):
+    """以流式方式生成音乐提示词，返回可迭代的 StreamingCompletion"""
+    return StreamingCompletion(
+        client, build_music_messages(weather, preferences), metrics_path,
+        temperature=temperature, max_tokens=max_tokens,
+    )
+
+
+def generate_music_prompt(client, weather, preferences=None, temperature=0.7, max_tokens=300,
+                          stream=False, metrics_path=None, cache=None):
+    """调用 DeepSeek 把天气和偏好转换为音乐生成提示词
+
+    提供 cache (PromptCache) 时，量化后天气特征相同的请求直接返回缓存结果。
+    """
+    if cache is not None:
+        cached = cache.get(weather, preferences)
+        if cached is not None:
+            return cached
+
+    if stream:
+        completion = stream_music_prompt(client, weather, preferences, metrics_path, temperature, max_tokens)
+        for _ in completion:
+            pass
+        prompt = completion.text.strip()
+    else:
+        response = client.chat.completions.create(
+            model=MODEL,
+            messages=build_music_messages(weather, preferences),
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=False
+        )
+        prompt = response.choices[0].message.content.strip()
+
+    if cache is not None and prompt:
+        cache.put(weather, preferences, prompt)
+    return prompt
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='测试 DeepSeek API')
+    parser.add_argument('api_key', nargs='?', default=API_KEY, help='DeepSeek API密钥')
+    parser.add_argument('--prompt', default='Hello', help='发送的用户消息 (默认: Hello)')
+    parser.add_argument('--stream', action='store_true', help='流式输出并记录首token时间和token速率')
+    parser.add_argument('--metrics-file', help='流式模式下追加写入延迟指标的JSONL文件')
+    parser.add_argument('--base-url', default=BASE_URL, help='API基础URL (例如本地模拟服务器)')
+    args = parser.parse_args()
+
+    client = create_client(args.api_key, args.base_url)
+    messages = [
         {"role": "system", "content": "You are a helpful assistant"},
-        {"role": "user", "content": "Hello"},
-    ],
-    stream=False
-)
+        {"role": "user", "content": args.prompt},
+    ]
+
+    if args.stream:
+        completion = StreamingCompletion(client, messages, args.metrics_file)
+        for token in completion:
+            print(token, end="", flush=True)
+        print()
+        print(f"\n首token时间: {completion.metrics['ttft']}秒, "
+              f"速率: {completion.metrics['tokens_per_second']} token/秒, "
+              f"总延迟: {completion.metrics['total_latency']}秒")
+    else:
+        response = client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            stream=False
+        )
 
-print(response.choices[0].message.content)
\ No newline at end of file
+        print(response.choices[0].message.content)
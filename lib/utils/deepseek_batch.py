@@ -0,0 +1,157 @@
+# deepseek_batch.py - 并发批量生成音乐提示词
+#
+# 用异步客户端同时发出多个请求，信号量限制并发数，遇到限流或服务端错误时
+# 按指数退避加抖动重试。结果按输入顺序返回。
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from deepseek_api_test import API_KEY, BASE_URL, MODEL, build_music_messages, create_async_client
+from prompt_cache import PromptCache
+
+
+def retryable_errors():
+    """可重试的 openai 异常类型
+
+    openai 导入约需0.7秒，与 deepseek_api_test.create_client 一样用到时才导入，
+    只导入本模块 (例如复用 retry_delay) 或解析命令行时不会加载它。
+    """
+    import openai
+
+    return (
+        openai.RateLimitError,
+        openai.APIConnectionError,
+        openai.APITimeoutError,
+        openai.InternalServerError,
+    )
+
+
+def retry_delay(err, attempt, base=1.0, cap=30.0):
+    """优先使用服务端的 Retry-After，否则指数退避加完全抖动"""
+    response = getattr(err, "response", None)
+    if response is not None:
+        try:
+            return max(float(response.headers.get("retry-after")), 0.0)
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+async def _generate_one(client, semaphore, item, max_attempts, stats, cache, temperature, max_tokens):
+    import openai
+
+    retryable = retryable_errors()
+    weather = item["weather"]
+    preferences = item.get("preferences")
+    if cache is not None:
+        cached = cache.get(weather, preferences)
+        if cached is not None:
+            stats["cache_hits"] += 1
+            return {"prompt": cached, "cached": True, "attempts": 0}
+
+    for attempt in range(1, max_attempts + 1):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.chat.completions.create(
+                    model=MODEL,
+                    messages=build_music_messages(weather, preferences),
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=False,
+                )
+            except retryable as err:
+                error = err
+            except openai.APIError as err:
+                return {"prompt": None, "error": str(err), "attempts": attempt}
+            else:
+                prompt = response.choices[0].message.content.strip()
+                if cache is not None and prompt:
+                    cache.put(weather, preferences, prompt)
+                return {"prompt": prompt, "cached": False, "attempts": attempt,
+                        "latency": round(time.perf_counter() - start, 3)}
+
+        # 在信号量之外等待，退避期间把并发名额让给其他请求
+        if attempt < max_attempts:
+            stats["retries"] += 1
+            await asyncio.sleep(retry_delay(error, attempt))
+    return {"prompt": None, "error": str(error), "attempts": max_attempts}
+
+
+async def _generate_item(index, *args):
+    """处理单个输入；输入格式错误 (缺少字段、类型不对等) 只让这一项失败，不影响整个批次"""
+    try:
+        return await _generate_one(*args)
+    except Exception as err:
+        return {"prompt": None, "error": f"第{index + 1}个输入无效: {type(err).__name__}: {err}", "attempts": 0}
+
+
+async def generate_prompts(inputs, api_key=API_KEY, base_url=BASE_URL, concurrency=8, max_attempts=5,
+                           cache=None, temperature=0.7, max_tokens=300):
+    """并发为每个输入 ({"weather": ..., "preferences": ...}) 生成提示词
+
+    返回 (结果列表, 统计信息)，结果顺序与输入一致；单个失败不影响其他输入。
+    """
+    client = create_async_client(api_key, base_url, max_retries=0)  # 重试由这里统一控制
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {"retries": 0, "cache_hits": 0}
+    start = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(
+            _generate_item(index, client, semaphore, item, max_attempts, stats, cache, temperature, max_tokens)
+            for index, item in enumerate(inputs)
+        ))
+    finally:
+        await client.close()
+
+    elapsed = time.perf_counter() - start
+    stats.update({
+        "total": len(results),
+        "failed": sum(1 for result in results if result["prompt"] is None),
+        "elapsed": round(elapsed, 3),
+        "prompts_per_second": round(len(results) / elapsed, 2) if elapsed > 0 else None,
+    })
+    return results, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='并发批量生成 DeepSeek 音乐提示词')
+    parser.add_argument('inputs', help='JSONL输入文件，每行 {"weather": {...}, "preferences": {...}}')
+    parser.add_argument('--api-key', default=API_KEY, help='DeepSeek API密钥')
+    parser.add_argument('--base-url', default=BASE_URL, help='API基础URL')
+    parser.add_argument('--concurrency', type=int, default=8, help='最大并发请求数 (默认: 8)')
+    parser.add_argument('--max-attempts', type=int, default=5, help='每个输入的最大尝试次数 (默认: 5)')
+    parser.add_argument('--cache', help='提示词缓存SQLite文件')
+    parser.add_argument('--output', help='JSONL输出文件 (默认: 标准输出)')
+    args = parser.parse_args()
+
+    with open(args.inputs, encoding='utf-8') as file:
+        inputs = [json.loads(line) for line in file if line.strip()]
+
+    cache = PromptCache(args.cache) if args.cache else None
+    results, stats = asyncio.run(generate_prompts(
+        inputs, args.api_key, args.base_url, args.concurrency, args.max_attempts, cache,
+    ))
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for item, result in zip(inputs, results):
+            record = dict(item, **result) if isinstance(item, dict) else dict(result, input=item)
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(f"批量完成: {stats['total']} 个输入, {stats['failed']} 个失败, {stats['retries']} 次重试, "
+          f"{stats['cache_hits']} 次缓存命中, 耗时 {stats['elapsed']}秒 "
+          f"({stats['prompts_per_second']} 个/秒)", file=sys.stderr)
+    if cache is not None:
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# music_mapping.py - 确定性的 天气 → 音乐参数 映射 (向量化，一次处理整批位置)
+#
+# 从温度、风速、湿度、天气状况和空气质量计算速度 (BPM)、调性/调式、
+# 各乐器权重和强度，并可以生成提示词模板，替代或辅助 DeepSeek 调用。
+# 所有计算都是对整列的NumPy运算，每个位置的开销远小于1毫秒。
+# 情绪词与 lib/models/weather_service.dart 的 getTemperatureMood / getWeatherMood 一致。
+#   python music_mapping.py inputs.jsonl --prompt > mapped.jsonl
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from prompt_cache import condition_group, local_hour
+
+# 状况分组顺序与 prompt_cache.condition_group 的取值一致
+CONDITIONS = ("clear", "clouds", "rain", "snow", "fog", "storm", "other")
+WEATHER_MOODS = {
+    "clear": ("bright", "cheerful"),
+    "clouds": ("changing", "thoughtful"),
+    "rain": ("melancholic", "introspective"),
+    "snow": ("pure", "quiet"),
+    "fog": ("mysterious", "vague"),
+    "storm": ("restless", "dynamic"),
+    "other": ("neutral", "balanced"),
+}
+# (下限°C, 情绪词)，从高到低
+TEMPERATURE_MOODS = ((30, ("hot", "energetic")), (20, ("warm", "cheerful")), (10, ("cool", "calm")),
+                     (0, ("cold", "melancholic")), (-np.inf, ("freezing", "contemplative")))
+
+INSTRUMENTS = ("piano", "strings", "synth pad", "acoustic guitar", "percussion", "brass", "woodwinds",
+               "ambient textures")
+
+# 每种状况的乐器基础权重 (行顺序同 CONDITIONS，列顺序同 INSTRUMENTS)
+CONDITION_PROFILES = np.array([
+    [0.8, 0.5, 0.2, 0.9, 0.6, 0.4, 0.6, 0.1],  # clear
+    [0.7, 0.6, 0.5, 0.5, 0.4, 0.2, 0.4, 0.4],  # clouds
+    [0.9, 0.8, 0.4, 0.3, 0.2, 0.1, 0.3, 0.6],  # rain
+    [0.7, 0.6, 0.6, 0.2, 0.1, 0.1, 0.5, 0.7],  # snow
+    [0.4, 0.5, 0.9, 0.1, 0.1, 0.1, 0.3, 0.9],  # fog
+    [0.4, 0.8, 0.5, 0.1, 1.0, 0.7, 0.1, 0.5],  # storm
+    [0.6, 0.6, 0.5, 0.5, 0.4, 0.3, 0.4, 0.4],  # other
+], dtype=np.float32)
+# 归一化后的温度、风速、湿度对各乐器权重的附加影响
+TEMPERATURE_WEIGHTS = np.array([0.0, -0.1, -0.1, 0.3, 0.3, 0.4, 0.2, -0.2], dtype=np.float32)
+WIND_WEIGHTS = np.array([-0.1, 0.3, 0.1, -0.1, 0.6, 0.2, -0.1, 0.2], dtype=np.float32)
+HUMIDITY_WEIGHTS = np.array([0.0, 0.1, 0.3, -0.1, -0.1, -0.1, 0.0, 0.4], dtype=np.float32)
+
+CONDITION_VALENCE = np.array([0.9, 0.5, 0.2, 0.5, 0.35, 0.15, 0.5], dtype=np.float32)
+CONDITION_ENERGY = np.array([0.6, 0.4, 0.3, 0.2, 0.15, 0.95, 0.4], dtype=np.float32)
+
+# 按“明亮”程度排列的调 (五度圈，从降号到升号)，温度越高越明亮
+KEYS = ("Eb", "Bb", "F", "C", "G", "D", "A", "E")
+MODES = ("minor", "dorian", "major")
+
+TEMPO_RANGE = (60, 150)  # BPM
+
+
+def _clip01(values):
+    return np.clip(values, 0.0, 1.0)
+
+
+def condition_indices(descriptions=None, codes=None):
+    """把 OpenWeather 状况代码 (优先) 或描述文字转换为 CONDITIONS 下标数组"""
+    if codes is not None:
+        codes = np.asarray(codes, dtype=np.float64)
+        known = ~np.isnan(codes)
+        group = np.where(known, codes, 0).astype(np.int64) // 100
+        indices = np.select(
+            [codes == 800, codes > 800, group == 2, (group == 3) | (group == 5), group == 6, group == 7],
+            [0, 1, 5, 2, 3, 4],
+            default=6,
+        )
+        if descriptions is None or known.all():
+            return indices
+        fallback = condition_indices(descriptions)
+        return np.where(known, indices, fallback)
+    return np.array([CONDITIONS.index(condition_group(text)) for text in descriptions], dtype=np.int64)
+
+
+def map_weather(temperature, wind_speed, humidity, conditions, air_quality=None, hour=None):
+    """把整批天气数组映射为音乐参数
+
+    temperature: °C；wind_speed: m/s；humidity: %；conditions: CONDITIONS 下标；
+    air_quality: 可选 US EPA 指数 (1-6，NaN表示未知)；hour: 可选当地小时。
+    返回各字段为数组的字典，instruments 为 (位置数, len(INSTRUMENTS)) 的权重矩阵 (每行和为1)。
+    """
+    temperature = np.asarray(temperature, dtype=np.float32)
+    wind = _clip01(np.asarray(wind_speed, dtype=np.float32) / 15.0)
+    humid = _clip01(np.asarray(humidity, dtype=np.float32) / 100.0)
+    conditions = np.asarray(conditions, dtype=np.int64)
+    warmth = _clip01((temperature + 10.0) / 45.0)  # -10°C → 0, 35°C → 1
+    pollution = np.zeros_like(temperature)
+    if air_quality is not None:
+        pollution = np.nan_to_num(_clip01((np.asarray(air_quality, dtype=np.float32) - 1.0) / 5.0))
+
+    energy = _clip01(0.45 * wind + 0.35 * warmth + 0.2 * CONDITION_ENERGY[conditions])
+    valence = _clip01(0.5 * CONDITION_VALENCE[conditions] + 0.4 * warmth + 0.1 * (1.0 - humid) - 0.2 * pollution)
+    if hour is not None:
+        night = np.isin(np.asarray(hour, dtype=np.int64) % 24, (21, 22, 23, 0, 1, 2, 3, 4))
+        energy = np.where(night, energy * 0.8, energy)
+
+    tempo = np.rint(TEMPO_RANGE[0] + energy * (TEMPO_RANGE[1] - TEMPO_RANGE[0])).astype(np.int16)
+    key = np.clip(np.rint(warmth * (len(KEYS) - 1)), 0, len(KEYS) - 1).astype(np.int8)
+    mode = np.digitize(valence, (0.4, 0.6)).astype(np.int8)
+    intensity = _clip01(0.45 * wind + 0.35 * CONDITION_ENERGY[conditions] + 0.2 * pollution).astype(np.float32)
+
+    weights = (CONDITION_PROFILES[conditions]
+               + np.outer(warmth, TEMPERATURE_WEIGHTS)
+               + np.outer(wind, WIND_WEIGHTS)
+               + np.outer(humid, HUMIDITY_WEIGHTS))
+    weights = np.maximum(weights, 0.0)
+    weights /= np.maximum(weights.sum(axis=1, keepdims=True), 1e-6)
+
+    return {
+        "tempo": tempo,
+        "key": key,
+        "mode": mode,
+        "intensity": intensity,
+        "energy": energy.astype(np.float32),
+        "valence": valence.astype(np.float32),
+        "condition": conditions,
+        "temperature": temperature,
+        "instruments": weights.astype(np.float32),
+    }
+
+
+def map_weather_dicts(weathers):
+    """对 weather_summary / build_music_messages 格式的字典列表做映射
+
+    需要 temperature、humidity、wind_speed 和 description，可选 condition_code、aqi，
+    当地小时取自 hour、dt + timezone 或 localtime (见 prompt_cache.local_hour)。
+    """
+    codes = [np.nan if weather.get("condition_code") is None else weather["condition_code"] for weather in weathers]
+    conditions = condition_indices([weather.get("description") for weather in weathers], codes)
+    return map_weather(
+        [weather["temperature"] for weather in weathers],
+        [weather["wind_speed"] for weather in weathers],
+        [weather["humidity"] for weather in weathers],
+        conditions,
+        air_quality=[np.nan if weather.get("aqi") is None else weather["aqi"] for weather in weathers],
+        hour=[local_hour(weather) for weather in weathers],
+    )
+
+
+def to_records(params, top=3):
+    """把数组结果转换为每个位置一个字典 (只保留权重最高的 top 种乐器)"""
+    order = np.argsort(-params["instruments"], axis=1)[:, :top]
+    records = []
+    for index in range(len(params["tempo"])):
+        records.append({
+            "tempo": int(params["tempo"][index]),
+            "key": KEYS[params["key"][index]],
+            "mode": MODES[params["mode"][index]],
+            "intensity": round(float(params["intensity"][index]), 3),
+            "energy": round(float(params["energy"][index]), 3),
+            "valence": round(float(params["valence"][index]), 3),
+            "condition": CONDITIONS[params["condition"][index]],
+            "instruments": {INSTRUMENTS[i]: round(float(params["instruments"][index, i]), 3) for i in order[index]},
+        })
+    return records
+
+
+def temperature_moods(celsius):
+    return next(moods for floor, moods in TEMPERATURE_MOODS if celsius >= floor)
+
+
+def build_prompt(record, weather, preferences=None):
+    """根据映射结果和天气字典生成 Stability 可直接使用的提示词"""
+    preferences = preferences or {}
+    intensity = record["intensity"]
+    level = "gentle" if intensity < 0.33 else "moderate" if intensity < 0.66 else "intense"
+    instruments = list(record["instruments"])
+    lead = instruments[0]
+    support = " and ".join(instruments[1:]) or "light accompaniment"
+    genre = f"{preferences['genre']} " if preferences.get("genre") else ""
+    prompt = (
+        f"{'An' if level[0] in 'aeiou' else 'A'} {level} {genre}piece at {record['tempo']} BPM in {record['key']} {record['mode']}, "
+        f"led by {lead} with {support}. "
+        f"The mood is {temperature_moods(weather['temperature'])[0]} and {WEATHER_MOODS[record['condition']][0]}, "
+        f"{WEATHER_MOODS[record['condition']][1]}, evoking {weather.get('description') or record['condition']}."
+    )
+    if preferences.get("vibe"):
+        prompt += f" Overall vibe: {preferences['vibe']}."
+    return prompt
+
+
+def main():
+    parser = argparse.ArgumentParser(description='把天气批量映射为音乐参数 (不调用LLM)')
+    parser.add_argument('inputs', help='JSONL输入文件，每行 {"weather": {...}, "preferences": {...}} 或天气字典')
+    parser.add_argument('--prompt', action='store_true', help='同时生成提示词')
+    parser.add_argument('--output', help='JSONL输出文件 (默认: 标准输出)')
+    args = parser.parse_args()
+
+    with open(args.inputs, encoding='utf-8') as file:
+        inputs = [json.loads(line) for line in file if line.strip()]
+    weathers = [item.get("weather", item) for item in inputs]
+
+    start = time.perf_counter()
+    records = to_records(map_weather_dicts(weathers))
+    if args.prompt:
+        for item, weather, record in zip(inputs, weathers, records):
+            record["prompt"] = build_prompt(record, weather, item.get("preferences"))
+    elapsed = time.perf_counter() - start
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for item, record in zip(inputs, records):
+            output.write(json.dumps(dict(item, music=record), ensure_ascii=False) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    per_item = elapsed / len(records) * 1e6 if records else 0.0
+    print(f"映射完成: {len(records)} 个位置, 耗时 {elapsed * 1000:.1f}毫秒 (每个 {per_item:.1f}微秒)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
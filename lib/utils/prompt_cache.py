@@ -0,0 +1,177 @@
+# prompt_cache.py - 以量化天气特征为键的 DeepSeek 提示词缓存
+#
+# 天气相近时生成的提示词也几乎相同，因此把温度、天气状况、风速、湿度和时段
+# 量化为区间后与音乐偏好和城市一起作为键，命中时直接跳过 LLM 调用。
+# 温度区间和天气状况分组与 lib/models/weather_service.dart 保持一致。
+
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 5000
+
+
+def temperature_band(celsius):
+    if celsius >= 30:
+        return "hot"
+    if celsius >= 20:
+        return "warm"
+    if celsius >= 10:
+        return "cool"
+    if celsius >= 0:
+        return "cold"
+    return "freezing"
+
+
+def condition_group(description, code=None):
+    """把 OpenWeather 状况代码 (优先) 或描述文字归为几类"""
+    if code is not None:
+        code = int(code)
+        if code == 800:
+            return "clear"
+        if code > 800:
+            return "clouds"
+        return {2: "storm", 3: "rain", 5: "rain", 6: "snow", 7: "fog"}.get(code // 100, "other")
+
+    condition = (description or "").lower()
+    for keyword, group in (("clear", "clear"), ("cloud", "clouds"), ("rain", "rain"), ("drizzle", "rain"),
+                           ("snow", "snow"), ("fog", "fog"), ("mist", "fog"), ("storm", "storm"),
+                           ("wind", "storm")):
+        if keyword in condition:
+            return group
+    return "other"
+
+
+def wind_band(speed_ms):
+    if speed_ms < 1.5:
+        return "calm"
+    if speed_ms < 5.5:
+        return "breeze"
+    if speed_ms < 10.8:
+        return "windy"
+    return "gale"
+
+
+def humidity_band(percent):
+    if percent < 40:
+        return "dry"
+    if percent < 70:
+        return "moderate"
+    return "humid"
+
+
+def day_period(hour):
+    if 5 <= hour < 12:
+        return "morning"
+    if 12 <= hour < 17:
+        return "midday"
+    if 17 <= hour < 21:
+        return "evening"
+    return "night"
+
+
+def local_hour(weather):
+    """返回天气所在地的当地小时
+
+    优先使用显式的 hour；其次是 OpenWeather 的 dt (UTC秒) 加 timezone (偏移秒)，
+    或 WeatherAPI 的 localtime ("YYYY-MM-DD HH:MM")；都没有时才退回服务器时钟。
+    """
+    if weather.get("hour") is not None:
+        return int(weather["hour"])
+    if weather.get("dt") is not None:
+        seconds = int(weather["dt"]) + int(weather.get("timezone") or 0)
+        return datetime.fromtimestamp(seconds, timezone.utc).hour
+    if weather.get("localtime"):
+        try:
+            return datetime.strptime(weather["localtime"], "%Y-%m-%d %H:%M").hour
+        except ValueError:
+            pass
+    return datetime.now().hour
+
+
+def weather_features(weather):
+    """把天气字典量化为特征元组 (温度, 状况, 风, 湿度, 时段)
+
+    weather 使用与 build_music_messages 相同的字段，可选 condition_code，
+    时段取自 hour、dt + timezone 或 localtime (见 local_hour)。
+    """
+    return (
+        temperature_band(weather["temperature"]),
+        condition_group(weather.get("description"), weather.get("condition_code")),
+        wind_band(weather["wind_speed"]),
+        humidity_band(weather["humidity"]),
+        day_period(local_hour(weather)),
+    )
+
+
+def cache_key(weather, preferences=None):
+    """缓存键：量化的天气特征 + 音乐偏好 + 城市
+
+    build_music_messages 会把城市写进提示词 (生成的提示词可能提到城市名)，
+    因此键中包含规范化的城市名，一个城市的提示词不会被另一个城市复用。
+    """
+    preferences = preferences or {}
+    prefs = tuple((preferences.get(name) or "").strip().lower() for name in ("vibe", "genre"))
+    city = " ".join(str(weather.get("city") or "").lower().split())
+    return "|".join(weather_features(weather) + prefs + (city,))
+
+
+class PromptCache:
+    """SQLite 持久化的提示词缓存，带TTL和条目数上限 (按最近访问淘汰)"""
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS prompts ("
+            "key TEXT PRIMARY KEY, prompt TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS prompts_accessed ON prompts (accessed)")
+        self._db.commit()
+
+    def get(self, weather, preferences=None):
+        """命中且未过期时返回缓存的提示词，否则返回 None"""
+        key = cache_key(weather, preferences)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT prompt, created FROM prompts WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] >= self.ttl:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE prompts SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, weather, preferences, prompt):
+        key = cache_key(weather, preferences)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO prompts (key, prompt, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, prompt, now, now),
+            )
+            self._db.execute("DELETE FROM prompts WHERE created <= ?", (now - self.ttl,))
+            cursor = self._db.execute(
+                "DELETE FROM prompts WHERE key IN ("
+                "SELECT key FROM prompts ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.evictions += max(cursor.rowcount, 0)
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM prompts").fetchone()[0]
+            return {"entries": entries, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+# api_metrics.py - 外部API调用的统一埋点：分阶段耗时、状态码、字节数和重试次数
+#
+# InstrumentedSession 是 requests.Session 的替代品，底层 urllib3 连接会记录
+# DNS、TCP连接、TLS握手、首字节 (TTFB) 和响应体传输各阶段的耗时。
+# 每次调用形成一个 span，可追加写入JSONL追踪文件，聚合后导出为Prometheus文本格式:
+#   metrics = ApiMetrics(trace_path="trace.jsonl", prometheus_path="api.prom")
+#   session = metrics.session(pool_maxsize=8)
+#   session.get("https://api.openweathermap.org/data/2.5/weather?...")
+#   metrics.print_summary()
+#   metrics.close()
+
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+
+# 主机名 -> 上游名称，未列出的主机 (例如本地模拟服务器) 直接使用 host:port
+UPSTREAMS = {
+    "api.openweathermap.org": "openweather",
+    "api.weatherapi.com": "weatherapi",
+    "maps.googleapis.com": "google_maps",
+    "www.google.com": "google",
+    "api.deepseek.com": "deepseek",
+    "api.stability.ai": "stability",
+}
+
+PHASES = ("dns", "connect", "tls", "ttfb", "body")
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_local = threading.local()  # 当前线程正在进行的 span，连接对象把阶段耗时写入其中
+
+
+def upstream_name(url):
+    """把URL映射为上游名称"""
+    parts = urlsplit(url)
+    if parts.hostname in UPSTREAMS:
+        return UPSTREAMS[parts.hostname]
+    return parts.netloc or "unknown"
+
+
+def _active_span():
+    return getattr(_local, "span", None)
+
+
+def _add(span, phase, seconds):
+    # 重定向或urllib3重试时同一阶段可能出现多次，累加
+    span[phase] = span.get(phase, 0.0) + seconds
+
+
+class _TimingMixin:
+    """记录DNS、连接、TTFB耗时的urllib3连接"""
+
+    def _new_conn(self):
+        span = _active_span()
+        if span is None:
+            return super()._new_conn()
+
+        host = self._dns_host
+        start = time.perf_counter()
+        try:
+            infos = socket.getaddrinfo(host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except socket.gaierror:
+            _add(span, "dns", time.perf_counter() - start)
+            return super()._new_conn()  # 交给urllib3抛出 NameResolutionError
+        resolved = time.perf_counter()
+        _add(span, "dns", resolved - start)
+
+        # 与 urllib3 的 create_connection 一样按解析顺序逐个尝试所有地址 (IPv6/IPv4、多条A记录)，
+        # 只是把已解析的地址交给它，避免重复解析
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        try:
+            for index, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    sock = super()._new_conn()
+                    break
+                except (NewConnectionError, ConnectTimeoutError):
+                    if index == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = host
+        _add(span, "connect", time.perf_counter() - resolved)
+        span["connections"] = span.get("connections", 0) + 1
+        return sock
+
+    def request(self, *args, **kwargs):
+        super().request(*args, **kwargs)
+        self._sent_at = time.perf_counter()
+
+    def getresponse(self):
+        response = super().getresponse()
+        span = _active_span()
+        if span is not None:
+            now = time.perf_counter()
+            _add(span, "ttfb", now - getattr(self, "_sent_at", now))
+            span["_headers_at"] = now
+        return response
+
+
+class InstrumentedHTTPConnection(_TimingMixin, HTTPConnection):
+    pass
+
+
+class InstrumentedHTTPSConnection(_TimingMixin, HTTPSConnection):
+
+    def connect(self):
+        span = _active_span()
+        if span is None:
+            return super().connect()
+        before = span.get("dns", 0.0) + span.get("connect", 0.0)
+        start = time.perf_counter()
+        super().connect()
+        elapsed = time.perf_counter() - start
+        # connect() 包含 _new_conn 的DNS和TCP时间，剩下的就是TLS握手
+        _add(span, "tls", max(elapsed - (span.get("dns", 0.0) + span.get("connect", 0.0) - before), 0.0))
+
+
+class InstrumentedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = InstrumentedHTTPConnection
+
+
+class InstrumentedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = InstrumentedHTTPSConnection
+
+
+class InstrumentedAdapter(HTTPAdapter):
+    """使用带计时连接的连接池"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": InstrumentedHTTPConnectionPool,
+            "https": InstrumentedHTTPSConnectionPool,
+        }
+
+
+class InstrumentedSession(requests.Session):
+    """每次请求生成一个 span 并交给 ApiMetrics 记录
+
+    stream=True 的响应在读完响应体或关闭时才记录，此时才知道传输耗时和字节数。
+    """
+
+    def __init__(self, metrics, pool_connections=10, pool_maxsize=10, max_retries=0):
+        super().__init__()
+        self.metrics = metrics
+        adapter = InstrumentedAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                      max_retries=max_retries)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        span = self.metrics.start_span(method, url)
+        previous = _active_span()
+        _local.span = span
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except Exception as err:
+            span["error"] = type(err).__name__
+            self.metrics.finish(span)
+            raise
+        finally:
+            _local.span = previous
+
+        span["status"] = response.status_code
+        retries = getattr(response.raw, "retries", None)
+        span["retries"] = len(retries.history) if retries is not None else 0
+        if kwargs.get("stream"):
+            self._track_stream(response, span)
+        else:
+            span["bytes"] = len(response.content)
+            self.metrics.finish(span)
+        return response
+
+    def _track_stream(self, response, span):
+        iter_content = response.iter_content
+        close = response.close
+
+        def tracked(*args, **kwargs):
+            try:
+                for chunk in iter_content(*args, **kwargs):
+                    span["bytes"] = span.get("bytes", 0) + len(chunk)
+                    yield chunk
+            finally:
+                self.metrics.finish(span)
+
+        def closing():
+            close()
+            self.metrics.finish(span)
+
+        response.iter_content = tracked
+        response.close = closing
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class ApiMetrics:
+    """汇总所有外部调用的 span，导出Prometheus文本和JSONL追踪"""
+
+    def __init__(self, trace_path=None, prometheus_path=None):
+        self.prometheus_path = prometheus_path
+        self._lock = threading.Lock()
+        self._requests = Counter()  # (上游, 端点, 方法, 状态) -> 次数
+        self._durations = {}  # (上游, 端点) -> [各桶计数..., 总和, 次数]
+        self._phases = defaultdict(lambda: [0.0, 0])  # (上游, 阶段) -> [总和, 次数]
+        self._bytes = Counter()
+        self._retries = Counter()
+        self._totals = defaultdict(lambda: deque(maxlen=10000))  # 上游 -> 最近的总耗时，用于摘要分位数
+        self._extra = {}  # (名称, 标签元组) -> 值，其他模块 (例如断路器) 上报的指标
+        self._extra_types = {}  # 名称 -> (类型, 说明)
+        self._trace = open(trace_path, 'a', encoding='utf-8') if trace_path else None
+
+    def session(self, pool_connections=10, pool_maxsize=10, max_retries=0):
+        return InstrumentedSession(self, pool_connections, pool_maxsize, max_retries)
+
+    def start_span(self, method, url, upstream=None, endpoint=None):
+        parts = urlsplit(url)
+        return {
+            "trace_id": uuid.uuid4().hex[:16],
+            "upstream": upstream or upstream_name(url),
+            "endpoint": endpoint or parts.path or "/",  # 不记录查询参数，其中常含API密钥
+            "method": method.upper(),
+            "timestamp": round(time.time(), 3),
+            "_start": time.perf_counter(),
+        }
+
+    def finish(self, span):
+        """结束 span 并记录；重复调用只记录一次"""
+        end = time.perf_counter()
+        with self._lock:
+            if span.get("_finished"):
+                return
+            span["_finished"] = True
+        headers_at = span.get("_headers_at")
+        if headers_at is not None:
+            _add(span, "body", end - headers_at)
+        span["total"] = end - span["_start"]
+        self.record({key: value for key, value in span.items() if not key.startswith("_")})
+
+    @contextmanager
+    def span(self, upstream, endpoint, method="POST"):
+        """为不经过 requests 的调用 (例如 DeepSeek 的 openai SDK) 记录总耗时"""
+        span = self.start_span(method, "", upstream, endpoint)
+        try:
+            yield span
+            span.setdefault("status", 200)
+        except Exception as err:
+            span["error"] = type(err).__name__
+            span.setdefault("status", getattr(err, "status_code", None))
+            raise
+        finally:
+            self.finish(span)
+
+    def count_retry(self, upstream, count=1):
+        """记录应用层的重试 (例如任务队列的退避重试)"""
+        with self._lock:
+            self._retries[upstream] += count
+
+    def set_gauge(self, name, value, help_text="", **labels):
+        """设置一个自定义 gauge 的当前值"""
+        with self._lock:
+            self._extra_types.setdefault(name, ("gauge", help_text))
+            self._extra[(name, tuple(sorted(labels.items())))] = value
+
+    def inc_counter(self, name, amount=1, help_text="", **labels):
+        """累加一个自定义 counter"""
+        with self._lock:
+            self._extra_types.setdefault(name, ("counter", help_text))
+            key = (name, tuple(sorted(labels.items())))
+            self._extra[key] = self._extra.get(key, 0) + amount
+
+    def record(self, span):
+        upstream, endpoint = span["upstream"], span["endpoint"]
+        status = span.get("status") or "error"
+        with self._lock:
+            self._requests[(upstream, endpoint, span["method"], status)] += 1
+            histogram = self._durations.setdefault((upstream, endpoint), [0] * len(DURATION_BUCKETS) + [0.0, 0])
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if span["total"] <= bound:
+                    histogram[index] += 1
+            histogram[-2] += span["total"]
+            histogram[-1] += 1
+            for phase in PHASES:
+                if phase in span:
+                    self._phases[(upstream, phase)][0] += span[phase]
+                    self._phases[(upstream, phase)][1] += 1
+            self._bytes[upstream] += span.get("bytes", 0)
+            self._retries[upstream] += span.get("retries", 0)
+            self._totals[upstream].append(span["total"])
+            if self._trace is not None:
+                rounded = {key: round(value, 6) if isinstance(value, float) else value for key, value in span.items()}
+                self._trace.write(json.dumps(rounded, ensure_ascii=False) + "\n")
+                self._trace.flush()
+
+    def to_prometheus(self):
+        """返回Prometheus文本格式的指标"""
+        lines = []
+        with self._lock:
+            lines += ["# HELP api_requests_total Outbound API requests by upstream, endpoint, method and status.",
+                      "# TYPE api_requests_total counter"]
+            for (upstream, endpoint, method, status), count in sorted(self._requests.items(), key=str):
+                lines.append(f"api_requests_total{_labels(upstream=upstream, endpoint=endpoint, method=method, status=status)} {count}")
+
+            lines += ["# HELP api_request_duration_seconds Outbound API request duration.",
+                      "# TYPE api_request_duration_seconds histogram"]
+            for (upstream, endpoint), histogram in sorted(self._durations.items()):
+                for bound, count in zip(DURATION_BUCKETS, histogram):
+                    lines.append(f"api_request_duration_seconds_bucket{_labels(upstream=upstream, endpoint=endpoint, le=bound)} {count}")
+                lines.append(f"api_request_duration_seconds_bucket{_labels(upstream=upstream, endpoint=endpoint, le='+Inf')} {histogram[-1]}")
+                lines.append(f"api_request_duration_seconds_sum{_labels(upstream=upstream, endpoint=endpoint)} {histogram[-2]:.6f}")
+                lines.append(f"api_request_duration_seconds_count{_labels(upstream=upstream, endpoint=endpoint)} {histogram[-1]}")
+
+            lines += ["# HELP api_request_phase_seconds Time spent in each request phase (dns, connect, tls, ttfb, body).",
+                      "# TYPE api_request_phase_seconds summary"]
+            for (upstream, phase), (total, count) in sorted(self._phases.items()):
+                lines.append(f"api_request_phase_seconds_sum{_labels(upstream=upstream, phase=phase)} {total:.6f}")
+                lines.append(f"api_request_phase_seconds_count{_labels(upstream=upstream, phase=phase)} {count}")
+
+            lines += ["# HELP api_response_bytes_total Response body bytes received.",
+                      "# TYPE api_response_bytes_total counter"]
+            lines += [f"api_response_bytes_total{_labels(upstream=upstream)} {count}"
+                      for upstream, count in sorted(self._bytes.items())]
+
+            lines += ["# HELP api_retries_total Retries at the transport or application level.",
+                      "# TYPE api_retries_total counter"]
+            lines += [f"api_retries_total{_labels(upstream=upstream)} {count}"
+                      for upstream, count in sorted(self._retries.items())]
+
+            for name, (kind, help_text) in sorted(self._extra_types.items()):
+                lines += [f"# HELP {name} {help_text or name}", f"# TYPE {name} {kind}"]
+                lines += [f"{name}{_labels(**dict(labels))} {value}"
+                          for (metric, labels), value in sorted(self._extra.items(), key=str) if metric == name]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """原子地写入文本文件 (可供 node_exporter 的 textfile collector 读取)"""
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(self.to_prometheus())
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+
+    def summary(self):
+        """按上游汇总: 调用数、错误数、总耗时占比、分位数和各阶段平均耗时 (毫秒)"""
+        with self._lock:
+            calls, errors = Counter(), Counter()
+            for (upstream, _, _, status), count in self._requests.items():
+                calls[upstream] += count
+                if status == "error" or int(status) >= 400:
+                    errors[upstream] += count
+            grand_total = sum(sum(totals) for totals in self._totals.values()) or 1.0
+            result = {}
+            for upstream, totals in self._totals.items():
+                ordered = sorted(totals)
+                result[upstream] = {
+                    "calls": calls[upstream],
+                    "errors": errors[upstream],
+                    "share": round(sum(ordered) / grand_total, 3),
+                    "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1),
+                    "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+                    "bytes": self._bytes[upstream],
+                    "retries": self._retries[upstream],
+                }
+                for phase in PHASES:
+                    total, count = self._phases.get((upstream, phase), (0.0, 0))
+                    result[upstream][f"{phase}_ms"] = round(total / count * 1000, 1) if count else None
+            return dict(sorted(result.items(), key=lambda item: -item[1]["share"]))
+
+    def print_summary(self, file=sys.stderr):
+        summary = self.summary()
+        if not summary:
+            return
+        print("外部调用耗时 (按总耗时占比排序):", file=file)
+        for upstream, row in summary.items():
+            phases = "  ".join(f"{phase} {row[f'{phase}_ms']}" for phase in PHASES if row[f"{phase}_ms"] is not None)
+            print(f"  {upstream:<22} {row['calls']:>5} 次  错误 {row['errors']:<3} 占比 {row['share']:>6.1%}  "
+                  f"p50 {row['p50_ms']} ms  p95 {row['p95_ms']} ms  重试 {row['retries']}  [{phases}]", file=file)
+
+    def close(self):
+        if self.prometheus_path:
+            self.write_prometheus(self.prometheus_path)
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+
+
+def start_metrics_server(metrics, port, host="127.0.0.1"):
+    """在后台线程提供 /metrics 端点，供Prometheus抓取长时间运行的进程"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            payload = metrics.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    """为脚本添加统一的埋点参数"""
+    parser.add_argument('--trace-file', help='把每次外部API调用的分阶段耗时追加到JSONL文件')
+    parser.add_argument('--prometheus-file', help='结束时把聚合指标写成Prometheus文本格式')
+
+
+def from_args(args):
+    """根据命令行参数创建 ApiMetrics，未启用时返回 None"""
+    if not (args.trace_file or args.prometheus_file):
+        return None
+    return ApiMetrics(args.trace_file, args.prometheus_file)
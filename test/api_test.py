@@ -1,4 +1,6 @@
-import requests
+import argparse
+import os
+from weather_models import CurrentWeather, loads
 
 # 你的 WeatherAPI API Key
 API_KEY = "39b7c09931b445c9a9d190003242712"
@@ -6,36 +8,73 @@ API_KEY = "39b7c09931b445c9a9d190003242712"
 # 你想查询的城市
 CITY = "Syndey"
 
-# WeatherAPI 的请求 URL
-URL = f"http://api.weatherapi.com/v1/current.json?key={API_KEY}&q={CITY}&aqi=yes"
+# WeatherAPI 的基础URL，可通过环境变量或 --base-url 指向本地模拟服务器
+BASE_URL = os.environ.get("WEATHERAPI_BASE_URL", "http://api.weatherapi.com")
 
-def fetch_weather():
+def fetch_weather(city=CITY, base_url=BASE_URL, session=None):
+    """查询并打印当前天气，返回 weather_models.CurrentWeather (失败时返回 None)"""
+    if session is None:
+        import requests  # 只在真正发请求时导入，导入本模块的脚本不需要为此付出启动时间
+        session = requests
+    # WeatherAPI 的请求 URL
+    url = f"{base_url}/v1/current.json?key={API_KEY}&q={city}&aqi=yes"
     try:
-        response = requests.get(URL)
-        data = response.json()
+        response = session.get(url)
+        data = loads(response.content)
 
         if "error" in data:
             print("❌ Error:", data["error"]["message"])
-            return
+            return None
 
         # 提取天气信息
-        location = data["location"]["name"]
-        temp_c = data["current"]["temp_c"]
-        wind_kph = data["current"]["wind_kph"]
-        humidity = data["current"]["humidity"]
-        co2 = data["current"]["air_quality"]["co"] if "air_quality" in data["current"] else "N/A"
-        condition = data["current"]["condition"]["text"]
+        weather = CurrentWeather.from_weatherapi(data)
+        co2 = weather.co if weather.co is not None else "N/A"
 
         # 输出天气数据
-        print(f"🌍 Weather in {location}:")
-        print(f"🌡️ Temperature: {temp_c}°C")
-        print(f"💨 Wind Speed: {wind_kph} km/h")
-        print(f"💧 Humidity: {humidity}%")
+        print(f"🌍 Weather in {weather.location.name}:")
+        print(f"🌡️ Temperature: {weather.temp}°C")
+        print(f"💨 Wind Speed: {weather.wind_kph} km/h")
+        print(f"💧 Humidity: {weather.humidity}%")
         print(f"🌫️ CO₂ Concentration: {co2} ppm")
-        print(f"☁️ Condition: {condition}")
+        print(f"☁️ Condition: {weather.condition}")
+        return weather
 
     except Exception as e:
         print("❌ Failed to fetch weather data:", str(e))
+        return None
 
 # 运行测试
-fetch_weather()
+if __name__ == "__main__":
+    import requests
+    import api_metrics
+
+    parser = argparse.ArgumentParser(description='测试 WeatherAPI 当前天气')
+    parser.add_argument('--city', default=CITY, help=f'查询的城市 (默认: {CITY})')
+    parser.add_argument('--base-url', default=BASE_URL, help='WeatherAPI 基础URL (例如本地模拟服务器)')
+    parser.add_argument('--geocode-index', help='地名索引SQLite文件，先把城市名 (可含拼写错误) 解析为坐标')
+    parser.add_argument('--maps-key', default=os.environ.get("GOOGLE_MAPS_API_KEY", ""),
+                        help='索引未命中时用于Geocoding API的Google Maps密钥')
+    api_metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    metrics = api_metrics.from_args(args)
+    session = metrics.session(1, 1) if metrics is not None else None
+    city = args.city
+    if args.geocode_index:
+        from geocode_index import GeocodeIndex
+
+        index = GeocodeIndex(args.geocode_index, args.maps_key, session or requests.Session())
+        try:
+            place = index.geocode(city)
+        except requests.exceptions.RequestException as e:
+            print("⚠️ Geocoding failed, using the raw city name:", str(e))
+            place = None
+        finally:
+            index.close()
+        if place is not None:
+            print(f"📍 {city} → {place['display_name']} ({place['lat']:.4f}, {place['lon']:.4f}) [{place['match']}]")
+            city = f"{place['lat']},{place['lon']}"
+    fetch_weather(city, args.base_url.rstrip('/'), session)
+    if metrics is not None:
+        metrics.print_summary()
+        metrics.close()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# audio_analysis.py - 音频下载后的后处理：响度归一化增益和可视化数据预计算
+#
+# 用 ffmpeg 子进程把 mp3/wav 解码为 float32 PCM，然后用NumPy计算：
+#   - 积分响度 (ITU-R BS.1770 的K加权和门限，K加权在频域近似) 和归一化到目标响度的增益
+#   - 按帧降采样的波形峰值 (int8，每帧最小/最大值)
+#   - 按帧的对数频带包络 (uint8，相对整首曲目的最大值，60 dB 动态范围)
+# 结果保存为音轨旁边的 <名称>.visual.npz，20秒音轨只有几KB，客户端不必在设备上做FFT。
+# 批量处理在进程池中运行:
+#   python audio_analysis.py ./output --workers 4
+#
+# 需要系统安装 ffmpeg (命令行工具)。
+
+import argparse
+import glob
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+SAMPLE_RATE = 44100
+TARGET_LUFS = -14.0  # 主流流媒体平台的响度目标
+PEAK_CEILING_DB = -1.0  # 增益后的采样峰值上限 (dBFS)
+FPS = 30  # 可视化帧率
+BANDS = 8
+BAND_RANGE = (40.0, 16000.0)  # Hz
+N_FFT = 2048
+BAND_FLOOR_DB = 60.0
+ANALYSIS_SUFFIX = ".visual.npz"
+
+BLOCK_SECONDS = 0.4  # BS.1770 门限块长度
+BLOCK_OVERLAP = 0.75
+BLOCK_CHUNK = 32  # 每次做FFT的门限块数，限制峰值内存 (与曲目长度无关)
+ABSOLUTE_GATE = -70.0  # LUFS
+RELATIVE_GATE = -10.0  # LU
+
+
+def decode_audio(path, sample_rate=SAMPLE_RATE, channels=2, ffmpeg="ffmpeg"):
+    """用 ffmpeg 把音频解码为 (采样数, 声道数) 的 float32 数组"""
+    command = [ffmpeg, "-nostdin", "-v", "error", "-i", path, "-f", "f32le", "-acodec", "pcm_f32le",
+               "-ac", str(channels), "-ar", str(sample_rate), "-"]
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    except FileNotFoundError:
+        raise RuntimeError("找不到 ffmpeg，请先安装 ffmpeg 并确保其在 PATH 中") from None
+    except subprocess.CalledProcessError as err:
+        raise RuntimeError(f"ffmpeg 解码失败: {err.stderr.decode('utf-8', 'replace').strip()[:500]}") from None
+    return np.frombuffer(result.stdout, dtype="<f4").reshape(-1, channels)
+
+
+def _biquad_response(b, a, frequencies, sample_rate):
+    """双二阶滤波器在给定频率处的功率响应 |H|^2"""
+    z = np.exp(-1j * 2 * np.pi * frequencies / sample_rate)
+    response = (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+    return np.abs(response) ** 2
+
+
+def k_weighting(frequencies, sample_rate):
+    """BS.1770 K加权 (高架滤波 + 高通) 的功率响应，系数按采样率重新计算"""
+    gain, q, fc = 4.0, 1 / np.sqrt(2), 1500.0
+    amplitude = 10 ** (gain / 40)
+    w0 = 2 * np.pi * fc / sample_rate
+    alpha = np.sin(w0) / (2 * q)
+    cos, root = np.cos(w0), 2 * np.sqrt(amplitude) * alpha
+    shelf = _biquad_response(
+        (amplitude * ((amplitude + 1) + (amplitude - 1) * cos + root),
+         -2 * amplitude * ((amplitude - 1) + (amplitude + 1) * cos),
+         amplitude * ((amplitude + 1) + (amplitude - 1) * cos - root)),
+        ((amplitude + 1) - (amplitude - 1) * cos + root,
+         2 * ((amplitude - 1) - (amplitude + 1) * cos),
+         (amplitude + 1) - (amplitude - 1) * cos - root),
+        frequencies, sample_rate,
+    )
+    q, fc = 0.5, 38.0
+    w0 = 2 * np.pi * fc / sample_rate
+    alpha, cos = np.sin(w0) / (2 * q), np.cos(w0)
+    highpass = _biquad_response(((1 + cos) / 2, -(1 + cos), (1 + cos) / 2), (1 + alpha, -2 * cos, 1 - alpha),
+                                frequencies, sample_rate)
+    return shelf * highpass
+
+
+def integrated_loudness(samples, sample_rate=SAMPLE_RATE):
+    """积分响度 (LUFS)；静音或过短的音频返回 -inf"""
+    block = int(round(BLOCK_SECONDS * sample_rate))
+    hop = int(round(block * (1 - BLOCK_OVERLAP)))
+    if len(samples) < block:
+        return float("-inf")
+    # (块数, 声道数, 块长度) 的视图，不复制数据；按 BLOCK_CHUNK 块分批做FFT，
+    # 避免一次性为所有重叠块分配频谱 (3分钟立体声曲目会超过1GB)
+    blocks = np.lib.stride_tricks.sliding_window_view(samples, block, axis=0)[::hop]
+    weights = k_weighting(np.fft.rfftfreq(block, 1 / sample_rate), sample_rate)
+    weights[1:-1] *= 2  # 单边谱：除直流和奈奎斯特外能量加倍
+    energy = np.empty(len(blocks))
+    for start in range(0, len(blocks), BLOCK_CHUNK):
+        power = np.abs(np.fft.rfft(blocks[start:start + BLOCK_CHUNK], axis=-1)) ** 2
+        mean_square = power @ weights / block ** 2  # Parseval
+        energy[start:start + BLOCK_CHUNK] = mean_square.sum(axis=1)  # 各声道权重均为1 (左/右)
+
+    with np.errstate(divide="ignore"):
+        loudness = -0.691 + 10 * np.log10(energy)
+    gated = energy[loudness > ABSOLUTE_GATE]
+    if not len(gated):
+        return float("-inf")
+    relative = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE
+    with np.errstate(divide="ignore"):
+        gated = gated[-0.691 + 10 * np.log10(gated) > relative]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def normalisation_gain(loudness, peak, target=TARGET_LUFS, ceiling=PEAK_CEILING_DB):
+    """达到目标响度所需的增益 (dB)，并限制增益后峰值不超过 ceiling"""
+    if not np.isfinite(loudness) or peak <= 0:
+        return 0.0
+    gain = target - loudness
+    return float(min(gain, ceiling - 20 * np.log10(peak)))
+
+
+def waveform_peaks(mono, hop):
+    """每帧的 (最小值, 最大值)，量化为 int8，形状 (帧数, 2)"""
+    frames = len(mono) // hop
+    framed = mono[:frames * hop].reshape(frames, hop)
+    peaks = np.stack((framed.min(axis=1), framed.max(axis=1)), axis=1)
+    return np.clip(np.rint(peaks * 127), -127, 127).astype(np.int8)
+
+
+def band_edges(sample_rate=SAMPLE_RATE, bands=BANDS):
+    low, high = BAND_RANGE
+    return np.geomspace(low, min(high, sample_rate / 2), bands + 1)
+
+
+def band_envelopes(mono, hop, sample_rate=SAMPLE_RATE, bands=BANDS, n_fft=N_FFT):
+    """每帧各对数频带的能量包络，量化为 uint8，形状 (帧数, 频带数)"""
+    frames = len(mono) // hop
+    if frames == 0:
+        return np.zeros((0, bands), dtype=np.uint8)
+    # 帧居中于 hop 的起点，两端补零
+    padded = np.pad(mono, (n_fft // 2, n_fft // 2))
+    windows = np.lib.stride_tricks.sliding_window_view(padded, n_fft)[::hop][:frames]
+    power = np.abs(np.fft.rfft(windows * np.hanning(n_fft).astype(np.float32), axis=1)) ** 2
+
+    frequencies = np.fft.rfftfreq(n_fft, 1 / sample_rate)
+    edges = band_edges(sample_rate, bands)
+    index = np.digitize(frequencies, edges) - 1
+    mask = np.zeros((len(frequencies), bands), dtype=np.float32)
+    valid = (index >= 0) & (index < bands)
+    mask[np.flatnonzero(valid), index[valid]] = 1.0
+    mask /= np.maximum(mask.sum(axis=0), 1.0)  # 每个频带取平均，避免高频带因为频点多而偏大
+
+    with np.errstate(divide="ignore"):
+        decibels = 10 * np.log10(power @ mask + 1e-12)
+    scaled = (decibels - decibels.max() + BAND_FLOOR_DB) / BAND_FLOOR_DB
+    return np.rint(np.clip(scaled, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+def analysis_path(path):
+    return os.path.splitext(path)[0] + ANALYSIS_SUFFIX
+
+
+def analyse_samples(samples, sample_rate=SAMPLE_RATE, fps=FPS, bands=BANDS, target=TARGET_LUFS):
+    """分析已解码的 (采样数, 声道数) 数组，返回要保存的数组字典"""
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.ndim == 1:
+        samples = samples[:, np.newaxis]
+    mono = samples.mean(axis=1)
+    hop = max(int(round(sample_rate / fps)), 1)
+    loudness = integrated_loudness(samples, sample_rate)
+    peak = float(np.abs(samples).max()) if len(samples) else 0.0
+    return {
+        "peaks": waveform_peaks(mono, hop),
+        "bands": band_envelopes(mono, hop, sample_rate, bands),
+        "band_edges": band_edges(sample_rate, bands).astype(np.float32),
+        "fps": np.float32(sample_rate / hop),
+        "duration": np.float32(len(samples) / sample_rate),
+        "loudness": np.float32(loudness),
+        "peak_db": np.float32(20 * np.log10(peak) if peak > 0 else -np.inf),
+        "gain_db": np.float32(normalisation_gain(loudness, peak, target)),
+        "target_lufs": np.float32(target),
+    }
+
+
+def save_analysis(result, path):
+    """原子写入 .npz (先写临时文件再替换)"""
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **result)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(buffer.getvalue())
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return buffer.tell()
+
+
+def load_analysis(path):
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def analyse_track(path, fps=FPS, bands=BANDS, target=TARGET_LUFS, force=False, ffmpeg="ffmpeg"):
+    """解码并分析一个音轨，结果写到音轨旁边；返回摘要字典
+
+    已有比音轨更新的分析文件且 force=False 时跳过。在进程池的工作进程中调用。
+    """
+    output = analysis_path(path)
+    if not force and os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(path):
+        return {"path": path, "output": output, "skipped": True}
+
+    start = time.perf_counter()
+    result = analyse_samples(decode_audio(path, SAMPLE_RATE, 2, ffmpeg), SAMPLE_RATE, fps, bands, target)
+    size = save_analysis(result, output)
+    return {
+        "path": path,
+        "output": output,
+        "duration": round(float(result["duration"]), 2),
+        "loudness": round(float(result["loudness"]), 2),
+        "peak_db": round(float(result["peak_db"]), 2),
+        "gain_db": round(float(result["gain_db"]), 2),
+        "frames": len(result["peaks"]),
+        "bytes": size,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def analyse_batch(paths, workers=None, **options):
+    """在进程池中分析多个音轨，按完成顺序生成摘要 (失败的带 error 字段)"""
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(analyse_track, path, **options): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as err:
+                yield {"path": futures[future], "error": str(err)}
+
+
+def expand_paths(inputs, pattern="*.mp3"):
+    """文件原样保留，目录展开为其中匹配 pattern 的文件"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(glob.glob(os.path.join(item, pattern))))
+        else:
+            paths.append(item)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='计算响度归一化增益并预计算波形和频带包络')
+    parser.add_argument('inputs', nargs='+', help='音频文件或目录')
+    parser.add_argument('--pattern', default='*.mp3', help='目录中要处理的文件模式 (默认: *.mp3)')
+    parser.add_argument('--workers', type=int, help='进程数 (默认: CPU核数)')
+    parser.add_argument('--fps', type=float, default=FPS, help=f'可视化帧率 (默认: {FPS})')
+    parser.add_argument('--bands', type=int, default=BANDS, help=f'频带数 (默认: {BANDS})')
+    parser.add_argument('--target-lufs', type=float, default=TARGET_LUFS, help=f'目标响度 (默认: {TARGET_LUFS} LUFS)')
+    parser.add_argument('--force', action='store_true', help='重新分析已有结果的音轨')
+    parser.add_argument('--ffmpeg', default='ffmpeg', help='ffmpeg 可执行文件路径')
+    args = parser.parse_args()
+
+    paths = expand_paths(args.inputs, args.pattern)
+    start = time.perf_counter()
+    failed = 0
+    for summary in analyse_batch(paths, args.workers, fps=args.fps, bands=args.bands, target=args.target_lufs,
+                                 force=args.force, ffmpeg=args.ffmpeg):
+        failed += "error" in summary
+        print(json.dumps(summary, ensure_ascii=False), flush=True)
+    print(f"分析完成: {len(paths)} 个音轨, {failed} 个失败, 耗时 {time.perf_counter() - start:.1f}秒", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
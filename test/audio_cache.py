@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# audio_cache.py - 内容寻址的音频缓存：相同请求直接返回已生成的文件
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1 GB
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """按块计算文件的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+FICLONE = 0x40049409  # Linux ioctl: 在同一文件系统上创建共享数据块的写时复制副本 (reflink)
+
+
+def clone_or_copy(src, dst):
+    """优先使用 reflink (btrfs/XFS 等，不额外占用空间)，不支持时完整复制
+
+    不使用硬链接：硬链接与缓存文件共享同一个inode，就地修改输出文件会同时破坏缓存
+    和所有恢复出的副本；reflink 在写入时自动分离。
+    """
+    try:
+        import fcntl
+
+        with open(src, 'rb') as source, open(dst, 'wb') as target:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        return
+    except (ImportError, OSError):
+        pass
+    shutil.copyfile(src, dst)
+
+
+class ContentAddressedStore:
+    """按SHA-256去重存储文件的磁盘缓存
+
+    请求键映射到内容哈希，多个键可以指向同一个文件。
+    总大小超过 max_bytes 时按最近访问时间淘汰文件及指向它的键；
+    刚写入的文件和 pinned() 期间正在使用的文件不会被淘汰。
+    """
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        self._pins = Counter()  # sha256 -> 正在使用的次数
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "sha256 TEXT PRIMARY KEY, size INTEGER NOT NULL, suffix TEXT NOT NULL, accessed REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, sha256 TEXT NOT NULL, meta TEXT, created REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS blobs_accessed ON blobs (accessed);"
+            "CREATE INDEX IF NOT EXISTS entries_sha256 ON entries (sha256);"
+        )
+        self._db.commit()
+
+    def blob_path(self, sha256, suffix=""):
+        return os.path.join(self.root, "blobs", sha256[:2], f"{sha256}{suffix}")
+
+    def get(self, key):
+        """返回 (文件路径, 元数据)，未命中时返回 None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT e.sha256, b.suffix, e.meta FROM entries e JOIN blobs b ON b.sha256 = e.sha256 "
+                "WHERE e.key = ?", (key,)
+            ).fetchone()
+            if row is None or not os.path.exists(self.blob_path(row[0], row[1])):
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE blobs SET accessed = ? WHERE sha256 = ?", (time.time(), row[0]))
+            self._db.commit()
+            self.hits += 1
+            return self.blob_path(row[0], row[1]), json.loads(row[2] or "{}")
+
+    def put_file(self, key, src_path, meta=None):
+        """把文件加入缓存 (源文件保持不变)，内容已存在时只新增键映射"""
+        sha256 = file_sha256(src_path)
+        suffix = os.path.splitext(src_path)[1]
+        now = time.time()
+        with self._lock:
+            existing = self._db.execute("SELECT suffix FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if existing is not None and os.path.exists(self.blob_path(sha256, existing[0])):
+                suffix = existing[0]
+            else:
+                blob_path = self.blob_path(sha256, suffix)
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                temp_path = f"{blob_path}.{os.getpid()}.{threading.get_ident()}.part"
+                clone_or_copy(src_path, temp_path)
+                os.replace(temp_path, blob_path)
+            self._db.execute(
+                "INSERT OR REPLACE INTO blobs (sha256, size, suffix, accessed) VALUES (?, ?, ?, ?)",
+                (sha256, os.path.getsize(src_path), suffix, now),
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, sha256, meta, created) VALUES (?, ?, ?, ?)",
+                (key, sha256, json.dumps(meta or {}, ensure_ascii=False), now),
+            )
+            self._db.commit()
+            self._evict(keep=sha256)
+            return self.blob_path(sha256, suffix)
+
+    @contextmanager
+    def pinned(self, path):
+        """with 块内 path 指向的缓存文件不会被淘汰 (例如打开文件准备发送时)"""
+        sha256 = os.path.basename(path)[:64]
+        with self._lock:
+            self._pins[sha256] += 1
+        try:
+            yield path
+        finally:
+            with self._lock:
+                self._pins[sha256] -= 1
+                if self._pins[sha256] <= 0:
+                    del self._pins[sha256]
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            blobs, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            return {
+                "entries": entries,
+                "blobs": blobs,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _evict(self, keep=None):
+        """按最近访问时间淘汰文件，直到总大小不超过上限
+
+        跳过 keep (刚写入的文件) 和被 pinned() 占用的文件；只剩这些文件时允许暂时超出上限。
+        """
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        protected = set(self._pins)
+        protected.add(keep)
+        rows = self._db.execute("SELECT sha256, size, suffix FROM blobs ORDER BY accessed").fetchall()
+        for sha256, size, suffix in rows:
+            if total <= self.max_bytes:
+                break
+            if sha256 in protected:
+                continue
+            self._db.execute("DELETE FROM entries WHERE sha256 = ?", (sha256,))
+            self._db.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+            try:
+                os.unlink(self.blob_path(sha256, suffix))
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+        self._db.commit()
+
+
+def request_key(prompt, duration, steps, output_format, seed=None):
+    """规范化生成参数并计算请求哈希
+
+    提示词去掉首尾空白并合并连续空白。seed 为空或0时API随机选择种子，
+    键中记为 null，与任何固定种子都不同 (AudioCache 不缓存这类请求)。
+    """
+    normalised = {
+        "prompt": " ".join(prompt.split()),
+        "duration": int(duration),
+        "steps": int(steps),
+        "output_format": output_format.lower(),
+        "seed": int(seed) if seed else None,
+    }
+    payload = json.dumps(normalised, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()
+
+
+class AudioCache(ContentAddressedStore):
+    """以生成参数为键的音频缓存
+
+    没有固定种子 (seed 为空或0) 的请求每次都应得到不同的音频，不查也不写缓存。
+    """
+
+    def lookup(self, prompt, duration, steps, output_format, seed=None):
+        """命中时返回缓存文件路径，否则返回 None"""
+        if not seed:
+            return None
+        entry = self.get(request_key(prompt, duration, steps, output_format, seed))
+        return entry[0] if entry is not None else None
+
+    def restore(self, output_path, prompt, duration, steps, output_format, seed=None):
+        """命中时把缓存文件放到 output_path 并返回 True"""
+        cached_path = self.lookup(prompt, duration, steps, output_format, seed)
+        if cached_path is None:
+            return False
+        if os.path.exists(output_path):
+            os.unlink(output_path)
+        clone_or_copy(cached_path, output_path)
+        return True
+
+    def store(self, audio_path, prompt, duration, steps, output_format, seed=None):
+        """加入缓存并返回缓存文件路径；没有固定种子时不缓存，返回 None"""
+        if not seed:
+            return None
+        meta = {"prompt": prompt, "duration": duration, "steps": steps,
+                "output_format": output_format, "seed": seed}
+        return self.put_file(request_key(prompt, duration, steps, output_format, seed), audio_path, meta)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='查看或填充Stability音频缓存')
+    parser.add_argument('cache_dir', help='缓存目录')
+    parser.add_argument('--max-bytes', type=int, default=DEFAULT_MAX_BYTES, help='缓存大小上限 (字节)')
+    parser.add_argument('--add', metavar='AUDIO', help='把已有音频文件加入缓存 (需同时给出 --prompt)')
+    parser.add_argument('--prompt', help='已有音频对应的提示词')
+    parser.add_argument('--duration', type=int, default=20, help='已有音频的时长 (默认: 20)')
+    parser.add_argument('--steps', type=int, default=30, help='已有音频的步数 (默认: 30)')
+    parser.add_argument('--seed', type=int, help='已有音频的种子')
+    args = parser.parse_args()
+
+    cache = AudioCache(args.cache_dir, args.max_bytes)
+    if args.add:
+        if not args.prompt:
+            parser.error('--add 需要同时提供 --prompt')
+        output_format = os.path.splitext(args.add)[1].lstrip('.') or 'mp3'
+        if not args.seed:
+            parser.error('--add 需要同时提供 --seed (没有固定种子的生成结果不缓存)')
+        path = cache.store(args.add, args.prompt, args.duration, args.steps, output_format, args.seed)
+        print(f"已缓存: {path}")
+    print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# benchmark.py - API客户端性能基准：延迟分位数、吞吐量和峰值内存
+#
+# 默认在进程内启动 mock_server 作为替身，结果可保存为JSON并与之前的结果比较:
+#   python benchmark.py --requests 200 --concurrency 16 --output bench.json
+#   python benchmark.py --compare bench.json --threshold 0.15
+
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib", "utils"))
+
+import deepseek_api_test
+import mock_server
+import stability_audio
+import test_googleapi
+import test_weather
+
+SAMPLE_WEATHER = {"description": "light rain", "temperature": 12.4, "humidity": 81, "wind_speed": 4.6, "city": "London"}
+
+
+def percentile(sorted_values, pct):
+    """最近秩法计算分位数"""
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def build_scenarios(base_url, session, workdir):
+    """返回 {名称: 单次调用函数}，每个函数执行一次完整的客户端请求"""
+    test_weather.OPENWEATHER_BASE_URL = base_url
+    test_googleapi.MAPS_BASE_URL = base_url
+    deepseek = deepseek_api_test.create_client("benchmark", base_url)
+    counter = iter(range(sys.maxsize))
+
+    def openweather(endpoint):
+        return lambda: test_weather.request_json(endpoint, "benchmark", 51.5074, -0.1278, session, timeout=30)
+
+    def maps(path):
+        def call():
+            response = session.get(f"{test_googleapi.MAPS_BASE_URL}{path}", timeout=30)
+            response.raise_for_status()
+            return response.content
+        return call
+
+    def deepseek_stream():
+        completion = deepseek_api_test.stream_music_prompt(deepseek, SAMPLE_WEATHER)
+        for _ in completion:
+            pass
+        return completion.metrics
+
+    def stability():
+        output_path = os.path.join(workdir, f"bench_{next(counter)}.mp3")
+        result = stability_audio.generate_audio(session, "benchmark", "benchmark prompt", output_path,
+                                                duration=20, steps=30, base_url=base_url)
+        os.unlink(output_path)
+        return result
+
+    return {
+        "weather": openweather("weather"),
+        "geocoding": openweather("geocoding"),
+        "forecast": openweather("forecast"),
+        "maps_geocode": maps("/maps/api/geocode/json?address=London&key=benchmark"),
+        "maps_directions": maps("/maps/api/directions/json?origin=London&destination=Manchester&key=benchmark"),
+        "deepseek": lambda: deepseek_api_test.generate_music_prompt(deepseek, SAMPLE_WEATHER),
+        "deepseek_stream": deepseek_stream,
+        "stability": stability,
+    }
+
+
+def run_scenario(call, requests_count, concurrency, warmup, trace_memory=False):
+    """并发执行 requests_count 次调用，统计延迟分布、吞吐量和内存
+
+    trace_memory 为真时用 tracemalloc 记录峰值分配；它会跟踪进程内所有线程
+    (包括模拟服务器)，明显拖慢请求，因此延迟数字只在关闭时有可比性。
+    """
+    for _ in range(warmup):
+        call()
+
+    def timed(_):
+        start = time.perf_counter()
+        try:
+            call()
+            return time.perf_counter() - start, None
+        except Exception as err:
+            return time.perf_counter() - start, f"{type(err).__name__}: {err}"
+
+    if trace_memory:
+        tracemalloc.start()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed, range(requests_count)))
+    wall_time = time.perf_counter() - wall_start
+    peak_traced = None
+    if trace_memory:
+        _, peak_traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    latencies = sorted(latency for latency, error in outcomes if error is None)
+    errors = [error for _, error in outcomes if error is not None]
+    to_ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        "requests": requests_count,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:3],
+        "wall_time_s": round(wall_time, 3),
+        "rps": round(len(latencies) / wall_time, 2) if wall_time > 0 else None,
+        "mean_ms": to_ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": to_ms(percentile(latencies, 50)),
+        "p95_ms": to_ms(percentile(latencies, 95)),
+        "p99_ms": to_ms(percentile(latencies, 99)),
+        "max_ms": to_ms(latencies[-1] if latencies else None),
+        "peak_traced_kb": round(peak_traced / 1024, 1) if peak_traced is not None else None,
+    }
+
+
+def compare(results, baseline, threshold):
+    """与基线比较，p95上升或吞吐量下降超过 threshold 时视为回归"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or not current["p95_ms"] or not previous.get("p95_ms"):
+            continue
+        p95_change = current["p95_ms"] / previous["p95_ms"] - 1
+        rps_change = current["rps"] / previous["rps"] - 1 if previous.get("rps") else 0.0
+        status = "ok"
+        if p95_change > threshold or rps_change < -threshold:
+            status = "REGRESSION"
+            regressions.append(name)
+        print(f"  {name:<16} p95 {previous['p95_ms']:>9.2f} → {current['p95_ms']:>9.2f} ms ({p95_change:+.1%})  "
+              f"rps {previous.get('rps') or 0:>8.1f} → {current['rps']:>8.1f} ({rps_change:+.1%})  {status}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='API客户端性能基准测试')
+    parser.add_argument('--scenarios', nargs='*', help='要运行的场景 (默认: 全部)')
+    parser.add_argument('--requests', type=int, default=100, help='每个场景的请求数 (默认: 100)')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发数 (默认: 8)')
+    parser.add_argument('--warmup', type=int, default=2, help='每个场景的预热请求数 (默认: 2)')
+    parser.add_argument('--trace-memory', action='store_true', help='用tracemalloc记录每个场景的峰值分配 (会拖慢请求)')
+    parser.add_argument('--base-url', help='使用已有的替身服务器，而不是在进程内启动 mock_server')
+    parser.add_argument('--mock-latency', type=float, default=0.02, help='进程内模拟服务器的基础延迟 (秒)')
+    parser.add_argument('--mock-jitter', type=float, default=0.01, help='进程内模拟服务器的延迟抖动 (秒)')
+    parser.add_argument('--seed', type=int, default=42, help='模拟服务器随机种子 (默认: 42)')
+    parser.add_argument('--output', help='把结果保存为JSON文件')
+    parser.add_argument('--compare', metavar='BASELINE', help='与之前保存的JSON结果比较')
+    parser.add_argument('--threshold', type=float, default=0.10, help='回归判定阈值 (默认: 0.10)')
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = mock_server.start_server(
+            config={"default": {"latency": args.mock_latency, "jitter": args.mock_jitter}}, seed=args.seed,
+        )
+        base_url = server.base_url
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=args.concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        scenarios = build_scenarios(base_url.rstrip('/'), session, workdir)
+        unknown = set(args.scenarios or []) - set(scenarios)
+        if unknown:
+            parser.error(f"未知场景: {', '.join(sorted(unknown))} (可选: {', '.join(scenarios)})")
+
+        for name in args.scenarios or scenarios:
+            result = run_scenario(scenarios[name], args.requests, args.concurrency, args.warmup,
+                                  args.trace_memory)
+            results[name] = result
+            line = (f"{name:<16} p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  p99 {result['p99_ms']} ms  "
+                    f"{result['rps']} req/s  错误 {result['errors']}")
+            if result['peak_traced_kb'] is not None:
+                line += f"  峰值分配 {result['peak_traced_kb']} KB"
+            print(line)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "trace_memory": args.trace_memory,
+            "base_url": args.base_url or "in-process mock",
+            "mock_latency": args.mock_latency,
+            "mock_jitter": args.mock_jitter,
+            "python": platform.python_version(),
+        },
+        # Linux 上 ru_maxrss 单位为KB
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "results": results,
+    }
+    print(f"进程峰值RSS: {report['peak_rss_kb']} KB")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"结果已保存至: {args.output}")
+
+    if server is not None:
+        server.shutdown()
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+        print(f"\n与基线比较 ({args.compare}, 阈值 {args.threshold:.0%}):")
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
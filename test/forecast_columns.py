@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# forecast_columns.py - 把多个位置的5天/3小时预报转换为列式数组
+#
+# 每条预报是结构化数组中的一行 (位置、时间、温度、湿度、风速、气压、状况代码)，
+# 聚合 (每日最高/最低、滑动平均) 都是对整列的NumPy运算，不再逐个字典循环。
+# 安装 pyarrow 时可以写成 Parquet，否则写成 .npz:
+#   python forecast_columns.py KEY locations.csv --parquet forecast.parquet --daily
+
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+import test_weather
+from test_weather import create_session, read_locations, request_json
+
+FORECAST_DTYPE = np.dtype([
+    ("location", "i4"),    # 位置在 location_ids 中的下标
+    ("dt", "i8"),          # UTC 时间戳 (秒)
+    ("day", "i4"),         # 当地日期，自1970-01-01起的天数
+    ("temp", "f4"),        # °C
+    ("humidity", "f4"),    # %
+    ("wind", "f4"),        # m/s
+    ("pressure", "f4"),    # hPa
+    ("condition", "i2"),   # OpenWeather 状况代码
+])
+
+DAILY_DTYPE = np.dtype([
+    ("location", "i4"), ("day", "i4"), ("temp_min", "f4"), ("temp_max", "f4"),
+    ("humidity_mean", "f4"), ("wind_max", "f4"), ("steps", "i2"),
+])
+
+
+def forecast_to_array(data, location=0):
+    """把一个预报响应的 list 转换为 FORECAST_DTYPE 数组"""
+    items = data.get("list") or []
+    offset = (data.get("city") or {}).get("timezone", 0)
+    table = np.empty(len(items), dtype=FORECAST_DTYPE)
+    table["location"] = location
+    table["dt"] = [item["dt"] for item in items]
+    table["day"] = (table["dt"] + offset) // 86400
+    table["temp"] = [item["main"]["temp"] for item in items]
+    table["humidity"] = [item["main"]["humidity"] for item in items]
+    table["wind"] = [item.get("wind", {}).get("speed", np.nan) for item in items]
+    table["pressure"] = [item["main"].get("pressure", np.nan) for item in items]
+    table["condition"] = [(item.get("weather") or [{}])[0].get("id", 0) for item in items]
+    return table
+
+
+def ingest(responses):
+    """把 [(位置id, 预报响应)] 合并为一个按 (位置, 时间) 排序的数组，返回 (数组, 位置id列表)"""
+    location_ids = []
+    parts = []
+    for location_id, data in responses:
+        parts.append(forecast_to_array(data, len(location_ids)))
+        location_ids.append(location_id)
+    table = np.concatenate(parts) if parts else np.empty(0, dtype=FORECAST_DTYPE)
+    table = table[np.lexsort((table["dt"], table["location"]))]
+    return table, location_ids
+
+
+def _group_starts(keys):
+    """已排序的键数组中每组的起始下标"""
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.intp)
+    return np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+
+
+def daily_extremes(table):
+    """按 (位置, 当地日期) 聚合：最低/最高温度、平均湿度、最大风速"""
+    keys = table["location"].astype(np.int64) << 32 | table["day"].astype(np.int64) & 0xFFFFFFFF
+    order = np.argsort(keys, kind="stable")
+    keys, rows = keys[order], table[order]
+    starts = _group_starts(keys)
+    counts = np.diff(np.append(starts, len(rows)))
+
+    daily = np.empty(len(starts), dtype=DAILY_DTYPE)
+    daily["location"] = rows["location"][starts]
+    daily["day"] = rows["day"][starts]
+    if len(starts):
+        daily["temp_min"] = np.minimum.reduceat(rows["temp"], starts)
+        daily["temp_max"] = np.maximum.reduceat(rows["temp"], starts)
+        daily["humidity_mean"] = np.add.reduceat(rows["humidity"], starts) / counts
+        daily["wind_max"] = np.fmax.reduceat(rows["wind"], starts)
+    daily["steps"] = counts
+    return daily
+
+
+def rolling_mean(table, field, window=8):
+    """每个位置内按时间的滑动平均 (默认8步 = 24小时)，窗口不跨越位置
+
+    table 需要按 (位置, 时间) 排序 (ingest 的输出即是)。缺失值 (NaN) 不参与平均，
+    窗口内没有有效值时结果为 NaN。
+    """
+    values = table[field].astype(np.float64)
+    index = np.arange(len(values))
+    group_start = np.zeros(len(values), dtype=np.intp)
+    starts = _group_starts(table["location"])
+    group_start[starts] = starts
+    group_start = np.maximum.accumulate(group_start)
+
+    window_start = np.maximum(index - window + 1, group_start)
+    # 缺失值按0累加、另外累计有效值个数；累加在每个位置的第一行重新开始，
+    # 一个缺失值不会影响之后的行或其他位置
+    valid = ~np.isnan(values)
+    clean = np.where(valid, values, 0.0)
+    sums = np.cumsum(clean)
+    sums -= sums[group_start] - clean[group_start]
+    counts = np.cumsum(valid)
+    counts -= counts[group_start] - valid[group_start]
+    # (累加值 - 当前值)[j] 是同一位置内 j 之前的累加
+    window_sums = sums - (sums - clean)[window_start]
+    window_counts = counts - (counts - valid)[window_start]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return window_sums / window_counts
+
+
+def to_arrow(table, location_ids):
+    """转换为 pyarrow.Table (需要安装 pyarrow)"""
+    import pyarrow as pa
+
+    columns = {name: table[name] for name in FORECAST_DTYPE.names}
+    columns["location_id"] = pa.DictionaryArray.from_arrays(
+        table["location"], pa.array([str(location_id) for location_id in location_ids])
+    )
+    return pa.table(columns)
+
+
+def write_parquet(table, location_ids, path):
+    import pyarrow.parquet as pq
+
+    pq.write_table(to_arrow(table, location_ids), path, compression="zstd")
+
+
+def write_npz(table, location_ids, path):
+    """不依赖 pyarrow 的保存方式"""
+    np.savez_compressed(path, forecast=table, location_ids=np.array([str(i) for i in location_ids]))
+
+
+def load_npz(path):
+    with np.load(path) as data:
+        return data["forecast"], data["location_ids"].tolist()
+
+
+def fetch_forecasts(api_key, locations, workers=8):
+    """并发请求所有位置的预报，返回 [(位置id, 响应)]，失败的位置打印到标准错误后跳过"""
+    def fetch(location):
+        try:
+            data, _ = request_json("forecast", api_key, location["lat"], location["lon"], session, timeout=10)
+            return location["id"], data
+        except (requests.exceptions.RequestException, ValueError) as err:
+            print(f"位置 {location['id']} 请求失败: {err}", file=sys.stderr)
+            return None
+
+    with create_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        return [result for result in executor.map(fetch, locations) if result is not None]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='把OpenWeather预报导入为列式数组')
+    parser.add_argument('api_key', help='OpenWeather API密钥')
+    parser.add_argument('locations', help='坐标文件 (CSV或JSONL，需要lat/lon列)')
+    parser.add_argument('--workers', type=int, default=8, help='并发请求数 (默认: 8)')
+    parser.add_argument('--base-url', help='替代 api.openweathermap.org 的基础URL (例如本地模拟服务器)')
+    parser.add_argument('--parquet', metavar='FILE', help='写入Parquet文件 (需要pyarrow)')
+    parser.add_argument('--npz', metavar='FILE', help='写入NumPy .npz文件')
+    parser.add_argument('--daily', action='store_true', help='输出每日最高/最低温度等聚合 (JSONL)')
+    parser.add_argument('--window', type=int, default=8, help='滑动平均窗口步数 (默认: 8，即24小时)')
+    args = parser.parse_args()
+
+    if args.base_url:
+        test_weather.OPENWEATHER_BASE_URL = args.base_url
+
+    start = time.perf_counter()
+    responses = fetch_forecasts(args.api_key, list(read_locations(args.locations)), args.workers)
+    fetched = time.perf_counter()
+    table, location_ids = ingest(responses)
+    daily = daily_extremes(table)
+    smoothed = rolling_mean(table, "temp", args.window)
+    ingested = time.perf_counter()
+    print(f"{len(location_ids)} 个位置, {len(table)} 条预报: 请求 {fetched - start:.2f}秒, "
+          f"转换和聚合 {(ingested - fetched) * 1000:.1f}毫秒", file=sys.stderr)
+
+    if args.daily:
+        for row, location in zip(daily, daily["location"]):
+            print(json.dumps({
+                "id": location_ids[location],
+                "date": str(np.datetime64(int(row["day"]), 'D')),
+                "temp_min": round(float(row["temp_min"]), 1),
+                "temp_max": round(float(row["temp_max"]), 1),
+                "humidity_mean": round(float(row["humidity_mean"]), 1),
+                "wind_max": round(float(row["wind_max"]), 1),
+                "steps": int(row["steps"]),
+            }, ensure_ascii=False))
+    if len(table):
+        print(f"{args.window}步滑动平均温度范围: {np.nanmin(smoothed):.1f} ~ {np.nanmax(smoothed):.1f} °C", file=sys.stderr)
+
+    if args.parquet:
+        try:
+            write_parquet(table, location_ids, args.parquet)
+        except ImportError:
+            sys.exit("写入Parquet需要安装 pyarrow (pip install pyarrow)，或改用 --npz")
+        print(f"已写入: {args.parquet}", file=sys.stderr)
+    if args.npz:
+        write_npz(table, location_ids, args.npz)
+        print(f"已写入: {args.npz}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
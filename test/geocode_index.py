@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# geocode_index.py - 地名 → 坐标 的持久化索引 (SQLite)，支持前缀和模糊匹配
+#
+# 地名先规范化 (去重音、小写、合并空白和标点)，索引整个加载到内存中，重复查询只需几微秒。
+# 精确和别名都匹配不到时调用 Google Geocoding API，结果写回索引，查询的写法 (包括拼写错误，
+# 例如 "Syndey") 记为别名，下次直接命中。三元组候选 + difflib 的模糊匹配只在离线或API没有
+# 结果时作为未确认的猜测返回，不写入索引；前缀表只用于自动补全 (complete)，不参与地理编码。
+# 批量模式对整个列表去重后并发请求，每个唯一的地名最多请求一次。
+#   python geocode_index.py places.sqlite lookup Syndey London "New York"
+#   python geocode_index.py places.sqlite complete new
+#   python geocode_index.py places.sqlite bulk cities.txt --workers 8
+#   python geocode_index.py places.sqlite import cities.csv   # name,lat,lon[,country]
+
+import argparse
+import bisect
+import csv
+import difflib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import requests
+
+import api_metrics
+import test_googleapi
+from test_googleapi import create_session
+
+SAME_PLACE_DEGREES = 0.1  # 同名记录的坐标相差不超过这么多 (度) 时视为同一地点
+FUZZY_CUTOFF = 0.8  # difflib 相似度下限
+FUZZY_MIN_LENGTH = 4  # 太短的名字不做模糊匹配，避免 "bath" 匹配到 "bach"
+MAX_CANDIDATES = 50
+
+
+def normalise_name(name):
+    """去掉重音符号、转小写，非字母数字字符合并为单个空格"""
+    text = unicodedata.normalize("NFKD", str(name))
+    text = "".join(char for char in text if not unicodedata.combining(char)).lower()
+    return " ".join("".join(char if char.isalnum() else " " for char in text).split())
+
+
+def trigrams(name):
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def place_name(result):
+    """Geocoding 结果中的地名：优先 locality，否则第一个地址组件或格式化地址的第一段"""
+    components = result.get("address_components") or []
+    for component in components:
+        if "locality" in component.get("types", []):
+            return component["long_name"]
+    if components:
+        return components[0]["long_name"]
+    return (result.get("formatted_address") or "").split(",")[0]
+
+
+def same_place(place, lat, lon, country=None):
+    """已有记录与新结果是否为同一地点 (国家一致且坐标接近)"""
+    if country and place.get("country") and country != place["country"]:
+        return False
+    return abs(place["lat"] - lat) <= SAME_PLACE_DEGREES and abs(place["lon"] - lon) <= SAME_PLACE_DEGREES
+
+
+class GeocodeIndex:
+    """持久化的地名索引
+
+    places 表保存规范化地名的坐标，aliases 表把查询过的其他写法 (包括拼写错误) 指向地名；
+    别名只在API确认后写入。
+    所有记录同时保存在内存中：字典用于精确查询，排序列表用于前缀查询，三元组倒排表用于模糊查询。
+    """
+
+    def __init__(self, path, api_key=None, session=None, timeout=10, fuzzy=True):
+        self.api_key = api_key
+        self.session = session
+        self.timeout = timeout
+        self.fuzzy = fuzzy
+        self.counts = Counter()
+        self._lock = threading.RLock()
+        self._inflight = {}  # 规范化地名 -> Future
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS places ("
+            "name TEXT PRIMARY KEY, display_name TEXT, lat REAL NOT NULL, lon REAL NOT NULL, "
+            "address TEXT, country TEXT, source TEXT, created REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS aliases (alias TEXT PRIMARY KEY, name TEXT NOT NULL);"
+        )
+        self._db.commit()
+        self._places = {}
+        self._aliases = dict(self._db.execute("SELECT alias, name FROM aliases"))
+        self._sorted = []
+        self._trigrams = defaultdict(set)
+        for row in self._db.execute("SELECT name, display_name, lat, lon, address, country, source FROM places"):
+            self._remember(dict(zip(("name", "display_name", "lat", "lon", "address", "country", "source"), row)))
+
+    def _remember(self, place):
+        name = place["name"]
+        if name not in self._places:
+            bisect.insort(self._sorted, name)
+            for gram in trigrams(name):
+                self._trigrams[gram].add(name)
+        self._places[name] = place
+
+    def add_place(self, name, lat, lon, display_name=None, address=None, country=None, source="import"):
+        """加入或更新一个地名，返回规范化后的记录"""
+        place = {"name": normalise_name(name), "display_name": display_name or name, "lat": float(lat),
+                 "lon": float(lon), "address": address, "country": country, "source": source}
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO places (name, display_name, lat, lon, address, country, source, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (place["name"], place["display_name"], place["lat"], place["lon"], address, country, source,
+                 time.time()),
+            )
+            self._db.commit()
+            self._remember(place)
+        return place
+
+    def add_alias(self, alias, name):
+        alias, name = normalise_name(alias), normalise_name(name)
+        if alias == name:
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO aliases (alias, name) VALUES (?, ?)", (alias, name))
+            self._db.commit()
+            self._aliases[alias] = name
+
+    def complete(self, text, limit=10):
+        """自动补全：以 text 开头的地名记录 (按地名排序)，最多 limit 条"""
+        key = normalise_name(text)
+        with self._lock:
+            start = bisect.bisect_left(self._sorted, key)
+            matches = []
+            for name in self._sorted[start:]:
+                if not name.startswith(key) or len(matches) >= limit:
+                    break
+                matches.append(dict(self._places[name], match="prefix", query=text))
+        return matches
+
+    def _fuzzy(self, name):
+        """共享三元组最多的候选中 difflib 相似度最高且不低于 FUZZY_CUTOFF 的地名"""
+        if len(name) < FUZZY_MIN_LENGTH:
+            return None
+        shared = Counter()
+        for gram in trigrams(name):
+            shared.update(self._trigrams.get(gram, ()))
+        candidates = [candidate for candidate, _ in shared.most_common(MAX_CANDIDATES)]
+        matches = difflib.get_close_matches(name, candidates, n=1, cutoff=FUZZY_CUTOFF)
+        return matches[0] if matches else None
+
+    def lookup(self, name, fuzzy=None):
+        """只查本地索引，返回带 match 字段 (exact/alias/fuzzy) 的记录，找不到时返回 None
+
+        fuzzy 默认取构造时的设置；模糊匹配只是猜测，不写入别名。
+        """
+        key = normalise_name(name)
+        fuzzy = self.fuzzy if fuzzy is None else fuzzy
+        with self._lock:
+            if key in self._places:
+                match, found = "exact", key
+            elif key in self._aliases and self._aliases[key] in self._places:
+                match, found = "alias", self._aliases[key]
+            else:
+                found = self._fuzzy(key) if fuzzy else None
+                match = "fuzzy"
+            if found is None:
+                self.counts["misses"] += 1
+                return None
+            self.counts[match] += 1
+            return dict(self._places[found], match=match, query=name)
+
+    def fetch(self, name):
+        """调用 Geocoding API，把结果写入索引，没有结果时返回 None
+
+        结果记在其地名下、查询写法记为别名；若该地名已是另一个地点，则改为记在查询写法下。
+        """
+        if self.session is None:
+            return None
+        query = urlencode({"address": name, "key": self.api_key or ""})
+        response = self.session.get(f"{test_googleapi.MAPS_BASE_URL}/maps/api/geocode/json?{query}",
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        self.counts["api_requests"] += 1
+        if data.get("status", "OK") != "OK" or not data.get("results"):
+            return None
+        result = data["results"][0]
+        location = result["geometry"]["location"]
+        country = next((component["short_name"] for component in result.get("address_components", [])
+                        if "country" in component.get("types", [])), None)
+        display_name = place_name(result) or name
+        lat, lon = float(location["lat"]), float(location["lng"])
+        with self._lock:
+            existing = self._places.get(normalise_name(display_name))
+            if existing is None:
+                # 记在地名下，查询写法 (例如拼写错误) 记为别名
+                place = self.add_place(display_name, lat, lon, display_name,
+                                       result.get("formatted_address"), country, source="google")
+                self.add_alias(name, place["name"])
+            elif same_place(existing, lat, lon, country):
+                place = existing
+                self.add_alias(name, place["name"])
+            else:
+                # 同名的其他地点 (例如 "London, Ontario" 与已有的 London)：记在查询写法下，不覆盖已有记录
+                place = self.add_place(name, lat, lon, display_name,
+                                       result.get("formatted_address"), country, source="google")
+        return dict(place, match="api", query=name)
+
+    def geocode(self, name):
+        """先精确/别名查本地索引，找不到再调用API；同一地名的并发请求只调用一次API
+
+        离线或API没有结果时退回模糊匹配 (match 为 "fuzzy"，表示未经确认)。
+        """
+        found = self.lookup(name, fuzzy=False)
+        if found is not None:
+            return found
+        if self.session is None:
+            return self.lookup(name)
+        key = normalise_name(name)
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            result = self.fetch(name)
+            if result is None and self.fuzzy:
+                result = self.lookup(name)
+            future.set_result(result)
+            return result
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def bulk(self, names, workers=8):
+        """批量地理编码，返回与输入顺序一致的结果列表 (失败为 {"error": ...}，无结果为 None)"""
+        unique = {}
+        for name in names:
+            unique.setdefault(normalise_name(name), name)
+
+        def geocode(name):
+            try:
+                return self.geocode(name)
+            except (requests.exceptions.RequestException, ValueError, KeyError) as err:
+                return {"error": str(err), "query": name}
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            resolved = dict(zip(unique, executor.map(geocode, unique.values())))
+        return [resolved[normalise_name(name)] for name in names]
+
+    def import_csv(self, path):
+        """从CSV导入地名 (name,lat,lon 列，可选 country)，返回导入条数"""
+        count = 0
+        with open(path, newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                if row.get('name') and row.get('lat') not in (None, '') and row.get('lon') not in (None, ''):
+                    self.add_place(row['name'], row['lat'], row['lon'], country=row.get('country') or None)
+                    count += 1
+        return count
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, places=len(self._places), aliases=len(self._aliases))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='地名 → 坐标 的持久化索引 (支持拼写纠正)')
+    parser.add_argument('index', help='SQLite索引文件')
+    parser.add_argument('--api-key', default=os.environ.get("GOOGLE_MAPS_API_KEY", ""), help='Google Maps API密钥')
+    parser.add_argument('--base-url', help='替代 maps.googleapis.com 的基础URL (例如本地模拟服务器)')
+    parser.add_argument('--offline', action='store_true', help='只查本地索引，不调用API')
+    parser.add_argument('--no-fuzzy', action='store_true', help='关闭模糊匹配')
+    parser.add_argument('--workers', type=int, default=8, help='批量模式的并发请求数 (默认: 8)')
+    api_metrics.add_arguments(parser)
+    commands = parser.add_subparsers(dest='command', required=True)
+    lookup_parser = commands.add_parser('lookup', help='查询一个或多个地名')
+    lookup_parser.add_argument('names', nargs='+', help='地名')
+    complete_parser = commands.add_parser('complete', help='列出以给定文本开头的已索引地名')
+    complete_parser.add_argument('text', help='地名前缀')
+    complete_parser.add_argument('--limit', type=int, default=10, help='最多返回的条数 (默认: 10)')
+    bulk_parser = commands.add_parser('bulk', help='批量查询文件中的地名 (每行一个)')
+    bulk_parser.add_argument('file', help='地名文件')
+    import_parser = commands.add_parser('import', help='从CSV导入地名 (name,lat,lon[,country])')
+    import_parser.add_argument('file', help='CSV文件')
+    args = parser.parse_args()
+
+    if args.base_url:
+        test_googleapi.MAPS_BASE_URL = args.base_url.rstrip('/')
+
+    metrics = api_metrics.from_args(args)
+    session = None if args.offline else create_session(args.workers, metrics)
+    index = GeocodeIndex(args.index, args.api_key, session, fuzzy=not args.no_fuzzy)
+    start = time.perf_counter()
+    try:
+        if args.command == 'import':
+            print(f"导入 {index.import_csv(args.file)} 个地名")
+        elif args.command == 'complete':
+            for place in index.complete(args.text, args.limit):
+                print(json.dumps(place, ensure_ascii=False))
+        else:
+            if args.command == 'lookup':
+                names = args.names
+            else:
+                with open(args.file, encoding='utf-8') as file:
+                    names = [line.strip() for line in file if line.strip()]
+            for name, result in zip(names, index.bulk(names, args.workers)):
+                print(json.dumps(result or {"query": name, "match": None}, ensure_ascii=False))
+            print(f"{len(names)} 个地名, 耗时 {(time.perf_counter() - start) * 1000:.1f}毫秒", file=sys.stderr)
+        print(f"索引统计: {json.dumps(index.stats(), ensure_ascii=False)}", file=sys.stderr)
+    finally:
+        index.close()
+        if session is not None:
+            session.close()
+        if metrics is not None:
+            metrics.print_summary()
+            metrics.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# map_tiles.py - 基于 Static Maps 的瓦片预取、磁盘缓存和本地瓦片服务
+#
+# 把边界框和缩放级别范围划分为 slippy map 瓦片 (与 spatial_index 相同的编号)，
+# 每个瓦片用一张以瓦片中心为中心、256x256 (乘以 scale) 的静态地图表示。
+# 图片存入内容寻址缓存 (相同图片只存一份，总大小超限时按最近访问淘汰)，
+# 元数据记录 ETag / Last-Modified，过期后用条件请求重新验证，未变化时服务器返回304。
+#   python map_tiles.py ./tiles prefetch --bbox 51.28 -0.51 51.69 0.33 --zooms 10 13 --api-key KEY
+#   python map_tiles.py ./tiles serve --port 8091
+#   curl http://127.0.0.1:8091/tiles/12/2046/1362.png
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import api_metrics
+import test_googleapi
+from audio_cache import DEFAULT_MAX_BYTES, ContentAddressedStore
+from spatial_index import tile_center, tile_xy
+from test_googleapi import create_session, static_map_url
+
+TILE_SIZE = 256  # Static Maps 的世界坐标以256像素瓦片为单位，与 slippy map 瓦片一致
+DEFAULT_MAX_AGE = 7 * 24 * 3600  # 超过该时间的瓦片在使用前重新验证
+MAX_TILES = 5000  # 防止误用过大的范围产生大量计费请求
+
+
+def tiles_for_bbox(south, west, north, east, min_zoom, max_zoom):
+    """返回覆盖边界框的所有瓦片 (zoom, x, y)，按缩放级别从小到大"""
+    tiles = []
+    for zoom in range(min_zoom, max_zoom + 1):
+        x0, y0 = tile_xy(north, west, zoom)
+        x1, y1 = tile_xy(south, east, zoom)
+        tiles.extend((zoom, x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+    return tiles
+
+
+def tile_key(zoom, x, y, scale=1, maptype="roadmap"):
+    return f"{maptype}/{scale}/{zoom}/{x}/{y}"
+
+
+class TileCache(ContentAddressedStore):
+    """以瓦片编号为键的图片缓存，元数据保存验证器和获取时间"""
+
+    def update_meta(self, key, meta):
+        """只更新键的元数据 (例如304后刷新获取时间)"""
+        with self._lock:
+            self._db.execute("UPDATE entries SET meta = ? WHERE key = ?", (json.dumps(meta, ensure_ascii=False), key))
+            self._db.commit()
+
+    def put_bytes(self, key, data, suffix, meta):
+        """把下载的图片写入临时文件后加入缓存"""
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=suffix)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            return self.put_file(key, temp_path, meta)
+        finally:
+            os.unlink(temp_path)
+
+
+class TileFetcher:
+    """从缓存或 Static Maps 获取瓦片
+
+    同一瓦片的并发请求只发送一次上游请求；缓存中的瓦片超过 max_age 后
+    带 If-None-Match / If-Modified-Since 重新验证。
+    """
+
+    def __init__(self, cache, api_key, session, scale=1, maptype="roadmap", max_age=DEFAULT_MAX_AGE,
+                 offline=False, timeout=10):
+        self.cache = cache
+        self.api_key = api_key
+        self.session = session
+        self.scale = scale
+        self.maptype = maptype
+        self.max_age = max_age
+        self.offline = offline
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._inflight = {}  # 键 -> Future
+
+    def tile(self, zoom, x, y, revalidate=False):
+        """返回 (图片路径, 状态)；状态为 hit、revalidated、fetched 或 stale (离线/上游失败时使用过期瓦片)
+
+        瓦片既不在缓存中又无法获取时返回 (None, 状态)。
+        """
+        key = tile_key(zoom, x, y, self.scale, self.maptype)
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            result = self._load(key, zoom, x, y, revalidate)
+            future.set_result(result)
+            return result
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _load(self, key, zoom, x, y, revalidate):
+        entry = self.cache.get(key)
+        if entry is not None:
+            path, meta = entry
+            if self.offline or (not revalidate and time.time() - meta.get("fetched", 0) < self.max_age):
+                return path, "hit"
+        else:
+            path, meta = None, {}
+        if self.offline:
+            return None, "missing"
+
+        latitude, longitude = tile_center(zoom, x, y)
+        url = static_map_url(self.api_key, f"{latitude:.6f},{longitude:.6f}", zoom,
+                             f"{TILE_SIZE}x{TILE_SIZE}", self.scale, self.maptype)
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            if path is not None:
+                return path, "stale"
+            raise
+
+        if response.status_code == 304 and path is not None:
+            self.cache.update_meta(key, dict(meta, fetched=time.time()))
+            return path, "revalidated"
+        content_type = response.headers.get("Content-Type", "")
+        if response.status_code != 200 or not content_type.startswith("image/"):
+            if path is not None:
+                return path, "stale"
+            raise RuntimeError(f"Static Maps 返回 {response.status_code} ({content_type}): {response.text[:200]}")
+
+        suffix = ".jpg" if "jpeg" in content_type else ".gif" if "gif" in content_type else ".png"
+        path = self.cache.put_bytes(key, response.content, suffix, {
+            "zoom": zoom, "x": x, "y": y,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_type": content_type,
+            "fetched": time.time(),
+        })
+        return path, "fetched"
+
+    def prefetch(self, tiles, workers=8, revalidate=False, progress=None):
+        """并发获取所有瓦片，返回各状态的计数"""
+        counts = Counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self.tile, *tile, revalidate=revalidate): tile for tile in tiles}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    counts[future.result()[1]] += 1
+                except Exception as err:
+                    counts["errors"] += 1
+                    print(f"瓦片 {futures[future]} 获取失败: {err}", file=sys.stderr)
+                if progress is not None:
+                    progress(done, len(futures))
+        return counts
+
+
+_TILE_PATH = re.compile(r"^/tiles/(\d+)/(\d+)/(\d+)(?:\.\w+)?$")
+
+
+class TileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "TileCache/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, content_type, payload, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/stats":
+            payload = json.dumps(self.server.fetcher.cache.stats(), ensure_ascii=False).encode('utf-8')
+            return self._send(200, "application/json; charset=utf-8", payload)
+        match = _TILE_PATH.match(path)
+        if match is None:
+            return self._send(404, "text/plain; charset=utf-8", b"Not Found")
+        zoom, x, y = (int(part) for part in match.groups())
+        if zoom > 21 or x >= 2 ** zoom or y >= 2 ** zoom:
+            return self._send(404, "text/plain; charset=utf-8", b"Tile out of range")
+
+        fetcher = self.server.fetcher
+        for attempt in range(2):
+            try:
+                tile_path, status = fetcher.tile(zoom, x, y)
+            except Exception as err:
+                return self._send(502, "text/plain; charset=utf-8", str(err).encode('utf-8'))
+            if tile_path is None:
+                return self._send(404, "text/plain; charset=utf-8", b"Tile not cached")
+            try:
+                # 固定住文件再读取；返回路径之后、固定之前仍可能被其他请求淘汰，此时重新获取一次
+                with fetcher.cache.pinned(tile_path), open(tile_path, 'rb') as file:
+                    payload = file.read()
+                break
+            except FileNotFoundError:
+                if attempt == 1:
+                    return self._send(502, "text/plain; charset=utf-8", b"Tile evicted while serving")
+
+        # 缓存文件名就是内容的SHA-256，可直接作为ETag
+        etag = f'"{os.path.splitext(os.path.basename(tile_path))[0][:32]}"'
+        headers = {"ETag": etag, "Cache-Control": "public, max-age=86400", "X-Tile-Cache": status}
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+        content_type = "image/jpeg" if tile_path.endswith(".jpg") else "image/gif" if tile_path.endswith(".gif") \
+            else "image/png"
+        self._send(200, content_type, payload, headers)
+
+
+def start_server(fetcher, host="127.0.0.1", port=0, verbose=False):
+    """在后台线程启动瓦片服务器，返回服务器对象 (server.base_url 为访问地址)"""
+    server = ThreadingHTTPServer((host, port), TileHandler)
+    server.daemon_threads = True
+    server.fetcher = fetcher
+    server.verbose = verbose
+    server.base_url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Static Maps 瓦片预取、缓存和本地服务')
+    parser.add_argument('cache_dir', help='瓦片缓存目录')
+    parser.add_argument('--api-key', default=os.environ.get("GOOGLE_MAPS_API_KEY", ""), help='Google Maps API密钥')
+    parser.add_argument('--base-url', help='替代 maps.googleapis.com 的基础URL (例如本地模拟服务器)')
+    parser.add_argument('--max-bytes', type=int, default=DEFAULT_MAX_BYTES, help='缓存大小上限 (字节)')
+    parser.add_argument('--max-age', type=float, default=DEFAULT_MAX_AGE, help='瓦片重新验证前的有效期 (秒)')
+    parser.add_argument('--scale', type=int, choices=(1, 2), default=1, help='图片缩放倍数 (2为高分屏)')
+    parser.add_argument('--maptype', default='roadmap', help='地图类型 (默认: roadmap)')
+    parser.add_argument('--workers', type=int, default=8, help='并发请求数 (默认: 8)')
+    api_metrics.add_arguments(parser)
+    commands = parser.add_subparsers(dest='command', required=True)
+    prefetch_parser = commands.add_parser('prefetch', help='预取边界框内的瓦片')
+    prefetch_parser.add_argument('--bbox', type=float, nargs=4, required=True, metavar=('SOUTH', 'WEST', 'NORTH', 'EAST'),
+                                 help='边界框 (南 西 北 东)')
+    prefetch_parser.add_argument('--zooms', type=int, nargs=2, required=True, metavar=('MIN', 'MAX'), help='缩放级别范围')
+    prefetch_parser.add_argument('--revalidate', action='store_true', help='重新验证所有已缓存的瓦片')
+    prefetch_parser.add_argument('--max-tiles', type=int, default=MAX_TILES, help=f'瓦片数上限 (默认: {MAX_TILES})')
+    serve_parser = commands.add_parser('serve', help='启动本地瓦片服务器')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='监听地址 (默认: 127.0.0.1)')
+    serve_parser.add_argument('--port', type=int, default=8091, help='监听端口 (默认: 8091)')
+    serve_parser.add_argument('--offline', action='store_true', help='只提供已缓存的瓦片，不访问上游')
+    serve_parser.add_argument('--verbose', action='store_true', help='打印每个请求')
+    commands.add_parser('stats', help='显示缓存统计')
+    args = parser.parse_args()
+
+    if args.base_url:
+        test_googleapi.MAPS_BASE_URL = args.base_url.rstrip('/')
+
+    cache = TileCache(args.cache_dir, args.max_bytes)
+    metrics = api_metrics.from_args(args)
+    session = create_session(args.workers, metrics)
+    fetcher = TileFetcher(cache, args.api_key, session, args.scale, args.maptype, args.max_age,
+                          offline=getattr(args, 'offline', False))
+    try:
+        if args.command == 'prefetch':
+            south, west, north, east = args.bbox
+            tiles = tiles_for_bbox(south, west, north, east, *args.zooms)
+            if len(tiles) > args.max_tiles:
+                parser.exit(1, f"范围包含 {len(tiles)} 个瓦片，超过上限 {args.max_tiles} (可调整 --max-tiles)\n")
+            start = time.perf_counter()
+            counts = fetcher.prefetch(tiles, args.workers, args.revalidate)
+            print(f"{len(tiles)} 个瓦片, 耗时 {time.perf_counter() - start:.1f}秒: "
+                  f"{json.dumps(dict(counts), ensure_ascii=False)}")
+        elif args.command == 'serve':
+            server = start_server(fetcher, args.host, args.port, args.verbose)
+            print(f"瓦片服务器运行在 {server.base_url}/tiles/{{z}}/{{x}}/{{y}}.png，按 Ctrl+C 停止")
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                server.shutdown()
+        print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+    finally:
+        session.close()
+        cache.close()
+        if metrics is not None:
+            metrics.print_summary()
+            metrics.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# mock_server.py - 本地模拟服务器：回放 Weather、Maps、DeepSeek、Stability 的录制响应
+#
+# 各脚本通过 --base-url 或环境变量指向这里即可离线运行，例如:
+#   python mock_server.py --port 8765 --latency 0.05 --jitter 0.02 --error-rate 0.01
+#   OPENWEATHER_BASE_URL=http://127.0.0.1:8765 python test_weather.py KEY
+#
+# 每个端点可以单独配置延迟、抖动、错误率和429比例 (JSON配置文件):
+#   {"default": {"latency": 0.05}, "endpoints": {"stability": {"latency": 8, "rate_limit_rate": 0.1}}}
+# Stability 端点的 step_latency 按 步数 × 时长/20秒 增加生成耗时，wav 输出的噪声随步数增加而减小，
+# 供 param_sweep.py 在本地测量参数取舍。
+
+import argparse
+import copy
+import glob
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESPONSES_DIR = os.path.join(HERE, "mock_responses")
+AUDIO_DIR = os.path.join(HERE, "output")
+
+FAULT_FIELDS = ("latency", "jitter", "error_rate", "rate_limit_rate", "step_latency")
+
+# (方法, 路径) -> 端点名称，名称用于按端点配置故障注入
+ROUTES = {
+    ("GET", "/"): "google",
+    ("GET", "/maps/api/geocode/json"): "maps_geocode",
+    ("GET", "/maps/api/staticmap"): "maps_static",
+    ("GET", "/maps/api/directions/json"): "maps_directions",
+    ("GET", "/data/2.5/weather"): "weather",
+    ("GET", "/data/2.5/forecast"): "forecast",
+    ("GET", "/geo/1.0/reverse"): "reverse_geocode",
+    ("GET", "/v1/current.json"): "weatherapi",
+    ("POST", "/chat/completions"): "deepseek",
+    ("POST", "/v1/chat/completions"): "deepseek",
+    ("POST", "/v2beta/audio/stable-audio-2/text-to-audio"): "stability",
+}
+
+
+def load_response(name):
+    with open(os.path.join(RESPONSES_DIR, f"{name}.json"), encoding='utf-8') as file:
+        return json.load(file)
+
+
+def sample_png(width=64, height=32):
+    """生成一张简单的渐变PNG，代替静态地图图片"""
+    rows = b"".join(
+        b"\x00" + b"".join(bytes((x * 4 % 256, y * 8 % 256, 160)) for x in range(width))
+        for y in range(height)
+    )
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+
+class MockState:
+    """服务器共享状态：录制响应、故障配置和请求计数"""
+
+    def __init__(self, config=None, seed=None):
+        config = config or {}
+        self.default_faults = dict.fromkeys(FAULT_FIELDS, 0.0)
+        self.default_faults.update(config.get("default", {}))
+        self.endpoint_faults = config.get("endpoints", {})
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.started = int(time.time())  # 所有录制响应的 Last-Modified
+        self.counts = {}
+
+        self.responses = {name: load_response(name) for name in (
+            "openweather_weather", "openweather_forecast", "openweather_reverse",
+            "weatherapi_current", "google_geocode", "google_directions", "deepseek_chat",
+        )}
+        self.responses["openweather_forecast"]["list"] = self._expand_forecast(
+            self.responses["openweather_forecast"]["list"][0]
+        )
+        audio_files = sorted(glob.glob(os.path.join(AUDIO_DIR, "*.mp3")))
+        self.audio = open(audio_files[0], 'rb').read() if audio_files else b"ID3" + bytes(1024)
+        self.png = sample_png()
+        self._wav_seconds = {}  # 步数 -> 1秒的PCM数据
+
+    @staticmethod
+    def _expand_forecast(first, steps=40):
+        """以录制的第一条预报为模板生成5天/3小时的40条预报"""
+        items = []
+        for step in range(steps):
+            item = copy.deepcopy(first)
+            item["dt"] = first["dt"] + step * 3 * 3600
+            swing = 4.0 * math.sin(step / 8 * 2 * math.pi)
+            item["main"]["temp"] = round(first["main"]["temp"] + swing, 2)
+            item["main"]["humidity"] = int(first["main"]["humidity"] - swing * 2)
+            item["wind"]["speed"] = round(first["wind"]["speed"] + swing / 2, 2)
+            item["dt_txt"] = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(item["dt"]))
+            items.append(item)
+        return items
+
+    def audio_for(self, output_format, duration, steps):
+        """按时长生成音频：mp3 重复/截取录制的样本，wav 合成和弦加噪声 (步数越多噪声越小)"""
+        if output_format != "wav":
+            size = max(int(len(self.audio) * duration / 20), 1)  # 样本约为20秒
+            return (self.audio * (size // len(self.audio) + 1))[:size]
+        with self.lock:
+            second = self._wav_seconds.get(steps)
+            if second is None:
+                noise = 0.4 / (1 + steps / 10)
+                rng = random.Random(steps)
+                samples = (
+                    0.15 * sum(math.sin(2 * math.pi * freq * i / 16000) for freq in (220.0, 277.2, 329.6))
+                    + noise * rng.uniform(-1, 1)
+                    for i in range(16000)
+                )
+                second = self._wav_seconds[steps] = struct.pack("<16000h", *(int(v * 32767) for v in samples))
+        data = second * max(int(round(duration)), 1)
+        header = struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + len(data), b"WAVE", b"fmt ", 16, 1, 1,
+                             16000, 32000, 2, 16, b"data", len(data))
+        return header + data
+
+    def faults_for(self, endpoint):
+        faults = dict(self.default_faults)
+        faults.update(self.endpoint_faults.get(endpoint, {}))
+        return faults
+
+    def draw(self, endpoint):
+        """按配置决定本次请求的延迟和注入的错误 (None、429或500)"""
+        faults = self.faults_for(endpoint)
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+            delay = max(0.0, faults["latency"] + self.random.uniform(-faults["jitter"], faults["jitter"]))
+            roll = self.random.random()
+        if roll < faults["rate_limit_rate"]:
+            return delay, 429
+        if roll < faults["rate_limit_rate"] + faults["error_rate"]:
+            return delay, 500
+        return delay, None
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "SoundscapeMock/1.0"
+    disable_nagle_algorithm = True  # 流式SSE的小分块不能被Nagle算法延迟
+
+    def handle(self):
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            pass  # 客户端提前断开 (例如流式响应读到 finish_reason 即关闭)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)) if method == "POST" else b""
+        endpoint = ROUTES.get((method, url.path))
+        if endpoint is None:
+            return self._send_json(404, {"detail": "Not Found"})
+
+        state = self.server.state
+        delay, injected = state.draw(endpoint)
+        time.sleep(delay)
+        if injected == 429:
+            return self._send_json(429, {"name": "rate_limited", "errors": ["Too many requests"]},
+                                   {"Retry-After": "1"})
+        if injected == 500:
+            return self._send_json(500, {"name": "internal_error", "errors": ["Injected failure"]})
+
+        getattr(self, f"_handle_{endpoint}")(query, body)
+
+    def _not_modified(self, etag):
+        """按 If-None-Match (优先) 或 If-Modified-Since 判断客户端缓存是否仍然有效"""
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return etag in [value.strip() for value in if_none_match.split(",")] or if_none_match.strip() == "*"
+        if_modified_since = self.headers.get("If-Modified-Since")
+        try:
+            return parsedate_to_datetime(if_modified_since).timestamp() >= self.server.state.started
+        except (TypeError, ValueError):
+            return False
+
+    def _send(self, status, content_type, payload, headers=None):
+        headers = dict(headers or {})
+        if self.command == "GET" and status == 200:
+            # 响应内容不变，用内容哈希作为ETag，支持条件请求返回304
+            etag = '"' + hashlib.sha1(payload).hexdigest()[:16] + '"'
+            headers.update({"ETag": etag, "Last-Modified": formatdate(self.server.state.started, usegmt=True)})
+            if self._not_modified(etag):
+                status, payload = 304, b""
+        self.send_response(status)
+        if status != 304:  # 304 没有响应体
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_json(self, status, data, headers=None):
+        self._send(status, "application/json; charset=utf-8",
+                   json.dumps(data, ensure_ascii=False).encode('utf-8'), headers)
+
+    def _coords(self, query, data):
+        if "lat" in query and "lon" in query:
+            data["coord"] = {"lat": float(query["lat"]), "lon": float(query["lon"])}
+        return data
+
+    def _handle_google(self, query, body):
+        self._send(200, "text/html; charset=utf-8", b"<!doctype html><title>mock</title>")
+
+    def _handle_maps_geocode(self, query, body):
+        self._send_json(200, self.server.state.responses["google_geocode"])
+
+    def _handle_maps_static(self, query, body):
+        self._send(200, "image/png", self.server.state.png)
+
+    def _handle_maps_directions(self, query, body):
+        self._send_json(200, self.server.state.responses["google_directions"])
+
+    def _handle_weather(self, query, body):
+        self._send_json(200, self._coords(query, copy.deepcopy(self.server.state.responses["openweather_weather"])))
+
+    def _handle_forecast(self, query, body):
+        self._send_json(200, self.server.state.responses["openweather_forecast"])
+
+    def _handle_reverse_geocode(self, query, body):
+        self._send_json(200, self.server.state.responses["openweather_reverse"])
+
+    def _handle_weatherapi(self, query, body):
+        self._send_json(200, self.server.state.responses["weatherapi_current"])
+
+    def _handle_deepseek(self, query, body):
+        request = json.loads(body or b"{}")
+        response = self.server.state.responses["deepseek_chat"]
+        if not request.get("stream"):
+            return self._send_json(200, response)
+
+        # 流式响应：按词拆分为SSE分块
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = response["choices"][0]["message"]["content"].split(" ")
+        for index, word in enumerate(words):
+            delta = {"content": word if index == 0 else " " + word}
+            self._write_event({"id": response["id"], "object": "chat.completion.chunk", "created": response["created"],
+                               "model": response["model"],
+                               "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        self._write_event({"id": response["id"], "object": "chat.completion.chunk", "created": response["created"],
+                           "model": response["model"], "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self._write_event({"id": response["id"], "object": "chat.completion.chunk", "created": response["created"],
+                               "model": response["model"], "choices": [], "usage": response.get("usage")})
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_event(self, data):
+        self._write_chunk(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+    def _write_chunk(self, payload):
+        self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+        self.wfile.flush()
+
+    def _handle_stability(self, query, body):
+        fields = {name.decode(): value.decode() for name, value in
+                  re.findall(rb'name="([^"]+)"\r\n\r\n([^\r]*)\r\n', body)}
+        output_format = fields.get("output_format", "mp3")
+        duration = float(fields.get("duration") or 20)
+        steps = int(fields.get("steps") or 30)
+        state = self.server.state
+        time.sleep(state.faults_for("stability")["step_latency"] * steps * duration / 20)
+        content_type = "audio/wav" if output_format == "wav" else "audio/mpeg"
+        self._send(200, content_type, state.audio_for(output_format, duration, steps), {"finish-reason": "SUCCESS"})
+
+
+def start_server(host="127.0.0.1", port=0, config=None, seed=None, verbose=False):
+    """在后台线程启动模拟服务器，返回服务器对象 (server.base_url 为访问地址)"""
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.state = MockState(config, seed)
+    server.verbose = verbose
+    server.base_url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Weather/Maps/DeepSeek/Stability 本地模拟服务器')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址 (默认: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口 (默认: 8765)')
+    parser.add_argument('--config', help='按端点配置故障注入的JSON文件')
+    parser.add_argument('--latency', type=float, help='所有端点的基础延迟 (秒)')
+    parser.add_argument('--jitter', type=float, help='延迟的随机抖动幅度 (秒)')
+    parser.add_argument('--error-rate', type=float, help='返回500的比例 (0-1)')
+    parser.add_argument('--rate-limit-rate', type=float, help='返回429的比例 (0-1)')
+    parser.add_argument('--step-latency', type=float, help='Stability 每个生成步数增加的延迟 (秒，按20秒音频计)')
+    parser.add_argument('--seed', type=int, help='随机种子，用于复现相同的故障序列')
+    parser.add_argument('--verbose', action='store_true', help='打印每个请求')
+    args = parser.parse_args()
+
+    config = {}
+    if args.config:
+        with open(args.config, encoding='utf-8') as file:
+            config = json.load(file)
+    defaults = config.setdefault("default", {})
+    for field in FAULT_FIELDS:
+        if getattr(args, field) is not None:
+            defaults[field] = getattr(args, field)
+
+    server = start_server(args.host, args.port, config, args.seed, args.verbose)
+    print(f"模拟服务器运行在 {server.base_url}，按 Ctrl+C 停止")
+    print("端点: " + ", ".join(sorted(set(ROUTES.values()))))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"\n请求计数: {json.dumps(server.state.counts, ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# music_pipeline.py - 天气 → 提示词 → 音频 的流式生成流水线
+#
+# 各阶段之间用有界队列连接：音频阶段变慢时队列被填满，上游阶段自动等待 (背压)；
+# 同时后续位置的天气和提示词请求可以与前面位置的音频渲染重叠进行。
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+import requests
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib", "utils"))
+
+import api_metrics
+from audio_analysis import analyse_track
+from audio_cache import AudioCache
+from deepseek_api_test import create_client, generate_music_prompt
+from music_mapping import build_prompt, map_weather_dicts, to_records
+from prompt_cache import PromptCache
+from stability_audio import generate_audio
+from test_weather import read_locations, request_json
+
+_DONE = object()  # 阶段结束标记
+
+
+def weather_summary(data):
+    """把 OpenWeather 当前天气响应转换为提示词阶段需要的字段"""
+    weather = (data.get('weather') or [{}])[0]
+    return {
+        "description": weather.get('description', 'unknown'),
+        "condition_code": weather.get('id'),
+        "temperature": data.get('main', {}).get('temp', 0.0),
+        "humidity": data.get('main', {}).get('humidity', 0),
+        "wind_speed": data.get('wind', {}).get('speed', 0.0),
+        "city": data.get('name'),
+        "dt": data.get('dt'),
+        "timezone": data.get('timezone'),
+    }
+
+
+async def _stage(name, func, inbox, outbox, workers):
+    """从 inbox 取出条目，在线程中执行 func，把结果放入 outbox
+
+    出错的条目带着 error 字段直接传给下游，不再执行后续阶段。
+    """
+    async def worker():
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                await inbox.put(_DONE)  # 让同阶段的其他worker也能退出
+                return
+            if "error" not in item:
+                start = time.perf_counter()
+                try:
+                    await asyncio.to_thread(func, item)
+                except Exception as err:
+                    item["error"] = f"{name}: {err}"
+                item["timings"][name] = round(time.perf_counter() - start, 3)
+            await outbox.put(item)
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    await outbox.put(_DONE)
+
+
+async def run_pipeline(locations, fetch_weather, make_prompt, render_audio,
+                       queue_size=4, workers=(4, 2, 2)):
+    """异步生成每个位置的结果 (按完成顺序)
+
+    fetch_weather、make_prompt、render_audio 都是接收并修改条目字典的阻塞函数，
+    分别在独立的线程中运行；workers 依次为三个阶段的并发数。
+    """
+    to_weather = asyncio.Queue(maxsize=queue_size)
+    to_prompt = asyncio.Queue(maxsize=queue_size)
+    to_audio = asyncio.Queue(maxsize=queue_size)
+    results = asyncio.Queue(maxsize=queue_size)
+
+    async def source():
+        for location in locations:
+            await to_weather.put({"location": location, "timings": {}})
+        await to_weather.put(_DONE)
+
+    tasks = [
+        asyncio.create_task(source()),
+        asyncio.create_task(_stage("weather", fetch_weather, to_weather, to_prompt, workers[0])),
+        asyncio.create_task(_stage("prompt", make_prompt, to_prompt, to_audio, workers[1])),
+        asyncio.create_task(_stage("audio", render_audio, to_audio, results, workers[2])),
+    ]
+    try:
+        while True:
+            item = await results.get()
+            if item is _DONE:
+                break
+            yield item
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def build_stages(args, metrics=None, analysis_pool=None):
+    """根据命令行参数创建三个阶段使用的函数
+
+    提供 analysis_pool (进程池) 时，音频阶段在下载后把响度和可视化分析提交到进程池。
+    """
+    if metrics is not None:
+        session = metrics.session(pool_maxsize=sum(args.workers))
+    else:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=sum(args.workers))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+    deepseek = create_client(args.deepseek_key) if args.prompt_source == "deepseek" else None
+    cache = AudioCache(args.cache_dir) if args.cache_dir else None
+    prompt_cache = PromptCache(args.prompt_cache) if args.prompt_cache else None
+    preferences = {"vibe": args.vibe, "genre": args.genre}
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    def fetch_weather(item):
+        location = item["location"]
+        data, _ = request_json("weather", args.weather_key, location["lat"], location["lon"], session, timeout=10)
+        item["weather"] = weather_summary(data)
+
+    def map_prompt(item):
+        # 确定性映射，不访问网络
+        item["music"] = to_records(map_weather_dicts([item["weather"]]))[0]
+        item["prompt"] = build_prompt(item["music"], item["weather"], preferences)
+
+    def make_prompt(item):
+        # DeepSeek 通过 openai SDK 调用，不经过 requests，只能记录总耗时
+        with metrics.span("deepseek", "/chat/completions") if metrics is not None else nullcontext():
+            item["prompt"] = generate_music_prompt(deepseek, item["weather"], preferences,
+                                                   stream=args.stream_prompts, metrics_path=args.prompt_metrics,
+                                                   cache=prompt_cache)
+
+    def render_audio(item):
+        params = {"prompt": item["prompt"], "duration": args.duration, "steps": args.steps,
+                  "output_format": "mp3", "seed": None}
+        output_path = os.path.join(args.output_dir, f"pipeline_{item['location']['id']}_{int(time.time())}.mp3")
+        if cache is not None and cache.restore(output_path, **params):
+            item["audio"] = {"output": output_path, "cache_hit": True}
+        else:
+            item["audio"] = generate_audio(session, args.stability_key, output_path=output_path, **params)
+            if cache is not None:
+                cache.store(output_path, **params)
+        if analysis_pool is not None:
+            # 分析失败不影响已生成的音频
+            try:
+                item["analysis"] = analysis_pool.submit(analyse_track, output_path).result()
+            except Exception as err:
+                item["analysis"] = {"error": str(err)}
+
+    return fetch_weather, make_prompt if deepseek is not None else map_prompt, render_audio
+
+
+async def main_async(args, metrics=None, analysis_pool=None):
+    stages = build_stages(args, metrics, analysis_pool)
+    start = time.perf_counter()
+    completed = failed = 0
+    async for item in run_pipeline(read_locations(args.locations), *stages,
+                                   queue_size=args.queue_size, workers=tuple(args.workers)):
+        completed += 1
+        failed += "error" in item
+        print(json.dumps(item, ensure_ascii=False), flush=True)
+    elapsed = time.perf_counter() - start
+    print(f"流水线完成: {completed} 个位置, {failed} 个失败, 总耗时 {elapsed:.1f}秒", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='天气 → DeepSeek提示词 → Stability音频 流水线')
+    parser.add_argument('locations', help='坐标文件 (CSV或JSONL，需要lat/lon列)')
+    parser.add_argument('--weather-key', required=True, help='OpenWeather API密钥')
+    parser.add_argument('--deepseek-key', help='DeepSeek API密钥 (--prompt-source deepseek 时必需)')
+    parser.add_argument('--prompt-source', choices=('deepseek', 'mapping'), default='deepseek',
+                        help='提示词来源: DeepSeek生成，或由天气确定性映射 (不调用LLM)')
+    parser.add_argument('--stability-key', required=True, help='Stability AI API密钥')
+    parser.add_argument('--vibe', help='音乐氛围偏好')
+    parser.add_argument('--genre', help='音乐风格偏好')
+    parser.add_argument('--duration', type=int, default=20, help='音频时长 (秒，默认: 20)')
+    parser.add_argument('--steps', type=int, default=30, help='生成步数 (默认: 30)')
+    parser.add_argument('--output-dir', default='./output', help='音频输出目录 (默认: ./output)')
+    parser.add_argument('--cache-dir', help='音频缓存目录')
+    parser.add_argument('--prompt-cache', help='提示词缓存SQLite文件，天气特征相近时跳过DeepSeek调用')
+    parser.add_argument('--stream-prompts', action='store_true', help='以流式方式请求DeepSeek提示词')
+    parser.add_argument('--prompt-metrics', help='流式提示词的延迟指标JSONL文件 (隐含 --stream-prompts)')
+    parser.add_argument('--queue-size', type=int, default=4, help='阶段间队列容量 (默认: 4)')
+    parser.add_argument('--workers', type=int, nargs=3, default=[4, 2, 2], metavar=('WEATHER', 'PROMPT', 'AUDIO'),
+                        help='天气、提示词、音频阶段的并发数 (默认: 4 2 2)')
+    parser.add_argument('--analyse', action='store_true',
+                        help='下载后计算响度归一化增益和可视化数据 (保存为 .visual.npz，需要ffmpeg)')
+    parser.add_argument('--analysis-workers', type=int, default=2, help='分析进程数 (默认: 2)')
+    api_metrics.add_arguments(parser)
+    args = parser.parse_args()
+    if args.prompt_source == 'deepseek' and not args.deepseek_key:
+        parser.error('--prompt-source deepseek 需要 --deepseek-key')
+    args.stream_prompts = args.stream_prompts or bool(args.prompt_metrics)
+
+    metrics = api_metrics.from_args(args)
+    analysis_pool = ProcessPoolExecutor(max_workers=args.analysis_workers) if args.analyse else None
+    try:
+        asyncio.run(main_async(args, metrics, analysis_pool))
+    finally:
+        if analysis_pool is not None:
+            analysis_pool.shutdown()
+        if metrics is not None:
+            metrics.print_summary()
+            metrics.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# param_sweep.py - Stability 生成参数扫描：在延迟、文件大小和音质之间找取舍
+#
+# 对 (steps, duration, format) 网格中的每个组合重复生成若干次，记录延迟、输出大小和一个
+# 简单的音质代理指标 (1 - 谱平坦度：噪声越多越接近0)，然后输出帕累托前沿表，
+# 并给出交互使用的低延迟预设和批量生成的高质量预设。
+# 默认在进程内启动 mock_server 作为替身:
+#   python param_sweep.py --steps 10 20 30 50 --durations 10 20 --formats mp3 wav --output sweep.json
+#   python param_sweep.py --api-key KEY --base-url https://api.stability.ai --repeats 1
+#
+# mp3 的音质指标需要 ffmpeg 解码；没有 ffmpeg 时该列为空，只比较延迟和大小。
+
+import argparse
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+import mock_server
+from audio_analysis import decode_audio
+from stability_audio import BASE_URL, StabilityAPIError, generate_audio
+
+DEFAULT_PROMPT = ("A song in the 3/4 time signature that features cello, live recorded drums, and rhythmic claps, "
+                  "The mood is calm and depressing.")
+MAX_RETRIES = 3
+N_FFT = 2048
+
+
+def load_samples(path, output_format):
+    """读取生成的音频为单声道 float32 数组，返回 (采样, 采样率)；无法解码时返回 (None, None)"""
+    if output_format == "wav":
+        with wave.open(path, 'rb') as file:
+            width, channels, rate = file.getsampwidth(), file.getnchannels(), file.getframerate()
+            frames = file.readframes(file.getnframes())
+        if width != 2:
+            return None, None
+        samples = np.frombuffer(frames, dtype="<i2").reshape(-1, channels).mean(axis=1) / 32768.0
+        return samples.astype(np.float32), rate
+    try:
+        return decode_audio(path, channels=1)[:, 0], 44100
+    except RuntimeError:
+        return None, None
+
+
+def quality_proxy(samples):
+    """1 - 中位谱平坦度 (只统计非静音帧)；越接近1越“有结构”，白噪声接近0"""
+    if samples is None or len(samples) < N_FFT:
+        return None
+    frames = np.lib.stride_tricks.sliding_window_view(samples, N_FFT)[::N_FFT // 2]
+    power = np.abs(np.fft.rfft(frames * np.hanning(N_FFT).astype(np.float32), axis=1)) ** 2 + 1e-12
+    mean = power.mean(axis=1)
+    loud = mean > mean.max() * 1e-4
+    if not loud.any():
+        return None
+    flatness = np.exp(np.log(power[loud]).mean(axis=1)) / mean[loud]
+    return round(float(1.0 - np.median(flatness)), 4)
+
+
+def run_point(session, api_key, prompt, steps, duration, output_format, repeats, base_url, workdir):
+    """对一个参数组合生成 repeats 次，返回汇总字典"""
+    latencies, sizes, qualities, errors = [], [], [], []
+    for repeat in range(repeats):
+        output_path = os.path.join(workdir, f"sweep_{steps}_{duration}_{repeat}.{output_format}")
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                result = generate_audio(session, api_key, prompt, output_path, duration=duration, steps=steps,
+                                        output_format=output_format, base_url=base_url, timeout=300)
+                break
+            except StabilityAPIError as err:
+                if not err.retryable or attempt == MAX_RETRIES:
+                    errors.append(str(err))
+                    result = None
+                    break
+                time.sleep(err.retry_after or 2 ** attempt)
+            except requests.exceptions.RequestException as err:
+                errors.append(str(err))
+                result = None
+                break
+        if result is None:
+            continue
+        latencies.append(result["elapsed"])
+        sizes.append(result["bytes"])
+        qualities.append(quality_proxy(load_samples(output_path, output_format)[0]))
+        os.unlink(output_path)
+
+    measured = [quality for quality in qualities if quality is not None]
+    return {
+        "steps": steps,
+        "duration": duration,
+        "format": output_format,
+        "runs": len(latencies),
+        "errors": len(errors),
+        "latency": round(statistics.median(latencies), 3) if latencies else None,
+        "latency_max": round(max(latencies), 3) if latencies else None,
+        "bytes": int(statistics.median(sizes)) if sizes else None,
+        "quality": round(statistics.median(measured), 4) if measured else None,
+        "last_error": errors[-1] if errors else None,
+    }
+
+
+def _dominates(a, b):
+    """a 在延迟、大小、音质上都不差于 b，且至少一项更好
+
+    音质未知的组合不能支配音质已知的组合；两者都未知时只比较延迟和大小。
+    """
+    if a["quality"] is None and b["quality"] is not None:
+        return False
+    both_quality = b["quality"] is not None
+    no_worse = (a["latency"] <= b["latency"] and a["bytes"] <= b["bytes"]
+                and (not both_quality or a["quality"] >= b["quality"]))
+    better = (a["latency"] < b["latency"] or a["bytes"] < b["bytes"]
+              or (both_quality and a["quality"] > b["quality"]))
+    return no_worse and better
+
+
+def pareto_front(rows):
+    """标记每行是否在帕累托前沿上 (只比较相同时长的组合，时长是需求而不是可以牺牲的指标)"""
+    measured = [row for row in rows if row["runs"]]
+    for row in rows:
+        row["pareto"] = bool(row["runs"]) and not any(
+            other is not row and other["duration"] == row["duration"] and _dominates(other, row)
+            for other in measured
+        )
+    return rows
+
+
+def choose_presets(rows, min_quality=None, max_latency=None, batch_max_latency=None):
+    """交互预设：满足音质下限和延迟上限的最快组合；批量预设：延迟预算内音质最高的组合"""
+    candidates = [row for row in rows if row.get("pareto")]
+
+    def quality(row):
+        return row["quality"] if row["quality"] is not None else -1.0
+
+    interactive = [row for row in candidates
+                   if (min_quality is None or quality(row) >= min_quality)
+                   and (max_latency is None or row["latency"] <= max_latency)]
+    batch = [row for row in candidates if batch_max_latency is None or row["latency"] <= batch_max_latency]
+    presets = {}
+    if interactive:
+        best = min(interactive, key=lambda row: (row["latency"], -quality(row)))
+        presets["interactive"] = {key: best[key] for key in ("steps", "duration", "format", "latency", "quality")}
+    if batch:
+        best = max(batch, key=lambda row: (quality(row), row["steps"], -row["latency"]))
+        presets["batch"] = {key: best[key] for key in ("steps", "duration", "format", "latency", "quality")}
+    return presets
+
+
+def format_table(rows):
+    header = f"{'steps':>5} {'时长':>4} {'格式':>4} {'延迟(秒)':>9} {'最大':>7} {'大小(KB)':>9} {'音质':>7} {'错误':>4}  前沿"
+    lines = [header]
+    for row in sorted(rows, key=lambda row: (row["duration"], row["format"], row["steps"])):
+        if not row["runs"]:
+            lines.append(f"{row['steps']:>5} {row['duration']:>6} {row['format']:>6} {'-':>11} {'-':>7} "
+                         f"{'-':>11} {'-':>7} {row['errors']:>6}")
+            continue
+        quality = f"{row['quality']:.3f}" if row["quality"] is not None else "-"
+        lines.append(f"{row['steps']:>5} {row['duration']:>6} {row['format']:>6} {row['latency']:>11.2f} "
+                     f"{row['latency_max']:>7.2f} {row['bytes'] / 1024:>11.1f} {quality:>7} {row['errors']:>6}"
+                     f"  {'*' if row['pareto'] else ''}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='扫描Stability生成参数，输出延迟/大小/音质的帕累托表')
+    parser.add_argument('--steps', type=int, nargs='+', default=[10, 20, 30, 50], help='生成步数 (默认: 10 20 30 50)')
+    parser.add_argument('--durations', type=int, nargs='+', default=[10, 20], help='音频时长 (秒，默认: 10 20)')
+    parser.add_argument('--formats', nargs='+', default=['mp3'], choices=('mp3', 'wav'), help='输出格式 (默认: mp3)')
+    parser.add_argument('--repeats', type=int, default=3, help='每个组合的重复次数 (默认: 3)')
+    parser.add_argument('--prompt', default=DEFAULT_PROMPT, help='生成提示词')
+    parser.add_argument('--api-key', default='sweep', help='Stability API密钥 (使用模拟服务器时可省略)')
+    parser.add_argument('--base-url', help='Stability 基础URL；省略时在进程内启动模拟服务器')
+    parser.add_argument('--mock-step-latency', type=float, default=0.01,
+                        help='模拟服务器每步增加的延迟 (秒，按20秒音频计，默认: 0.01)')
+    parser.add_argument('--min-quality', type=float, help='交互预设的最低音质')
+    parser.add_argument('--max-latency', type=float, help='交互预设的最大延迟 (秒)')
+    parser.add_argument('--batch-max-latency', type=float, help='批量预设的最大延迟 (秒)')
+    parser.add_argument('--output', help='把结果和预设保存为JSON文件')
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url.rstrip('/') if args.base_url else None
+    if base_url is None:
+        server = mock_server.start_server(config={"endpoints": {"stability": {"step_latency": args.mock_step_latency}}})
+        base_url = server.base_url
+    if base_url == BASE_URL and args.api_key == 'sweep':
+        parser.error('请求 Stability 正式端点需要 --api-key')
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=1)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    grid = list(itertools.product(args.steps, args.durations, args.formats))
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for index, (steps, duration, output_format) in enumerate(grid, 1):
+                row = run_point(session, args.api_key, args.prompt, steps, duration, output_format, args.repeats,
+                                base_url, workdir)
+                rows.append(row)
+                print(f"[{index}/{len(grid)}] steps={steps} duration={duration} format={output_format}: "
+                      f"延迟 {row['latency']}秒, 音质 {row['quality']}, 错误 {row['errors']}", file=sys.stderr)
+    finally:
+        session.close()
+        if server is not None:
+            server.shutdown()
+
+    pareto_front(rows)
+    presets = choose_presets(rows, args.min_quality, args.max_latency, args.batch_max_latency)
+    print(format_table(rows))
+    for name, preset in presets.items():
+        print(f"{name} 预设: {json.dumps(preset, ensure_ascii=False)}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({"base_url": base_url, "prompt": args.prompt, "repeats": args.repeats,
+                       "results": rows, "presets": presets}, file, ensure_ascii=False, indent=2)
+        print(f"结果已保存至: {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
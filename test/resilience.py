@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# resilience.py - 所有API客户端共用的断路器和对冲请求
+#
+# 每个上游一个断路器，按滚动时间窗口内的错误率和慢请求比例决定是否打开；
+# 打开后在冷却时间内直接抛出 CircuitOpenError (不再等满5秒或120秒的超时)，
+# 冷却结束进入半开状态，放行少量探测请求，成功则恢复。
+# 幂等的 GET/HEAD 请求在等待超过该上游最近 p95 延迟后发出第二个请求 (对冲)，取先返回的结果，
+# 对冲次数受预算限制，避免在上游变慢时成倍放大负载。POST (例如 Stability 生成) 从不对冲。
+#   registry = BreakerRegistry(metrics=metrics)
+#   session = ResilientSession(requests.Session(), registry)
+#   session.get("https://api.openweathermap.org/data/2.5/weather?...", timeout=5)
+#
+# 断路器状态通过 api_metrics 导出为 api_circuit_state (0=关闭, 1=半开, 2=打开)。
+
+import argparse
+import json
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from api_metrics import upstream_name
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """断路器打开，请求未发送
+
+    继承 RequestException，现有的网络错误处理会把它当作一次快速失败；
+    retry_after 为距离半开状态的秒数。
+    """
+
+    def __init__(self, upstream, retry_after):
+        super().__init__(f"{upstream} 断路器已打开，{retry_after:.1f}秒后重试")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """按滚动窗口统计的断路器
+
+    窗口内调用数达到 min_calls 且错误率 ≥ error_threshold，或耗时超过 slow_call_seconds 的比例
+    ≥ slow_call_threshold 时打开；打开 open_seconds 后半开，放行 half_open_calls 个探测请求。
+    """
+
+    def __init__(self, name, window=30.0, min_calls=10, error_threshold=0.5, slow_call_seconds=None,
+                 slow_call_threshold=0.8, open_seconds=30.0, half_open_calls=1, on_change=None):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_threshold = error_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_threshold = slow_call_threshold
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.on_change = on_change
+        self.state = CLOSED
+        self.rejected = 0
+        self._calls = deque()  # (时间, 是否成功, 耗时)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    def _transition(self, state, now):
+        previous, self.state = self.state, state
+        if state == OPEN:
+            self._opened_at = now
+        if state != CLOSED:
+            self._probes = 0
+        if state == CLOSED:
+            self._calls.clear()  # 恢复后重新统计，避免旧错误立即再次打开
+        if self.on_change is not None and previous != state:
+            self.on_change(self, previous, state)
+
+    def allow(self):
+        """请求前调用：允许时返回，不允许时抛出 CircuitOpenError"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.open_seconds - now
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, remaining)
+                self._transition(HALF_OPEN, now)
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, 0.0)
+                self._probes += 1
+
+    def record(self, success, seconds):
+        """请求结束后调用"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._transition(CLOSED if success else OPEN, now)
+                return
+            self._calls.append((now, success, seconds))
+            self._prune(now)
+            calls = len(self._calls)
+            slow_call = self.slow_call_seconds is not None and seconds >= self.slow_call_seconds
+            if (success and not slow_call) or calls < self.min_calls:
+                return  # 只在失败或慢请求时判断是否打开
+            errors = sum(1 for _, ok, _ in self._calls if not ok)
+            slow = 0
+            if self.slow_call_seconds is not None:
+                slow = sum(1 for _, _, elapsed in self._calls if elapsed >= self.slow_call_seconds)
+            if errors / calls >= self.error_threshold or slow / calls >= self.slow_call_threshold:
+                self._transition(OPEN, now)
+
+    def release(self):
+        """请求未能完成 (不是上游的问题) 时调用：归还半开状态的探测名额，不计入统计"""
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def latency_quantile(self, quantile=0.95, min_samples=5):
+        """窗口内成功请求耗时的分位数，样本不足时返回 None"""
+        with self._lock:
+            self._prune(time.monotonic())
+            latencies = sorted(elapsed for _, ok, elapsed in self._calls if ok)
+        if len(latencies) < min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * quantile))]
+
+    def snapshot(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            calls = len(self._calls)
+            errors = sum(1 for _, ok, _ in self._calls if not ok)
+            return {"state": self.state, "calls": calls, "error_rate": round(errors / calls, 3) if calls else 0.0,
+                    "rejected": self.rejected}
+
+
+class BreakerRegistry:
+    """按上游名称创建和查找断路器，状态变化时更新 api_metrics 的指标"""
+
+    def __init__(self, metrics=None, overrides=None, **defaults):
+        self.metrics = metrics
+        self.defaults = defaults
+        self.overrides = overrides or {}  # 上游 -> CircuitBreaker 参数
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, upstream):
+        with self._lock:
+            breaker = self._breakers.get(upstream)
+            if breaker is None:
+                options = dict(self.defaults, **self.overrides.get(upstream, {}))
+                breaker = self._breakers[upstream] = CircuitBreaker(upstream, on_change=self._changed, **options)
+                self._publish(breaker.name, breaker.state)
+            return breaker
+
+    def _changed(self, breaker, previous, state):
+        self._publish(breaker.name, state)
+        if self.metrics is not None:
+            self.metrics.inc_counter("api_circuit_transitions_total", 1, "Circuit breaker state transitions.",
+                                     upstream=breaker.name, state=state)
+
+    def _publish(self, upstream, state):
+        if self.metrics is not None:
+            self.metrics.set_gauge("api_circuit_state", STATE_VALUES[state],
+                                   "Circuit breaker state (0=closed, 1=half_open, 2=open).", upstream=upstream)
+
+    def rejected(self, upstream):
+        if self.metrics is not None:
+            self.metrics.inc_counter("api_circuit_rejections_total", 1,
+                                     "Requests rejected without being sent because the breaker was open.",
+                                     upstream=upstream)
+
+    def states(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+def _failed(response):
+    """429和5xx计为上游故障；其他4xx是调用方的问题，不影响断路器"""
+    return response.status_code == 429 or response.status_code >= 500
+
+
+class ResilientSession:
+    """包装 requests.Session (或 InstrumentedSession)，为每个请求加上断路器和对冲
+
+    对冲延迟为该上游最近成功请求耗时的 p95 (限制在 [min_hedge_delay, max_hedge_delay] 内，
+    样本不足时使用 max_hedge_delay)；对冲请求数不超过总请求数的 hedge_budget。
+    """
+
+    HEDGE_METHODS = ("GET", "HEAD")
+
+    def __init__(self, session, registry=None, hedge=True, hedge_quantile=0.95, min_hedge_delay=0.05,
+                 max_hedge_delay=1.0, hedge_budget=0.1, max_workers=16):
+        self.session = session
+        self.registry = registry or BreakerRegistry()
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.hedge_budget = hedge_budget
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if hedge else None
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        upstream = upstream_name(url)
+        breaker = self.registry.get(upstream)
+        try:
+            breaker.allow()
+        except CircuitOpenError:
+            self.counts["rejected"] += 1
+            self.registry.rejected(upstream)
+            raise
+
+        start = time.perf_counter()
+        try:
+            if self._can_hedge(method, kwargs):
+                response = self._hedged(breaker, method, url, kwargs)
+            else:
+                response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            breaker.record(False, time.perf_counter() - start)
+            raise
+        except BaseException:
+            # 其他异常 (参数错误、KeyboardInterrupt 等) 不说明上游状态，但必须归还探测名额，
+            # 否则半开的断路器会一直拒绝后续请求
+            breaker.release()
+            raise
+        breaker.record(not _failed(response), time.perf_counter() - start)
+        return response
+
+    def _can_hedge(self, method, kwargs):
+        if not self.hedge or method.upper() not in self.HEDGE_METHODS or kwargs.get("stream"):
+            return False
+        with self._lock:
+            self.counts["requests"] += 1
+            return self.counts["hedged"] < self.counts["requests"] * self.hedge_budget + 1
+
+    def hedge_delay(self, breaker):
+        quantile = breaker.latency_quantile(self.hedge_quantile)
+        if quantile is None:
+            return self.max_hedge_delay
+        return min(max(quantile, self.min_hedge_delay), self.max_hedge_delay)
+
+    def _hedged(self, breaker, method, url, kwargs):
+        """先发一个请求，超过对冲延迟仍未返回时再发一个，返回先成功的响应"""
+        primary = self._executor.submit(self.session.request, method, url, **kwargs)
+        done, _ = wait([primary], timeout=self.hedge_delay(breaker))
+        if done:
+            return primary.result()
+
+        with self._lock:
+            self.counts["hedged"] += 1
+        secondary = self._executor.submit(self.session.request, method, url, **kwargs)
+        pending = {primary, secondary}
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except requests.exceptions.RequestException as err:
+                    last_error = err
+                    continue
+                if _failed(response) and pending:
+                    last_error = response
+                    continue
+                for other in pending:
+                    # 落后的请求完成后直接丢弃，释放连接
+                    other.add_done_callback(lambda late: late.exception() is None and late.result().close())
+                if future is secondary:
+                    with self._lock:
+                        self.counts["hedge_wins"] += 1
+                return response
+        if isinstance(last_error, requests.Response):
+            return last_error
+        raise last_error
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def add_arguments(parser):
+    """为脚本添加统一的断路器/对冲参数"""
+    parser.add_argument('--resilient', action='store_true', help='启用断路器和GET请求对冲')
+    parser.add_argument('--breaker-open-seconds', type=float, default=30.0, help='断路器打开后的冷却时间 (秒)')
+    parser.add_argument('--breaker-slow-seconds', type=float,
+                        help='耗时超过此值 (秒) 计为慢请求，窗口内慢请求过多时打开断路器 (默认按脚本设置)')
+
+
+def registry_from_args(args, metrics=None, **defaults):
+    """根据命令行参数创建 BreakerRegistry，未启用时返回 None
+
+    defaults 为各脚本按自身请求量和超时设置的断路器参数 (window、min_calls、slow_call_seconds 等)，
+    --breaker-slow-seconds 覆盖其中的 slow_call_seconds。
+    """
+    if not args.resilient:
+        return None
+    if args.breaker_slow_seconds is not None:
+        defaults["slow_call_seconds"] = args.breaker_slow_seconds
+    return BreakerRegistry(metrics=metrics, open_seconds=args.breaker_open_seconds, **defaults)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对同一URL反复请求，观察断路器和对冲的效果')
+    parser.add_argument('url', help='请求的URL (例如模拟服务器的 /data/2.5/weather)')
+    parser.add_argument('--requests', type=int, default=50, help='请求次数 (默认: 50)')
+    parser.add_argument('--timeout', type=float, default=5.0, help='单次请求超时 (秒)')
+    parser.add_argument('--max-hedge-delay', type=float, default=1.0, help='对冲延迟上限 (秒，默认: 1.0)')
+    parser.add_argument('--no-hedge', action='store_true', help='关闭对冲')
+    args = parser.parse_args()
+
+    session = ResilientSession(requests.Session(), hedge=not args.no_hedge, max_hedge_delay=args.max_hedge_delay)
+    latencies, outcomes = [], Counter()
+    with session:
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            try:
+                response = session.get(args.url, timeout=args.timeout)
+                outcomes[response.status_code] += 1
+            except CircuitOpenError:
+                outcomes["rejected"] += 1
+            except requests.exceptions.RequestException as err:
+                outcomes[type(err).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(json.dumps({
+        "outcomes": {str(key): value for key, value in outcomes.items()},
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1),
+        "session": dict(session.counts),
+        "breakers": session.registry.states(),
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
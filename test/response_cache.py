@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# response_cache.py - API响应缓存 (内存LRU + 可选SQLite持久化，按端点设置TTL)
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# 各端点的默认缓存时间 (秒)：反向地理编码几乎不变，预报每小时更新
+DEFAULT_TTLS = {
+    "weather": 10 * 60,
+    "forecast": 60 * 60,
+    "geocoding": 30 * 24 * 60 * 60,
+}
+DEFAULT_TTL = 10 * 60
+
+
+class ResponseCache:
+    """线程安全的响应缓存
+
+    键是元组，第一个元素为端点名称，用于查找该端点的TTL。
+    内存层按LRU淘汰；指定 db_path 时未命中内存的查询会再查SQLite，
+    写入同时落盘，因此缓存可以跨进程运行复用。
+    """
+
+    def __init__(self, max_entries=1024, ttls=None, db_path=None, max_disk_entries=100000, precision=2):
+        self.max_entries = max_entries
+        self.precision = precision
+        self.max_disk_entries = max_disk_entries
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self._entries = OrderedDict()  # key -> (过期时间, 值)
+        self._lock = threading.RLock()
+        self._writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+            self._db.commit()
+
+    def make_key(self, endpoint, latitude, longitude, units="metric"):
+        """构建缓存键：坐标四舍五入到 precision 位小数 (2位约为1公里)"""
+        return (endpoint, round(latitude, self.precision), round(longitude, self.precision), units)
+
+    def ttl_for(self, key):
+        return self.ttls.get(key[0], DEFAULT_TTL)
+
+    def get(self, key):
+        """返回缓存值，未命中或已过期时返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+
+            value = self._disk_get(key, now)
+            if value is not None:
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        expires = time.time() + self.ttl_for(key)
+        with self._lock:
+            self._remember(key, expires, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                    (json.dumps(key), json.dumps(value), expires, time.time()),
+                )
+                self._writes += 1
+                if self._writes % 100 == 0:
+                    self._prune_disk()
+                self._db.commit()
+
+    def stats(self):
+        """返回命中、未命中和淘汰计数"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._prune_disk()
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _remember(self, key, expires, value):
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_get(self, key, now):
+        if self._db is None:
+            return None
+        db_key = json.dumps(key)
+        row = self._db.execute("SELECT value, expires FROM cache WHERE key = ?", (db_key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now:
+            self._db.execute("DELETE FROM cache WHERE key = ?", (db_key,))
+            self._db.commit()
+            self.expirations += 1
+            return None
+        self._db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, db_key))
+        self._db.commit()
+        value = json.loads(row[0])
+        self._remember(key, row[1], value)
+        return value
+
+    def _prune_disk(self):
+        """删除过期条目，并按最近访问时间只保留 max_disk_entries 条"""
+        self._db.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+        cursor = self._db.execute(
+            "DELETE FROM cache WHERE key IN ("
+            "SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+        self.evictions += max(cursor.rowcount, 0)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# route_engine.py - 批量路线/距离查询：合并重复和反向的起终点对，并发请求并缓存结果
+#
+# 在音乐标记之间规划“声音漫步”时需要所有标记两两之间的路线，逐个顺序请求是 O(n²) 次往返。
+# 这里先把起终点规范化 (步行和骑行时 A→B 与 B→A 视为同一条路线)，缓存中没有的才并发请求
+# Directions API；结果 (包括编码折线) 按TTL缓存，可选SQLite持久化。
+# 折线解码为 int32 的 (点数, 2) 数组 (单位 1e-5 度)，每个点只占8字节。
+#   python route_engine.py pairs.csv --mode walking --cache-db routes.sqlite
+#   python route_engine.py markers.csv --matrix --mode walking
+#
+# pairs.csv 需要 origin,destination 两列 (地名或 "纬度,经度")；markers.csv 需要 lat/lon 列或 name 列。
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import numpy as np
+import requests
+
+import api_metrics
+import test_googleapi
+from response_cache import ResponseCache
+from test_googleapi import create_session
+
+DEFAULT_TTL = 24 * 60 * 60  # 路线很少变化
+SYMMETRIC_MODES = ("walking", "bicycling")  # 这些方式下反向路线按相同路线处理 (驾车有单行道)
+
+
+class DirectionsError(Exception):
+    """Directions API 返回了非 OK 状态"""
+
+    def __init__(self, status, message=None):
+        super().__init__(f"Directions API 返回 {status}" + (f": {message}" if message else ""))
+        self.status = status
+
+
+def decode_polyline(points):
+    """把 Google 编码折线解码为 int32 数组 (点数, 2)，列为 (纬度, 经度)，单位 1e-5 度
+
+    每个字符减63后低5位是数据、0x20表示后续还有字符；按块拼接、zigzag解码后累加即为坐标。
+    """
+    if not points:
+        return np.empty((0, 2), dtype=np.int32)
+    values = np.frombuffer(points.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    ends = np.flatnonzero((values & 0x20) == 0)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    # 每个字符在所属数值中的位置 (第几个5位)
+    position = np.arange(len(values)) - np.repeat(starts, ends - starts + 1)
+    numbers = np.add.reduceat((values & 0x1f) << (5 * position), starts)
+    deltas = np.where(numbers & 1, ~(numbers >> 1), numbers >> 1)
+    deltas = deltas[:len(deltas) // 2 * 2].reshape(-1, 2)
+    return np.cumsum(deltas, axis=0).astype(np.int32)
+
+
+def to_degrees(path):
+    return path.astype(np.float64) / 1e5
+
+
+def normalise_point(point):
+    """把地名或坐标规范化为请求使用的字符串 (坐标保留5位小数，约1米)"""
+    if isinstance(point, (tuple, list)):
+        return f"{float(point[0]):.5f},{float(point[1]):.5f}"
+    text = " ".join(str(point).split())
+    try:
+        latitude, longitude = (float(part) for part in text.split(","))
+        return f"{latitude:.5f},{longitude:.5f}"
+    except ValueError:
+        return text.lower()
+
+
+def canonical_pair(origin, destination, mode="walking"):
+    """返回 (缓存键, 是否反向)；对称方式下按字典序排列起终点，使 A→B 与 B→A 共享键"""
+    origin, destination = normalise_point(origin), normalise_point(destination)
+    reverse = mode in SYMMETRIC_MODES and destination < origin
+    if reverse:
+        origin, destination = destination, origin
+    return ("directions", origin, destination, mode), reverse
+
+
+def summarise_route(data):
+    """从 Directions 响应中提取可缓存的字段 (可JSON序列化)"""
+    status = data.get("status", "OK")
+    if status != "OK" or not data.get("routes"):
+        raise DirectionsError(status if status != "OK" else "ZERO_RESULTS", data.get("error_message"))
+    route = data["routes"][0]
+    legs = route.get("legs") or []
+    return {
+        "distance": sum(leg["distance"]["value"] for leg in legs if "value" in leg.get("distance", {})),
+        "duration": sum(leg["duration"]["value"] for leg in legs if "value" in leg.get("duration", {})),
+        "start_address": legs[0].get("start_address") if legs else None,
+        "end_address": legs[-1].get("end_address") if legs else None,
+        "polyline": route.get("overview_polyline", {}).get("points", ""),
+        "summary": route.get("summary"),
+    }
+
+
+class RouteEngine:
+    """带缓存的批量路线查询
+
+    route_many() 返回与输入顺序一致的结果；每个结果包含距离 (米)、时间 (秒)、地址和
+    path (int32 坐标数组)，反向对的结果会把起终点和路径顺序翻转回来。
+    """
+
+    def __init__(self, api_key, session, cache=None, workers=8, timeout=10):
+        self.api_key = api_key
+        self.session = session
+        self.cache = cache if cache is not None else ResponseCache(ttls={"directions": DEFAULT_TTL})
+        self.workers = workers
+        self.timeout = timeout
+        self.requests = 0
+
+    def fetch(self, key):
+        """请求一条规范化的路线并写入缓存"""
+        _, origin, destination, mode = key
+        query = urlencode({"origin": origin, "destination": destination, "mode": mode, "key": self.api_key})
+        response = self.session.get(f"{test_googleapi.MAPS_BASE_URL}/maps/api/directions/json?{query}",
+                                    timeout=self.timeout)
+        self.requests += 1
+        response.raise_for_status()
+        summary = summarise_route(response.json())
+        self.cache.put(key, summary)
+        return summary
+
+    @staticmethod
+    def _result(summary, reverse):
+        result = {name: value for name, value in summary.items() if name != "polyline"}
+        path = decode_polyline(summary["polyline"])
+        if reverse:
+            result["start_address"], result["end_address"] = result["end_address"], result["start_address"]
+            path = path[::-1].copy()
+        result["path"] = path
+        return result
+
+    def route_many(self, pairs, mode="walking"):
+        """查询多个 (起点, 终点)，重复和反向的对只请求一次；失败的对返回 {"error": ...}"""
+        canonical = [canonical_pair(origin, destination, mode) for origin, destination in pairs]
+        summaries = {}
+        missing = {}  # 保持顺序的去重集合
+        for key, _ in canonical:
+            if key in summaries or key in missing:
+                continue
+            cached = self.cache.get(key)
+            if cached is not None:
+                summaries[key] = cached
+            else:
+                missing[key] = None
+
+        def fetch(key):
+            try:
+                return key, self.fetch(key)
+            except (requests.exceptions.RequestException, DirectionsError, ValueError, KeyError) as err:
+                return key, err
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for key, summary in executor.map(fetch, missing):
+                summaries[key] = summary
+
+        results = []
+        for key, reverse in canonical:
+            summary = summaries[key]
+            results.append({"error": str(summary)} if isinstance(summary, Exception) else self._result(summary, reverse))
+        return results
+
+    def route(self, origin, destination, mode="walking"):
+        return self.route_many([(origin, destination)], mode)[0]
+
+    def matrix(self, markers, mode="walking"):
+        """所有标记两两之间的距离和时间矩阵 (失败的对为 NaN)
+
+        对称方式下只请求 n(n-1)/2 条路线。
+        """
+        count = len(markers)
+        pairs = [(i, j) for i in range(count) for j in range(count) if i != j
+                 and (mode not in SYMMETRIC_MODES or i < j)]
+        results = self.route_many([(markers[i], markers[j]) for i, j in pairs], mode)
+        distances = np.full((count, count), np.nan)
+        durations = np.full((count, count), np.nan)
+        np.fill_diagonal(distances, 0.0)
+        np.fill_diagonal(durations, 0.0)
+        for (i, j), result in zip(pairs, results):
+            if "error" in result:
+                continue
+            distances[i, j], durations[i, j] = result["distance"], result["duration"]
+            if mode in SYMMETRIC_MODES:
+                distances[j, i], durations[j, i] = result["distance"], result["duration"]
+        return distances, durations
+
+
+def soundwalk_order(durations, start=0):
+    """最近邻贪心：从 start 出发每次走向用时最短的未访问标记，返回访问顺序"""
+    count = len(durations)
+    order = [start]
+    visited = np.zeros(count, dtype=bool)
+    visited[start] = True
+    for _ in range(count - 1):
+        row = np.where(visited, np.inf, np.nan_to_num(durations[order[-1]], nan=np.inf))
+        following = int(np.argmin(row))
+        if not np.isfinite(row[following]):
+            following = int(np.flatnonzero(~visited)[0])  # 剩余标记都不可达时按原顺序追加
+        order.append(following)
+        visited[following] = True
+    return order
+
+
+def read_rows(path):
+    with open(path, newline='', encoding='utf-8') as file:
+        if path.endswith(('.jsonl', '.ndjson')):
+            return [json.loads(line) for line in file if line.strip()]
+        return list(csv.DictReader(file))
+
+
+def marker_point(row):
+    if row.get('lat') not in (None, '') and row.get('lon') not in (None, ''):
+        return float(row['lat']), float(row['lon'])
+    return row.get('name') or row.get('address')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量查询Directions路线，合并重复/反向的起终点对并缓存结果')
+    parser.add_argument('inputs', help='起终点对文件 (origin,destination 列)，或配合 --matrix 的标记文件')
+    parser.add_argument('--api-key', default=os.environ.get("GOOGLE_MAPS_API_KEY", ""), help='Google Maps API密钥')
+    parser.add_argument('--base-url', help='替代 maps.googleapis.com 的基础URL (例如本地模拟服务器)')
+    parser.add_argument('--mode', default='walking', choices=('walking', 'bicycling', 'driving', 'transit'),
+                        help='出行方式 (默认: walking)')
+    parser.add_argument('--matrix', action='store_true', help='计算所有标记两两之间的矩阵和漫步顺序')
+    parser.add_argument('--workers', type=int, default=8, help='并发请求数 (默认: 8)')
+    parser.add_argument('--cache-db', help='SQLite缓存文件，跨运行复用路线')
+    parser.add_argument('--ttl', type=float, default=DEFAULT_TTL, help=f'路线缓存时间 (秒，默认: {DEFAULT_TTL})')
+    parser.add_argument('--with-path', action='store_true', help='在输出中包含路径坐标 (度)')
+    api_metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.base_url:
+        test_googleapi.MAPS_BASE_URL = args.base_url.rstrip('/')
+
+    metrics = api_metrics.from_args(args)
+    session = create_session(args.workers, metrics)
+    cache = ResponseCache(max_entries=100000, ttls={"directions": args.ttl}, db_path=args.cache_db)
+    engine = RouteEngine(args.api_key, session, cache, args.workers)
+    rows = read_rows(args.inputs)
+    start = time.perf_counter()
+    try:
+        if args.matrix:
+            markers = [marker_point(row) for row in rows]
+            distances, durations = engine.matrix(markers, args.mode)
+            order = soundwalk_order(durations)
+            print(json.dumps({
+                "markers": [normalise_point(marker) for marker in markers],
+                "distance": np.where(np.isnan(distances), None, distances).tolist(),
+                "duration": np.where(np.isnan(durations), None, durations).tolist(),
+                "soundwalk": order,
+                "soundwalk_duration": float(np.nansum([durations[a, b] for a, b in zip(order, order[1:])])),
+            }, ensure_ascii=False))
+        else:
+            pairs = [(row['origin'], row['destination']) for row in rows]
+            for (origin, destination), result in zip(pairs, engine.route_many(pairs, args.mode)):
+                path = result.pop("path", None)
+                result.update(origin=origin, destination=destination)
+                if path is not None:
+                    result["points"] = len(path)
+                    if args.with_path:
+                        result["path"] = to_degrees(path).round(5).tolist()
+                print(json.dumps(result, ensure_ascii=False))
+        print(f"{len(rows)} 条输入, {engine.requests} 次API请求, 耗时 {time.perf_counter() - start:.2f}秒, "
+              f"缓存: {json.dumps(cache.stats(), ensure_ascii=False)}", file=sys.stderr)
+    finally:
+        cache.close()
+        session.close()
+        if metrics is not None:
+            metrics.print_summary()
+            metrics.close()
+
+
+if __name__ == "__main__":
+    main()
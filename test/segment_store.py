@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# segment_store.py - 把生成的音轨打包进只追加的大段文件，并通过HTTP Range提供播放
+#
+# 每个段文件依次追加多条音轨，SQLite索引记录 (段号, 偏移, 长度)。
+# 读取通过 mmap 切片，HTTP服务器用 os.sendfile 把段文件中的字节范围直接写入套接字，
+# 客户端可以拖动进度条或边下边播；几万条音轨也只占用少量文件和inode。
+#   python segment_store.py ./store import ./output
+#   python segment_store.py ./store serve --port 8090
+#   curl -r 0-1023 http://127.0.0.1:8090/tracks/stability_audio_1743949305
+
+import argparse
+import glob
+import hashlib
+import json
+import mimetypes
+import mmap
+import os
+import re
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+DEFAULT_SEGMENT_SIZE = 256 * 1024 * 1024  # 256 MB
+COPY_CHUNK = 1024 * 1024
+SENDFILE_CHUNK = 8 * 1024 * 1024
+
+
+class SegmentStore:
+    """只追加的段文件音轨存储
+
+    索引是唯一的事实来源：写入先追加数据并fsync，再提交索引；
+    打开时把最后一个段截断到索引记录的末尾，并删除编号更大的段，丢弃中断写入留下的残余数据。
+    内容相同的音轨 (SHA-256相同) 只存一份，多个id指向同一范围。
+    """
+
+    def __init__(self, root, segment_size=DEFAULT_SEGMENT_SIZE):
+        self.root = root
+        self.segment_size = segment_size
+        self._lock = threading.RLock()
+        self._files = {}  # 段号 -> 只读文件对象 (供 sendfile 使用)
+        self._maps = {}  # 段号 -> mmap
+        os.makedirs(root, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS tracks ("
+            "track_id TEXT PRIMARY KEY, segment INTEGER NOT NULL, offset INTEGER NOT NULL, "
+            "length INTEGER NOT NULL, sha256 TEXT NOT NULL, content_type TEXT NOT NULL, "
+            "created REAL NOT NULL, meta TEXT);"
+            "CREATE INDEX IF NOT EXISTS tracks_sha256 ON tracks (sha256);"
+        )
+        self._db.commit()
+        self._active, self._end = self._recover()
+
+    def segment_path(self, segment):
+        return os.path.join(self.root, f"segment-{segment:06d}.dat")
+
+    def _recover(self):
+        """返回 (当前段号, 追加位置)，并丢弃未记入索引的数据
+
+        当前段截断到索引记录的末尾；切换到新段后、提交索引前中断时，
+        编号更大的段里没有任何已索引的音轨，直接删除。
+        """
+        row = self._db.execute(
+            "SELECT segment, MAX(offset + length) FROM tracks WHERE segment = (SELECT MAX(segment) FROM tracks)"
+        ).fetchone()
+        segment, end = (row[0], row[1]) if row and row[0] is not None else (1, 0)
+        path = self.segment_path(segment)
+        if os.path.exists(path) and os.path.getsize(path) > end:
+            os.truncate(path, end)
+        for other in glob.glob(os.path.join(self.root, "segment-*.dat")):
+            match = re.search(r"segment-(\d+)\.dat$", other)
+            if match and int(match.group(1)) > segment:
+                os.unlink(other)
+        return segment, end
+
+    def append(self, track_id, src_path, content_type=None, meta=None):
+        """把文件追加到当前段并记录索引，返回 (段号, 偏移, 长度)"""
+        content_type = content_type or mimetypes.guess_type(src_path)[0] or "application/octet-stream"
+        length = os.path.getsize(src_path)
+        with self._lock:
+            if self._end > 0 and self._end + length > self.segment_size:
+                self._active, self._end = self._active + 1, 0
+            segment, offset = self._active, self._end
+
+            digest = hashlib.sha256()
+            path = self.segment_path(segment)
+            # 不能用 'ab'：追加模式忽略 seek，写入总是落在文件物理末尾而不是索引记录的偏移处
+            with open(src_path, 'rb') as src, open(path, 'r+b' if os.path.exists(path) else 'w+b') as dst:
+                dst.truncate(offset)
+                dst.seek(offset)
+                for chunk in iter(lambda: src.read(COPY_CHUNK), b''):
+                    digest.update(chunk)
+                    dst.write(chunk)
+                dst.flush()
+                sha256 = digest.hexdigest()
+
+                existing = self._db.execute(
+                    "SELECT segment, offset, length FROM tracks WHERE sha256 = ? AND length = ? LIMIT 1",
+                    (sha256, length),
+                ).fetchone()
+                if existing is not None:
+                    # 内容已存在：撤销刚写入的数据，新id指向已有范围
+                    dst.truncate(offset)
+                    segment, offset, length = existing
+                else:
+                    os.fsync(dst.fileno())
+                    self._end = offset + length
+
+            self._db.execute(
+                "INSERT OR REPLACE INTO tracks (track_id, segment, offset, length, sha256, content_type, created, meta) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (track_id, segment, offset, length, sha256, content_type, time.time(),
+                 json.dumps(meta or {}, ensure_ascii=False)),
+            )
+            self._db.commit()
+            return segment, offset, length
+
+    def locate(self, track_id):
+        """返回音轨信息字典，不存在时返回 None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT segment, offset, length, sha256, content_type, meta FROM tracks WHERE track_id = ?",
+                (track_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        segment, offset, length, sha256, content_type, meta = row
+        return {"segment": segment, "offset": offset, "length": length, "sha256": sha256,
+                "content_type": content_type, "meta": json.loads(meta or "{}")}
+
+    def _file(self, segment):
+        with self._lock:
+            if segment not in self._files:
+                self._files[segment] = open(self.segment_path(segment), 'rb')
+            return self._files[segment]
+
+    def _map(self, segment, needed):
+        """段文件的只读mmap；当前段增长后重新映射
+
+        旧的映射可能还被 view() 返回的 memoryview 引用，不能主动关闭 (会抛出 BufferError)，
+        只丢弃引用，最后一个 memoryview 释放后自动解除映射。
+        """
+        with self._lock:
+            mapped = self._maps.get(segment)
+            if mapped is None or len(mapped) < needed:
+                mapped = mmap.mmap(self._file(segment).fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[segment] = mapped
+            return mapped
+
+    def view(self, track_id, start=0, end=None):
+        """返回音轨 [start, end) 范围的 memoryview (不复制数据)，音轨不存在时返回 None"""
+        track = self.locate(track_id)
+        if track is None:
+            return None
+        end = track["length"] if end is None else min(end, track["length"])
+        begin = track["offset"]
+        mapped = self._map(track["segment"], begin + track["length"])
+        return memoryview(mapped)[begin + start:begin + end]
+
+    def read(self, track_id, start=0, end=None):
+        view = self.view(track_id, start, end)
+        return None if view is None else bytes(view)
+
+    def sendfile(self, sock, track, start, end):
+        """用 os.sendfile 把音轨 [start, end) 直接从段文件写入套接字"""
+        fd = self._file(track["segment"]).fileno()
+        position = track["offset"] + start
+        remaining = end - start
+        while remaining > 0:
+            sent = os.sendfile(sock.fileno(), fd, position, min(remaining, SENDFILE_CHUNK))
+            if sent == 0:
+                break
+            position += sent
+            remaining -= sent
+
+    def delete(self, track_id):
+        """删除索引记录 (段文件中的数据保留，直到整理段文件)"""
+        with self._lock:
+            self._db.execute("DELETE FROM tracks WHERE track_id = ?", (track_id,))
+            self._db.commit()
+
+    def list(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT track_id, length, content_type, created FROM tracks ORDER BY created"
+            ).fetchall()
+        return [{"id": track_id, "length": length, "content_type": content_type, "created": created}
+                for track_id, length, content_type, created in rows]
+
+    def import_directory(self, directory, pattern="*.mp3"):
+        """导入目录中的音频文件 (以文件名去掉扩展名作为id)，已导入的id跳过"""
+        imported = 0
+        for path in sorted(glob.glob(os.path.join(directory, pattern))):
+            track_id = os.path.splitext(os.path.basename(path))[0]
+            if self.locate(track_id) is None:
+                self.append(track_id, path, meta={"source": os.path.basename(path)})
+                imported += 1
+        return imported
+
+    def stats(self):
+        with self._lock:
+            tracks, unique, total = self._db.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT sha256), COALESCE(SUM(length), 0) FROM tracks"
+            ).fetchone()
+        segments = sorted(glob.glob(os.path.join(self.root, "segment-*.dat")))
+        return {
+            "tracks": tracks,
+            "unique_tracks": unique,
+            "track_bytes": total,
+            "segments": len(segments),
+            "segment_bytes": sum(os.path.getsize(path) for path in segments),
+        }
+
+    def close(self):
+        with self._lock:
+            for mapped in self._maps.values():
+                try:
+                    mapped.close()
+                except BufferError:
+                    pass  # 仍有 memoryview 引用，释放后自动解除映射
+            for file in self._files.values():
+                file.close()
+            self._maps.clear()
+            self._files.clear()
+            self._db.close()
+
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header, length):
+    """解析单个 Range 头，返回 (start, end) (end不含)；
+    无法满足时返回 "unsatisfiable"，不支持的形式 (例如多个范围) 返回 None 表示返回整个文件"""
+    match = _RANGE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N: 最后N个字节
+        suffix = int(last)
+        if suffix == 0:
+            return "unsatisfiable"
+        return max(length - suffix, 0), length
+    start = int(first)
+    end = min(int(last) + 1, length) if last else length
+    if start >= length or end <= start:
+        return "unsatisfiable"
+    return start, end
+
+
+class TrackHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "SegmentStore/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _send_json(self, status, data):
+        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(payload)
+
+    def _serve(self, send_body):
+        path = self.path.split("?")[0]
+        if path == "/tracks":
+            return self._send_json(200, self.server.store.list())
+        if not path.startswith("/tracks/"):
+            return self._send_json(404, {"detail": "Not Found"})
+        track = self.server.store.locate(unquote(path[len("/tracks/"):]))
+        if track is None:
+            return self._send_json(404, {"detail": "Track not found"})
+
+        length = track["length"]
+        etag = f'"{track["sha256"][:32]}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        byte_range = None
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range", etag) == etag:
+            byte_range = parse_range(range_header, length)
+        if byte_range == "unsatisfiable":
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{length}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start, end = byte_range or (0, length)
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type", track["content_type"])
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{length}")
+        self.end_headers()
+        if send_body:
+            self.wfile.flush()
+            try:
+                self.server.store.sendfile(self.connection, track, start, end)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True  # 播放器拖动进度时常会提前断开
+
+
+def start_server(store, host="127.0.0.1", port=0, verbose=False):
+    """在后台线程启动音轨服务器，返回服务器对象 (server.base_url 为访问地址)"""
+    server = ThreadingHTTPServer((host, port), TrackHandler)
+    server.daemon_threads = True
+    server.store = store
+    server.verbose = verbose
+    server.base_url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='段文件音轨存储和HTTP Range服务器')
+    parser.add_argument('root', help='存储目录')
+    parser.add_argument('--segment-size', type=int, default=DEFAULT_SEGMENT_SIZE, help='单个段文件的大小上限 (字节)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_parser = commands.add_parser('import', help='导入目录中的音频文件')
+    import_parser.add_argument('directory', help='音频目录 (例如 ./output)')
+    import_parser.add_argument('--pattern', default='*.mp3', help='文件名模式 (默认: *.mp3)')
+    get_parser = commands.add_parser('get', help='把音轨导出为文件')
+    get_parser.add_argument('track_id', help='音轨id')
+    get_parser.add_argument('output', help='输出文件')
+    commands.add_parser('list', help='列出所有音轨')
+    serve_parser = commands.add_parser('serve', help='启动支持Range请求的HTTP服务器')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='监听地址 (默认: 127.0.0.1)')
+    serve_parser.add_argument('--port', type=int, default=8090, help='监听端口 (默认: 8090)')
+    serve_parser.add_argument('--verbose', action='store_true', help='打印每个请求')
+    args = parser.parse_args()
+
+    store = SegmentStore(args.root, args.segment_size)
+    try:
+        if args.command == 'import':
+            imported = store.import_directory(args.directory, args.pattern)
+            print(f"导入 {imported} 条音轨")
+            print(json.dumps(store.stats(), ensure_ascii=False, indent=2))
+        elif args.command == 'get':
+            data = store.read(args.track_id)
+            if data is None:
+                parser.exit(1, f"音轨不存在: {args.track_id}\n")
+            with open(args.output, 'wb') as file:
+                file.write(data)
+            print(f"已导出 {len(data)} 字节至: {args.output}")
+        elif args.command == 'list':
+            for track in store.list():
+                print(json.dumps(track, ensure_ascii=False))
+        else:
+            server = start_server(store, args.host, args.port, args.verbose)
+            print(f"音轨服务器运行在 {server.base_url}/tracks，按 Ctrl+C 停止")
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                server.shutdown()
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# spatial_index.py - 空间分桶：相邻坐标共享同一次天气请求
+
+import math
+import threading
+import time
+from concurrent.futures import Future
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_BASE32_INDEX = {char: index for index, char in enumerate(_BASE32)}
+
+
+def geohash_encode(latitude, longitude, precision=6):
+    """把坐标编码为geohash字符串 (精度6约为1.2km x 0.6km)"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # geohash从经度开始交替编码
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def geohash_decode(geohash):
+    """返回geohash单元的中心坐标 (纬度, 经度)"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = _BASE32_INDEX[char]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            target = lon_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            if bit:
+                target[0] = mid
+            else:
+                target[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def tile_xy(latitude, longitude, zoom):
+    """把坐标转换为slippy map瓦片编号 (x, y)"""
+    latitude = max(min(latitude, 85.05112878), -85.05112878)
+    n = 2 ** zoom
+    x = int((longitude + 180.0) / 360.0 * n)
+    lat_rad = math.radians(latitude)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_center(zoom, x, y):
+    """返回瓦片中心坐标 (纬度, 经度)"""
+    n = 2 ** zoom
+    longitude = (x + 0.5) / n * 360.0 - 180.0
+    latitude = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 0.5) / n))))
+    return latitude, longitude
+
+
+class SpatialBucketer:
+    """按geohash或slippy瓦片把坐标归入桶，每个桶以中心点作为代表坐标"""
+
+    SCHEMES = ("geohash", "tile")
+    # 两种方式的默认桶大小相近 (约1~2公里)：6位geohash约 1.2×0.6 公里，14级瓦片在赤道约2.4公里
+    DEFAULT_PRECISION = {"geohash": 6, "tile": 14}
+
+    def __init__(self, scheme="geohash", precision=None):
+        if scheme not in self.SCHEMES:
+            raise ValueError(f"未知的分桶方式: {scheme} (可选: {', '.join(self.SCHEMES)})")
+        self.scheme = scheme
+        # geohash字符数，或瓦片缩放级别
+        self.precision = self.DEFAULT_PRECISION[scheme] if precision is None else precision
+
+    def key(self, latitude, longitude):
+        if self.scheme == "geohash":
+            return geohash_encode(latitude, longitude, self.precision)
+        x, y = tile_xy(latitude, longitude, self.precision)
+        return f"{self.precision}/{x}/{y}"
+
+    def representative(self, key):
+        if self.scheme == "geohash":
+            return geohash_decode(key)
+        zoom, x, y = (int(part) for part in key.split("/"))
+        return tile_center(zoom, x, y)
+
+
+class BucketedFetcher:
+    """同一个桶内的请求只调用一次上游
+
+    fetch(lat, lon, *args) 以桶中心坐标调用；同一 (桶, args) 的并发请求
+    会等待同一个结果，完成的结果在 ttl 秒内直接复用。异常同样会传给所有等待者，
+    且不会被保留。
+    """
+
+    def __init__(self, bucketer, fetch, ttl=600):
+        self.bucketer = bucketer
+        self.fetch = fetch
+        self.ttl = ttl
+        self._results = {}  # (桶, args) -> (创建时间, Future)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.upstream_calls = 0
+
+    def get(self, latitude, longitude, *args):
+        return self.get_shared(latitude, longitude, *args)[0]
+
+    def get_shared(self, latitude, longitude, *args):
+        """返回 (结果, 是否共享)；共享表示本次调用没有请求上游，而是复用了同桶其他调用的结果"""
+        bucket = self.bucketer.key(latitude, longitude)
+        slot = (bucket, args)
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            if self.requests % 1000 == 0:
+                self._purge_expired(now)
+            entry = self._results.get(slot)
+            if entry is not None and now - entry[0] < self.ttl:
+                future = entry[1]
+                owner = False
+            else:
+                future = Future()
+                self._results[slot] = (now, future)
+                self.upstream_calls += 1
+                owner = True
+
+        if owner:
+            try:
+                rep_lat, rep_lon = self.bucketer.representative(bucket)
+                future.set_result(self.fetch(rep_lat, rep_lon, *args))
+            except BaseException as err:
+                with self._lock:
+                    if self._results.get(slot, (None, None))[1] is future:
+                        del self._results[slot]
+                future.set_exception(err)
+        return future.result(), not owner
+
+    def stats(self):
+        with self._lock:
+            saved = self.requests - self.upstream_calls
+            return {
+                "scheme": self.bucketer.scheme,
+                "precision": self.bucketer.precision,
+                "requests": self.requests,
+                "upstream_calls": self.upstream_calls,
+                "buckets": len(self._results),
+                "reduction": round(self.requests / self.upstream_calls, 1) if self.upstream_calls else 0.0,
+                "saved_calls": saved,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def _purge_expired(self, now):
+        expired = [slot for slot, (created, future) in self._results.items()
+                   if future.done() and now - created >= self.ttl]
+        for slot in expired:
+            del self._results[slot]
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# stability_audio.py - Stability AI 文本生成音频的可复用客户端
+
+import os
+import tempfile
+import time
+
+BASE_URL = os.environ.get("STABILITY_BASE_URL", "https://api.stability.ai")
+ENDPOINT = "/v2beta/audio/stable-audio-2/text-to-audio"
+CHUNK_SIZE = 64 * 1024  # 流式下载每次写入的字节数
+
+
+class StabilityAPIError(Exception):
+    """Stability API 返回了非音频响应"""
+
+    def __init__(self, status_code, detail, retry_after=None):
+        super().__init__(f"API请求失败: {status_code} {detail}")
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        """429和5xx值得重试，其余 (如401、400) 重试也不会成功"""
+        return self.status_code == 429 or self.status_code >= 500
+
+
+def save_audio_stream(response, output_path, start_time):
+    """边接收边把音频写入临时文件，完成后原子地重命名到 output_path
+
+    内存占用只取决于 CHUNK_SIZE，与音频时长无关。
+    返回 (总字节数, 首字节时间, 吞吐量 字节/秒)。
+    """
+    output_dir = os.path.dirname(output_path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=output_dir, suffix=".part")
+    total_bytes = 0
+    first_byte_time = None
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if not chunk:
+                    continue
+                if first_byte_time is None:
+                    first_byte_time = time.time()
+                file.write(chunk)
+                total_bytes += len(chunk)
+        os.chmod(temp_path, 0o644)  # mkstemp默认只有所有者可读写
+        os.replace(temp_path, output_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+    end_time = time.time()
+    ttfb = (first_byte_time or end_time) - start_time
+    transfer_time = end_time - (first_byte_time or end_time)
+    throughput = total_bytes / transfer_time if transfer_time > 0 else float(total_bytes)
+    return total_bytes, ttfb, throughput
+
+
+def generate_audio(session, api_key, prompt, output_path, duration=20, steps=30,
+                   output_format="mp3", seed=None, base_url=BASE_URL, timeout=120):
+    """生成一段音频并流式保存到 output_path
+
+    成功时返回包含字节数、首字节时间和总耗时的字典；
+    API返回错误时抛出 StabilityAPIError，网络错误时抛出 requests 的异常。
+    """
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Accept": "audio/*"
+    }
+    data = {
+        "prompt": prompt,
+        "output_format": output_format,
+        "duration": duration,
+        "steps": steps,
+    }
+    if seed is not None:
+        data["seed"] = seed
+
+    start_time = time.time()
+    with session.post(
+        f"{base_url}{ENDPOINT}",
+        headers=headers,
+        files={"none": ""},  # 必须包含至少一个文件字段，即使是空的
+        data=data,
+        timeout=timeout,
+        stream=True
+    ) as response:
+        content_type = response.headers.get('Content-Type', '')
+        if response.status_code == 200 and 'audio/' in content_type:
+            total_bytes, ttfb, throughput = save_audio_stream(response, output_path, start_time)
+            return {
+                "output": output_path,
+                "bytes": total_bytes,
+                "ttfb": round(ttfb, 3),
+                "elapsed": round(time.time() - start_time, 3),
+                "throughput": round(throughput, 1),
+            }
+
+        raise StabilityAPIError(
+            response.status_code,
+            response.text[:500],
+            parse_retry_after(response.headers.get('Retry-After')),
+        )
+
+
+def parse_retry_after(value):
+    """解析秒数形式的 Retry-After 头，无法解析时返回 None"""
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
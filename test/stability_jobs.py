@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# stability_jobs.py - Stability AI 批量音频生成任务队列 (令牌桶限速、退避重试、断点续跑)
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from api_metrics import add_arguments as add_metrics_arguments, from_args as metrics_from_args, upstream_name
+from resilience import CircuitOpenError, ResilientSession, add_arguments as add_resilience_arguments, registry_from_args
+from audio_cache import AudioCache
+from stability_audio import BASE_URL, StabilityAPIError, generate_audio
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARAMS = {
+    "duration": 20,
+    "steps": 30,
+    "output_format": "mp3",
+    "seed": None,
+}
+
+
+class TokenBucket:
+    """令牌桶限速器：平均每秒 rate 个请求，最多允许 capacity 个突发"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """阻塞直到取得一个令牌"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class JobState:
+    """任务状态文件，每次状态变化都原子地写回磁盘，中断后可以继续"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.jobs = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                self.jobs = json.load(file).get("jobs", {})
+
+    def get(self, job_id):
+        with self._lock:
+            return dict(self.jobs.get(job_id, {}))
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            self.jobs.setdefault(job_id, {}).update(fields)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump({"jobs": self.jobs}, file, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+
+
+def load_jobs(path, defaults):
+    """读取任务文件：JSONL每行一个任务对象，或纯文本每行一个提示词"""
+    jobs = []
+    seen = {}
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            spec = json.loads(line) if line.startswith('{') else {"prompt": line}
+            params = {key: spec.get(key, defaults[key]) for key in DEFAULT_PARAMS}
+            params["prompt"] = spec["prompt"]
+            if "id" in spec:
+                jobs.append((str(spec["id"]), params))
+                continue
+            # 没有显式id时用参数哈希作为id，增删其他行不影响已有任务，续跑时能对上；
+            # 参数完全相同的任务 (例如不固定种子的多次生成) 按出现顺序加后缀区分
+            digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+            seen[digest] = seen.get(digest, 0) + 1
+            jobs.append((digest if seen[digest] == 1 else f"{digest}-{seen[digest]}", params))
+    return jobs
+
+
+def backoff_delay(attempt, base=2.0, cap=60.0):
+    """指数退避加完全抖动"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def run_job(job_id, params, session, api_key, limiter, state, output_dir, max_attempts, base_url, cache=None,
+            metrics=None):
+    """执行单个任务，对429、5xx和网络错误退避重试；缓存命中时不调用API"""
+    output_path = os.path.join(output_dir, f"{job_id}.{params['output_format']}")
+    previous = state.get(job_id)
+    # 上次运行已失败的任务重新获得完整的重试次数
+    attempts = 0 if previous.get("status") == "failed" else previous.get("attempts", 0)
+
+    if cache is not None and cache.restore(output_path, **params):
+        state.update(job_id, status="done", error=None, output=output_path, cache_hit=True, params=params)
+        logger.info(f"[{job_id}] 缓存命中: {output_path}")
+        return True
+
+    while True:
+        limiter.acquire()
+        attempts += 1
+        state.update(job_id, status="running", attempts=attempts, params=params)
+        try:
+            result = generate_audio(session, api_key, output_path=output_path, base_url=base_url, **params)
+            if cache is not None:
+                cache.store(output_path, **params)
+            state.update(job_id, status="done", error=None, cache_hit=False, **result)
+            logger.info(f"[{job_id}] 完成: {result['bytes']} 字节, 耗时 {result['elapsed']:.2f}秒")
+            return True
+        except StabilityAPIError as err:
+            retryable = err.retryable
+            delay = err.retry_after if err.retry_after is not None else backoff_delay(attempts)
+            error = f"{err.status_code}: {err.detail[:200]}"
+        except CircuitOpenError as err:
+            # 断路器打开时请求没有发出，不计入尝试次数，等到冷却结束再试
+            attempts -= 1
+            state.update(job_id, status="waiting", attempts=attempts, error=str(err))
+            logger.warning(f"[{job_id}] {err}")
+            time.sleep(err.retry_after)
+            continue
+        except requests.exceptions.RequestException as err:
+            retryable = True
+            delay = backoff_delay(attempts)
+            error = str(err)
+        except OSError as err:
+            # 写入输出文件失败 (例如磁盘已满)：只让这个任务失败，不中断整个批次
+            retryable = False
+            delay = 0.0
+            error = f"写入失败: {err}"
+
+        if not retryable or attempts >= max_attempts:
+            state.update(job_id, status="failed", error=error)
+            logger.error(f"[{job_id}] 失败 (第{attempts}次尝试): {error}")
+            return False
+
+        state.update(job_id, status="retrying", error=error)
+        if metrics is not None:
+            metrics.count_retry(upstream_name(base_url))
+        logger.warning(f"[{job_id}] 第{attempts}次尝试失败，{delay:.1f}秒后重试: {error}")
+        time.sleep(delay)
+
+
+def run_queue(api_key, jobs, state, output_dir="./output", concurrency=4, rate=0.5, burst=2,
+              max_attempts=5, base_url=BASE_URL, cache=None, metrics=None, registry=None):
+    """并发执行所有未完成的任务，返回 (成功数, 失败数, 跳过数)
+
+    提供 registry (resilience.BreakerRegistry) 时请求经过断路器：上游持续出错时任务等待冷却而不是继续请求。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    todo = []
+    skipped = 0
+    for job_id, params in jobs:
+        previous = state.get(job_id)
+        if previous.get("status") == "done" and os.path.exists(previous.get("output", "")):
+            skipped += 1
+            continue
+        todo.append((job_id, params))
+
+    logger.info(f"共 {len(jobs)} 个任务，{skipped} 个已完成，本次执行 {len(todo)} 个")
+    limiter = TokenBucket(rate, burst)
+    start = time.time()
+
+    if metrics is not None:
+        session = metrics.session(pool_maxsize=concurrency)
+    else:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=concurrency)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+    if registry is not None:
+        session = ResilientSession(session, registry, hedge=False)  # 生成请求按次计费，不做对冲
+    with session, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(
+            lambda job: run_job(job[0], job[1], session, api_key, limiter, state,
+                                output_dir, max_attempts, base_url, cache, metrics),
+            todo,
+        ))
+
+    succeeded = sum(outcomes)
+    failed = len(outcomes) - succeeded
+    logger.info(f"批量生成结束: 成功 {succeeded}, 失败 {failed}, 跳过 {skipped}, 总耗时 {time.time() - start:.1f}秒")
+    return succeeded, failed, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量生成Stability AI音频')
+    parser.add_argument('api_key', help='Stability AI API密钥')
+    parser.add_argument('jobs', help='任务文件: JSONL (prompt/duration/steps/output_format/seed/id) 或每行一个提示词')
+    parser.add_argument('--state', default='stability_jobs.state.json', help='任务状态文件，用于断点续跑')
+    parser.add_argument('--output-dir', default='./output', help='音频输出目录 (默认: ./output)')
+    parser.add_argument('--concurrency', type=int, default=4, help='同时进行的生成数 (默认: 4)')
+    parser.add_argument('--rate', type=float, default=0.5, help='每秒允许发起的请求数 (默认: 0.5)')
+    parser.add_argument('--burst', type=int, default=2, help='令牌桶容量 (默认: 2)')
+    parser.add_argument('--max-attempts', type=int, default=5, help='每个任务的最大尝试次数 (默认: 5)')
+    parser.add_argument('--duration', type=int, default=DEFAULT_PARAMS["duration"], help='默认时长 (秒)')
+    parser.add_argument('--steps', type=int, default=DEFAULT_PARAMS["steps"], help='默认步数')
+    parser.add_argument('--format', dest='output_format', default=DEFAULT_PARAMS["output_format"], help='默认输出格式')
+    parser.add_argument('--seed', type=int, default=DEFAULT_PARAMS["seed"], help='默认种子 (不指定时随机，且不缓存)')
+    parser.add_argument('--base-url', default=BASE_URL, help='API基础URL')
+    parser.add_argument('--cache-dir', help='音频缓存目录，相同参数和种子的任务直接复用已生成的文件')
+    parser.add_argument('--cache-max-bytes', type=int, default=1024 ** 3, help='音频缓存大小上限 (默认: 1GB)')
+    add_metrics_arguments(parser)
+    add_resilience_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    defaults = dict(DEFAULT_PARAMS, duration=args.duration, steps=args.steps, output_format=args.output_format,
+                    seed=args.seed)
+    jobs = load_jobs(args.jobs, defaults)
+    seedless = sum(1 for _, params in jobs if not params["seed"])
+    if args.cache_dir and seedless:
+        logger.warning(f"{seedless} 个任务没有固定种子，不会使用音频缓存 (用 --seed 或任务的 seed 字段指定)")
+    state = JobState(args.state)
+    cache = AudioCache(args.cache_dir, args.cache_max_bytes) if args.cache_dir else None
+    metrics = metrics_from_args(args)
+    # 生成请求慢且限速，30秒窗口里凑不够样本；按5分钟窗口、至少5次调用判断。
+    # 正常生成需要几十秒，超过90秒 (接近120秒超时) 才算慢请求
+    registry = registry_from_args(args, metrics, window=300.0, min_calls=5, slow_call_seconds=90.0)
+    _, failed, _ = run_queue(
+        args.api_key, jobs, state, args.output_dir, args.concurrency, args.rate, args.burst,
+        args.max_attempts, args.base_url, cache, metrics, registry,
+    )
+    if registry is not None:
+        logger.info(f"断路器状态: {json.dumps(registry.states(), ensure_ascii=False)}")
+    if metrics is not None:
+        metrics.print_summary()
+        metrics.close()
+    if cache is not None:
+        logger.info(f"音频缓存统计: {json.dumps(cache.stats(), ensure_ascii=False)}")
+        cache.close()
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,11 @@ import logging
 import json
 import os
 import time
+import argparse
 from requests.exceptions import RequestException, Timeout
+import api_metrics
+from audio_cache import AudioCache
+from stability_audio import save_audio_stream
 
 # 设置日志
 logging.basicConfig(
@@ -18,7 +22,7 @@ logger = logging.getLogger(__name__)
 
 # Stability AI API配置
 API_KEY = "sk-hzdHSi39PEEm3eaR0TrKqeeXf2Nu6grJhrLCbdwIu28jCXP2"  # 请替换为您的实际API密钥
-BASE_URL = "https://api.stability.ai"
+BASE_URL = os.environ.get("STABILITY_BASE_URL", "https://api.stability.ai")
 ENDPOINT = "/v2beta/audio/stable-audio-2/text-to-audio"
 
 # 请求配置
@@ -26,9 +30,15 @@ AUDIO_PROMPT = "A song in the 3/4 time signature that features cello, live recor
 OUTPUT_FORMAT = "mp3"
 DURATION = 20  # 秒
 STEPS = 30
+SEED = None  # None 表示使用API默认种子
 
-def test_stability_api():
-    """测试Stability AI API的连通性和音频生成功能"""
+def test_stability_api(stream=False, cache_dir=None, metrics=None):
+    """测试Stability AI API的连通性和音频生成功能
+
+    stream=True 时按块流式下载音频并记录首字节时间和吞吐量；
+    提供 cache_dir 时相同参数的请求直接复用缓存中的音频；
+    提供 metrics (api_metrics.ApiMetrics) 时记录请求的分阶段耗时。
+    """
     
     logger.info("=== Stability AI API 测试开始 ===")
     
@@ -54,16 +64,29 @@ def test_stability_api():
     os.makedirs(output_dir, exist_ok=True)
     output_path = f"{output_dir}/stability_audio_{int(time.time())}.{OUTPUT_FORMAT}"
     
+    cache = AudioCache(cache_dir) if cache_dir else None
+    params = {"prompt": AUDIO_PROMPT, "duration": DURATION, "steps": STEPS,
+              "output_format": OUTPUT_FORMAT, "seed": SEED}
+    if SEED is not None:
+        data["seed"] = SEED
+    
+    response = None
     try:
+        if cache is not None and cache.restore(output_path, **params):
+            logger.info(f"缓存命中，跳过API请求，音频文件保存至: {output_path}")
+            return True
+        
         logger.info("发送API请求...")
         start_time = time.time()
         
-        response = requests.post(
+        http = metrics.session(1, 1) if metrics is not None else requests
+        response = http.post(
             f"{BASE_URL}{ENDPOINT}",
             headers=headers,
             files={"none": ""},  # 必须包含至少一个文件字段，即使是空的
             data=data,
-            timeout=120  # 设置两分钟超时
+            timeout=120,  # 设置两分钟超时
+            stream=stream
         )
         
         elapsed_time = time.time() - start_time
@@ -76,11 +99,21 @@ def test_stability_api():
         
         if response.status_code == 200:
             # 检查Content-Type确认我们收到了音频文件
-            if 'audio/' in content_type:
+            if 'audio/' in content_type and stream:
+                total_bytes, ttfb, throughput = save_audio_stream(response, output_path, start_time)
+                logger.info(f"首字节时间: {ttfb:.2f}秒, 吞吐量: {throughput / 1024:.1f} KB/秒")
+                logger.info(f"成功接收音频数据，大小: {total_bytes} 字节")
+                logger.info(f"音频文件保存至: {output_path}")
+                if cache is not None:
+                    cache.store(output_path, **params)
+                return True
+            elif 'audio/' in content_type:
                 logger.info(f"成功接收音频数据，大小: {len(response.content)} 字节")
                 with open(output_path, 'wb') as file:
                     file.write(response.content)
                 logger.info(f"音频文件保存至: {output_path}")
+                if cache is not None:
+                    cache.store(output_path, **params)
                 return True
             else:
                 # 如果状态码是200但不是音频内容，记录并解析响应
@@ -121,8 +154,34 @@ def test_stability_api():
         logger.error(f"测试过程中发生未知错误: {str(e)}")
         return False
     finally:
+        # 流式响应在出错或非音频分支中不会被读完，必须关闭才能把连接还给连接池
+        if response is not None:
+            response.close()
+        if cache is not None:
+            logger.info(f"音频缓存统计: {json.dumps(cache.stats())}")
+            cache.close()
         logger.info("=== Stability AI API 测试结束 ===")
 
 if __name__ == "__main__":
-    test_result = test_stability_api()
+    parser = argparse.ArgumentParser(description='测试Stability AI音频生成API')
+    parser.add_argument('--stream', action='store_true', help='流式下载音频，记录首字节时间和吞吐量')
+    parser.add_argument('--cache-dir', help='音频缓存目录，相同参数和种子的请求直接复用已生成的文件 (需要 --seed)')
+    parser.add_argument('--seed', type=int, help='固定生成种子 (非0)；不指定时使用API默认的随机种子')
+    parser.add_argument('--base-url', help='替代 api.stability.ai 的基础URL (例如本地模拟服务器)')
+    api_metrics.add_arguments(parser)
+    args = parser.parse_args()
+    # 不固定种子时每次都应生成不同的音频，缓存不会查也不会写，直接报错而不是默默地全部未命中
+    if args.cache_dir and not args.seed:
+        parser.error("--cache-dir 需要同时指定非0的 --seed (随机种子的请求不缓存)")
+    
+    if args.seed:
+        SEED = args.seed
+    if args.base_url:
+        BASE_URL = args.base_url.rstrip('/')
+    
+    metrics = api_metrics.from_args(args)
+    test_result = test_stability_api(stream=args.stream, cache_dir=args.cache_dir, metrics=metrics)
+    if metrics is not None:
+        metrics.print_summary()
+        metrics.close()
     print(f"\n测试结果: {'成功' if test_result else '失败'}")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# test_forecast_columns.py - 列式预报聚合的测试
+#
+# 用构造的预报响应检查滑动平均：缺失值不影响之后的行和其他位置，窗口不跨越位置。
+#   python -m pytest test_forecast_columns.py
+#   python test_forecast_columns.py
+
+import numpy as np
+
+from forecast_columns import ingest, rolling_mean
+
+
+def forecast(winds, start=1700000000):
+    """构造一个预报响应，winds 中的 None 表示该条缺少风速"""
+    items = []
+    for step, wind in enumerate(winds):
+        item = {"dt": start + step * 3 * 3600, "main": {"temp": 10.0 + step, "humidity": 50}}
+        if wind is not None:
+            item["wind"] = {"speed": wind}
+        items.append(item)
+    return {"city": {"timezone": 0}, "list": items}
+
+
+def naive_rolling_mean(values, window):
+    return np.array([
+        np.nan if np.all(np.isnan(values[max(0, i - window + 1):i + 1]))
+        else np.nanmean(values[max(0, i - window + 1):i + 1])
+        for i in range(len(values))
+    ])
+
+
+def test_gap_does_not_poison_later_rows():
+    winds_a = [1.0, 2.0, None, 4.0, 5.0, 6.0, 7.0, 8.0, 9.0, 10.0, 11.0]
+    winds_b = [3.0, 3.0, 5.0, 7.0]
+    table, location_ids = ingest([("a", forecast(winds_a)), ("b", forecast(winds_b))])
+    assert location_ids == ["a", "b"]
+
+    smoothed = rolling_mean(table, "wind", window=8)
+    assert not np.isnan(smoothed).any()
+    a = np.array([np.nan if wind is None else wind for wind in winds_a])
+    np.testing.assert_allclose(smoothed[:len(winds_a)], naive_rolling_mean(a, 8))
+    # 第二个位置的窗口从它自己的第一行开始
+    np.testing.assert_allclose(smoothed[len(winds_a):], naive_rolling_mean(np.array(winds_b), 8))
+
+
+def test_window_without_values_is_nan():
+    table, _ = ingest([("a", forecast([None, None, 2.0])), ("b", forecast([None]))])
+    smoothed = rolling_mean(table, "wind", window=2)
+    assert np.isnan(smoothed[0]) and np.isnan(smoothed[1])
+    assert smoothed[2] == 2.0
+    assert np.isnan(smoothed[3])
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"通过: {name}")
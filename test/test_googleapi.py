@@ -6,10 +6,19 @@ Google Maps API连通性测试脚本
 
 import requests
 import json
+import os
 import time
 import sys
 import argparse
+import asyncio
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+import api_metrics
+import resilience
+
+# 服务地址，可通过环境变量或 --base-url 指向本地模拟服务器
+GOOGLE_URL = os.environ.get("GOOGLE_BASE_URL", "https://www.google.com")
+MAPS_BASE_URL = os.environ.get("GOOGLE_MAPS_BASE_URL", "https://maps.googleapis.com")
 
 # 彩色输出
 class Colors:
@@ -42,12 +51,12 @@ def print_header(message):
     """打印标题"""
     print(f"\n{Colors.HEADER}{Colors.BOLD}=== {message} ==={Colors.ENDC}")
 
-def test_internet_connectivity():
+def test_internet_connectivity(session=None):
     """测试互联网连接"""
     print_header("测试基本互联网连接")
     
     try:
-        response = requests.get("https://www.google.com", timeout=5)
+        response = (session or requests).get(GOOGLE_URL, timeout=5)
         if response.status_code == 200:
             print_success("成功连接到Google")
             return True
@@ -58,12 +67,12 @@ def test_internet_connectivity():
         print_error(f"连接到Google时出错: {e}")
         return False
 
-def test_maps_api_connectivity():
+def test_maps_api_connectivity(session=None):
     """测试Google Maps API连接性"""
     print_header("测试Google Maps API域名连接性")
     
     try:
-        response = requests.get("https://maps.googleapis.com", timeout=5)
+        response = (session or requests).get(MAPS_BASE_URL, timeout=5)
         if response.status_code < 400:  # 可能返回301或302重定向
             print_success("成功连接到Google Maps API域名")
             return True
@@ -74,14 +83,14 @@ def test_maps_api_connectivity():
         print_error(f"连接到Google Maps API域名时出错: {e}")
         return False
 
-def test_geocoding_api(api_key):
+def test_geocoding_api(api_key, session=None):
     """测试Geocoding API"""
     print_header("测试Geocoding API")
     
-    url = f"https://maps.googleapis.com/maps/api/geocode/json?address=London&key={api_key}"
+    url = f"{MAPS_BASE_URL}/maps/api/geocode/json?address=London&key={api_key}"
     
     try:
-        response = requests.get(url, timeout=5)
+        response = (session or requests).get(url, timeout=5)
         data = response.json()
         
         if response.status_code == 200:
@@ -108,14 +117,19 @@ def test_geocoding_api(api_key):
         print_error(f"解析Geocoding API响应时出错: {e}")
         return False
 
-def test_static_maps_api(api_key):
+def static_map_url(api_key, center, zoom, size="600x300", scale=1, maptype="roadmap"):
+    """Static Maps 请求URL，center 为地名或 纬度,经度 字符串"""
+    return (f"{MAPS_BASE_URL}/maps/api/staticmap?center={center}&zoom={zoom}&size={size}"
+            f"&scale={scale}&maptype={maptype}&key={api_key}")
+
+def test_static_maps_api(api_key, session=None):
     """测试Static Maps API"""
     print_header("测试Static Maps API")
     
-    url = f"https://maps.googleapis.com/maps/api/staticmap?center=London&zoom=13&size=600x300&key={api_key}"
+    url = static_map_url(api_key, "London", 13)
     
     try:
-        response = requests.get(url, timeout=5)
+        response = (session or requests).get(url, timeout=5)
         
         if response.status_code == 200:
             content_type = response.headers.get('content-type', '')
@@ -136,14 +150,14 @@ def test_static_maps_api(api_key):
         print_error(f"调用Static Maps API时出错: {e}")
         return False
 
-def test_directions_api(api_key):
+def test_directions_api(api_key, session=None):
     """测试Directions API"""
     print_header("测试Directions API")
     
-    url = f"https://maps.googleapis.com/maps/api/directions/json?origin=London&destination=Manchester&key={api_key}"
+    url = f"{MAPS_BASE_URL}/maps/api/directions/json?origin=London&destination=Manchester&key={api_key}"
     
     try:
-        response = requests.get(url, timeout=5)
+        response = (session or requests).get(url, timeout=5)
         data = response.json()
         
         if response.status_code == 200:
@@ -171,19 +185,58 @@ def test_directions_api(api_key):
         print_error(f"解析Directions API响应时出错: {e}")
         return False
 
-def run_all_tests(api_key):
-    """运行所有测试"""
-    print_header(f"Google Maps API连通性测试 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print_info(f"API密钥: {api_key[:6]}...{api_key[-4:]}")
-    
-    results = {
-        "internet": test_internet_connectivity(),
-        "maps_domain": test_maps_api_connectivity(),
-        "geocoding": test_geocoding_api(api_key),
-        "static_maps": test_static_maps_api(api_key),
-        "directions": test_directions_api(api_key)
-    }
-    
+def build_probes(api_key):
+    """按执行顺序返回 (名称, 测试函数, 参数) 列表"""
+    return [
+        ("internet", test_internet_connectivity, ()),
+        ("maps_domain", test_maps_api_connectivity, ()),
+        ("geocoding", test_geocoding_api, (api_key,)),
+        ("static_maps", test_static_maps_api, (api_key,)),
+        ("directions", test_directions_api, (api_key,)),
+    ]
+
+def create_session(pool_size, metrics=None, registry=None):
+    """创建共享连接池的会话，池大小足够让所有探测同时复用连接
+
+    提供 metrics (api_metrics.ApiMetrics) 时返回记录分阶段耗时的会话；
+    提供 registry (resilience.BreakerRegistry) 时再加上断路器和GET请求对冲。
+    """
+    if metrics is not None:
+        session = metrics.session(pool_size, pool_size)
+    else:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+    if registry is not None:
+        return resilience.ResilientSession(session, registry)
+    return session
+
+async def run_probes_concurrently(api_key, metrics=None, registry=None):
+    """通过共享会话并发发送所有探测请求，返回结果、各探测耗时和总耗时"""
+    probes = build_probes(api_key)
+    latencies = {}
+
+    async def timed(name, func, args, session):
+        start = time.perf_counter()
+        try:
+            # requests是阻塞的，放到线程中执行以便同时等待所有探测
+            return await asyncio.to_thread(func, *args, session=session)
+        finally:
+            latencies[name] = time.perf_counter() - start
+
+    wall_start = time.perf_counter()
+    with create_session(len(probes), metrics, registry) as session:
+        outcomes = await asyncio.gather(
+            *(timed(name, func, args, session) for name, func, args in probes)
+        )
+    wall_time = time.perf_counter() - wall_start
+
+    results = {name: outcome for (name, _, _), outcome in zip(probes, outcomes)}
+    return results, latencies, wall_time
+
+def print_summary(results, latencies=None, wall_time=None):
+    """打印测试结果摘要"""
     print_header("测试结果摘要")
     
     total = len(results)
@@ -192,9 +245,15 @@ def run_all_tests(api_key):
     for test, result in results.items():
         status = "通过" if result else "失败"
         color = Colors.GREEN if result else Colors.RED
-        print(f"{color}{status}{Colors.ENDC}: {test}")
+        if latencies is not None:
+            print(f"{color}{status}{Colors.ENDC}: {test} ({latencies[test] * 1000:.0f} ms)")
+        else:
+            print(f"{color}{status}{Colors.ENDC}: {test}")
     
     print(f"\n总体结果: {passed}/{total} 测试通过")
+    if wall_time is not None:
+        slowest = max(latencies.values()) if latencies else 0.0
+        print_info(f"总耗时: {wall_time:.2f} 秒 (最慢探测: {slowest:.2f} 秒, 各探测耗时之和: {sum(latencies.values()):.2f} 秒)")
     
     if passed == total:
         print_success("所有测试通过！Google Maps API工作正常。")
@@ -203,17 +262,52 @@ def run_all_tests(api_key):
     else:
         print_error(f"大多数测试失败 ({total-passed}/{total})。Google Maps API可能存在严重连接问题。")
 
+def run_all_tests(api_key, concurrent=False, metrics=None, registry=None):
+    """运行所有测试"""
+    print_header(f"Google Maps API连通性测试 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print_info(f"API密钥: {api_key[:6]}...{api_key[-4:]}")
+    
+    if concurrent:
+        print_info("并发模式: 所有探测同时发送")
+        results, latencies, wall_time = asyncio.run(run_probes_concurrently(api_key, metrics, registry))
+        print_summary(results, latencies, wall_time)
+    else:
+        session = create_session(1, metrics, registry) if metrics is not None or registry is not None else None
+        results = {name: func(*args, session=session) for name, func, args in build_probes(api_key)}
+        print_summary(results)
+
 def main():
     parser = argparse.ArgumentParser(description='测试Google Maps API连通性')
     parser.add_argument('api_key', help='Google Maps API密钥')
+    parser.add_argument('--concurrent', action='store_true', help='使用asyncio并发运行所有探测')
+    parser.add_argument('--base-url', help='用同一个地址替代Google和Maps API (例如本地模拟服务器)')
+    api_metrics.add_arguments(parser)
+    resilience.add_arguments(parser)
     
     args = parser.parse_args()
     
-    run_all_tests(args.api_key)
+    if args.base_url:
+        global GOOGLE_URL, MAPS_BASE_URL
+        GOOGLE_URL = MAPS_BASE_URL = args.base_url.rstrip('/')
+    
+    metrics = api_metrics.from_args(args)
+    # 一次运行只有约6个探测，分属两个主机，断路器状态也不跨运行保存；
+    # 把最少调用数降到3，顺序模式下某个主机连续失败后剩余探测可以快速失败。
+    # 并发模式下所有探测同时发出，断路器来不及生效，只有对冲起作用。
+    # 探测的超时为5秒，超过3秒的响应计为慢请求
+    registry = resilience.registry_from_args(args, metrics, window=60.0, min_calls=3, slow_call_seconds=3.0)
+    try:
+        run_all_tests(args.api_key, concurrent=args.concurrent, metrics=metrics, registry=registry)
+    finally:
+        if registry is not None:
+            print_info(f"断路器状态: {json.dumps(registry.states(), ensure_ascii=False)}")
+        if metrics is not None:
+            metrics.print_summary(file=sys.stdout)
+            metrics.close()
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("使用方法: python test_google_maps_api.py YOUR_API_KEY")
+        print("使用方法: python test_google_maps_api.py YOUR_API_KEY [--concurrent]")
         sys.exit(1)
     
     main()
\ No newline at end of file
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# test_segment_store.py - SegmentStore 的崩溃恢复测试
+#
+# 模拟在追加数据之后、提交索引之前中断 (段尾残留数据、未索引的新段)，
+# 检查重新打开后残余数据被丢弃，之后的写入落在索引记录的偏移处。
+#   python -m pytest test_segment_store.py
+#   python test_segment_store.py
+
+import os
+import tempfile
+
+from segment_store import SegmentStore
+
+
+def write_file(directory, name, data):
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as file:
+        file.write(data)
+    return path
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    root = str(tmp_path / "store")
+    store = SegmentStore(root)
+    store.append("a", write_file(str(tmp_path), "a.mp3", b"AAA"))
+    store.close()
+
+    # 中断的写入：数据已追加到段尾，但索引没有提交
+    with open(os.path.join(root, "segment-000001.dat"), 'ab') as segment:
+        segment.write(b"GARBAGE")
+
+    store = SegmentStore(root)
+    assert os.path.getsize(store.segment_path(1)) == 3
+    store.append("b", write_file(str(tmp_path), "b.mp3", b"BBB"))
+    assert store.read("a") == b"AAA"
+    assert store.read("b") == b"BBB"
+    assert store.locate("b")["offset"] == 3
+    store.close()
+
+
+def test_unindexed_segments_are_removed(tmp_path):
+    root = str(tmp_path / "store")
+    store = SegmentStore(root, segment_size=4)
+    store.append("a", write_file(str(tmp_path), "a.mp3", b"AAA"))
+    store.close()
+
+    # 切换到新段后中断：segment-000002 有数据但没有任何索引记录
+    write_file(root, "segment-000002.dat", b"GARBAGE")
+    write_file(root, "segment-000003.dat", b"MORE")
+
+    store = SegmentStore(root, segment_size=4)
+    assert not os.path.exists(store.segment_path(2))
+    assert not os.path.exists(store.segment_path(3))
+    store.append("b", write_file(str(tmp_path), "b.mp3", b"BBB"))
+    assert store.locate("b")["segment"] == 2
+    assert store.read("b") == b"BBB"
+    assert os.path.getsize(store.segment_path(2)) == 3
+    store.close()
+
+
+def test_duplicate_content_is_rolled_back(tmp_path):
+    root = str(tmp_path / "store")
+    store = SegmentStore(root)
+    first = store.append("a", write_file(str(tmp_path), "a.mp3", b"SAME"))
+    second = store.append("b", write_file(str(tmp_path), "b.mp3", b"SAME"))
+    assert first == second
+    assert os.path.getsize(store.segment_path(1)) == 4
+    store.close()
+
+
+def test_remap_keeps_existing_views(tmp_path):
+    root = str(tmp_path / "store")
+    store = SegmentStore(root)
+    store.append("a", write_file(str(tmp_path), "a.mp3", b"AAA"))
+    view = store.view("a")
+    # 段增长后重新映射，旧的 memoryview 仍然可用
+    store.append("b", write_file(str(tmp_path), "b.mp3", b"BBB"))
+    assert store.read("b") == b"BBB"
+    assert bytes(view) == b"AAA"
+    store.close()
+    view.release()
+
+
+if __name__ == "__main__":
+    import pathlib
+
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_") and callable(test):
+            with tempfile.TemporaryDirectory() as directory:
+                test(pathlib.Path(directory))
+            print(f"通过: {name}")
@@ -3,138 +3,271 @@
 
 import requests
 import json
+import csv
+import os
+import sys
+import time
 import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from response_cache import ResponseCache
+import api_metrics
+import resilience
+from spatial_index import SpatialBucketer, BucketedFetcher
+from weather_models import CurrentWeather, ForecastSeries, Location, loads
+
+UNITS = "metric"
+
+# 设置后替换所有端点的协议和主机 (例如指向本地模拟服务器)
+OPENWEATHER_BASE_URL = os.environ.get("OPENWEATHER_BASE_URL")
+
+# 各端点的URL模板
+ENDPOINT_URLS = {
+    "weather": "https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&units={units}&appid={api_key}",
+    "geocoding": "http://api.openweathermap.org/geo/1.0/reverse?lat={lat}&lon={lon}&limit=1&appid={api_key}",
+    "forecast": "https://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&units={units}&appid={api_key}",
+}
 
 def format_json(json_data):
     """格式化JSON数据以便于阅读"""
     return json.dumps(json_data, indent=2, ensure_ascii=False)
 
-def test_weather_api(api_key, latitude, longitude):
+def build_url(endpoint, api_key, latitude, longitude):
+    """根据端点名称构建请求URL"""
+    url = ENDPOINT_URLS[endpoint].format(lat=latitude, lon=longitude, units=UNITS, api_key=api_key)
+    if OPENWEATHER_BASE_URL:
+        url = OPENWEATHER_BASE_URL.rstrip('/') + url[url.index('/', url.index('//') + 2):]
+    return url
+
+def request_json(endpoint, api_key, latitude, longitude, session=None, cache=None, timeout=None):
+    """请求端点并解析JSON，返回 (数据, 状态码)
+
+    提供缓存时先查缓存，命中则不访问网络，状态码返回 None。
+    HTTP错误状态会抛出 requests.exceptions.HTTPError。
+    """
+    key = cache.make_key(endpoint, latitude, longitude, UNITS) if cache is not None else None
+    if cache is not None:
+        data = cache.get(key)
+        if data is not None:
+            return data, None
+
+    response = (session or requests).get(build_url(endpoint, api_key, latitude, longitude), timeout=timeout)
+    response.raise_for_status()  # 如果HTTP请求返回了不成功的状态码，抛出异常
+    data = loads(response.content)
+    if cache is not None:
+        cache.put(key, data)
+    return data, response.status_code
+
+def na(value):
+    """缺失的字段显示为 N/A"""
+    return 'N/A' if value is None else value
+
+def test_weather_api(api_key, latitude, longitude, session=None, cache=None):
     """测试OpenWeather当前天气API"""
     print("\n===== 测试当前天气API =====")
-    url = f"https://api.openweathermap.org/data/2.5/weather?lat={latitude}&lon={longitude}&units=metric&appid={api_key}"
-    
     try:
-        response = requests.get(url)
-        response.raise_for_status()  # 如果HTTP请求返回了不成功的状态码，抛出异常
-        
-        print(f"状态码: {response.status_code}")
-        weather_data = response.json()
+        weather_data, status = request_json("weather", api_key, latitude, longitude, session, cache)
+        print(f"状态码: {status}" if status else "缓存命中，未访问网络")
         
         print("\n完整的API响应:")
         print(format_json(weather_data))
         
         # 提取和显示一些关键信息
-        if 'name' in weather_data:
-            print(f"\n城市: {weather_data['name']}")
+        weather = CurrentWeather.from_openweather(weather_data)
+        if weather.location.name:
+            print(f"\n城市: {weather.location.name}")
         
         if 'main' in weather_data:
-            main = weather_data['main']
-            print(f"温度: {main.get('temp', 'N/A')}°C")
-            print(f"体感温度: {main.get('feels_like', 'N/A')}°C")
-            print(f"湿度: {main.get('humidity', 'N/A')}%")
-            print(f"气压: {main.get('pressure', 'N/A')} hPa")
+            print(f"温度: {na(weather.temp)}°C")
+            print(f"体感温度: {na(weather.feels_like)}°C")
+            print(f"湿度: {na(weather.humidity)}%")
+            print(f"气压: {na(weather.pressure)} hPa")
         
-        if 'weather' in weather_data and len(weather_data['weather']) > 0:
-            weather = weather_data['weather'][0]
-            print(f"天气状况: {weather.get('main', 'N/A')} - {weather.get('description', 'N/A')}")
-            print(f"天气图标: {weather.get('icon', 'N/A')}")
+        if weather.condition is not None:
+            print(f"天气状况: {na(weather.condition)} - {na(weather.description)}")
+            print(f"天气图标: {na(weather.icon)}")
         
         if 'wind' in weather_data:
-            wind = weather_data['wind']
-            print(f"风速: {wind.get('speed', 'N/A')} m/s")
-            print(f"风向: {wind.get('deg', 'N/A')}°")
-        
-        if 'sys' in weather_data:
-            sys = weather_data['sys']
-            # 转换Unix时间戳为可读格式
-            if 'sunrise' in sys:
-                sunrise_time = datetime.fromtimestamp(sys['sunrise']).strftime('%H:%M:%S')
-                print(f"日出: {sunrise_time}")
-            if 'sunset' in sys:
-                sunset_time = datetime.fromtimestamp(sys['sunset']).strftime('%H:%M:%S')
-                print(f"日落: {sunset_time}")
-            if 'country' in sys:
-                print(f"国家代码: {sys['country']}")
+            print(f"风速: {na(weather.wind_speed)} m/s")
+            print(f"风向: {na(weather.wind_deg)}°")
+        
+        # 转换Unix时间戳为可读格式
+        if weather.sunrise is not None:
+            print(f"日出: {datetime.fromtimestamp(weather.sunrise).strftime('%H:%M:%S')}")
+        if weather.sunset is not None:
+            print(f"日落: {datetime.fromtimestamp(weather.sunset).strftime('%H:%M:%S')}")
+        if weather.location.country:
+            print(f"国家代码: {weather.location.country}")
         
     except requests.exceptions.HTTPError as http_err:
         print(f"HTTP错误: {http_err}")
-        if response.text:
-            print(f"错误详情: {response.text}")
+        if http_err.response is not None and http_err.response.text:
+            print(f"错误详情: {http_err.response.text}")
     except Exception as err:
         print(f"发生错误: {err}")
 
-def test_geocoding_api(api_key, latitude, longitude):
+def test_geocoding_api(api_key, latitude, longitude, session=None, cache=None):
     """测试OpenWeather反向地理编码API"""
     print("\n===== 测试反向地理编码API =====")
-    url = f"http://api.openweathermap.org/geo/1.0/reverse?lat={latitude}&lon={longitude}&limit=1&appid={api_key}"
-    
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        print(f"状态码: {response.status_code}")
-        geocoding_data = response.json()
+        geocoding_data, status = request_json("geocoding", api_key, latitude, longitude, session, cache)
+        print(f"状态码: {status}" if status else "缓存命中，未访问网络")
         
         print("\n完整的API响应:")
         print(format_json(geocoding_data))
         
         # 如果响应是一个列表且不为空
         if isinstance(geocoding_data, list) and len(geocoding_data) > 0:
-            location = geocoding_data[0]
+            location = Location.from_openweather(geocoding_data[0])
             print("\n位置信息:")
-            print(f"名称: {location.get('name', 'N/A')}")
-            print(f"国家: {location.get('country', 'N/A')}")
-            print(f"州/省: {location.get('state', 'N/A')}")
+            print(f"名称: {na(location.name)}")
+            print(f"国家: {na(location.country)}")
+            print(f"州/省: {na(location.region)}")
             
             # 检查是否有本地化名称
-            if 'local_names' in location:
+            if 'local_names' in geocoding_data[0]:
                 print("\n不同语言的地名:")
-                for lang, name in location['local_names'].items():
+                for lang, name in geocoding_data[0]['local_names'].items():
                     print(f"  {lang}: {name}")
         
     except requests.exceptions.HTTPError as http_err:
         print(f"HTTP错误: {http_err}")
-        if response.text:
-            print(f"错误详情: {response.text}")
+        if http_err.response is not None and http_err.response.text:
+            print(f"错误详情: {http_err.response.text}")
     except Exception as err:
         print(f"发生错误: {err}")
 
-def test_forecast_api(api_key, latitude, longitude):
+def test_forecast_api(api_key, latitude, longitude, session=None, cache=None):
     """测试OpenWeather 5天天气预报API"""
     print("\n===== 测试5天天气预报API =====")
-    url = f"https://api.openweathermap.org/data/2.5/forecast?lat={latitude}&lon={longitude}&units=metric&appid={api_key}"
-    
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        print(f"状态码: {response.status_code}")
-        forecast_data = response.json()
+        forecast_data, status = request_json("forecast", api_key, latitude, longitude, session, cache)
+        print(f"状态码: {status}" if status else "缓存命中，未访问网络")
         
         # 只显示第一个预报项以避免输出过多
-        if 'list' in forecast_data and len(forecast_data['list']) > 0:
-            first_forecast = forecast_data['list'][0]
+        series = ForecastSeries.from_openweather(forecast_data)
+        if len(series) > 0:
             print("\n第一个预报项:")
-            print(format_json(first_forecast))
+            print(format_json(forecast_data['list'][0]))
             
-            print(f"\n预报数量: {len(forecast_data['list'])}")
+            print(f"\n预报数量: {len(series)}")
             print("预报时间间隔:")
-            for i in range(min(3, len(forecast_data['list']))):
-                dt = datetime.fromtimestamp(forecast_data['list'][i]['dt'])
-                print(f"  {dt.strftime('%Y-%m-%d %H:%M:%S')}")
+            for timestamp in series.dt[:3]:
+                print(f"  {datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')}")
         else:
             print("\n完整的API响应:")
             print(format_json(forecast_data))
         
     except requests.exceptions.HTTPError as http_err:
         print(f"HTTP错误: {http_err}")
-        if response.text:
-            print(f"错误详情: {response.text}")
+        if http_err.response is not None and http_err.response.text:
+            print(f"错误详情: {http_err.response.text}")
     except Exception as err:
         print(f"发生错误: {err}")
 
+def read_locations(path):
+    """逐行读取坐标文件 (CSV或JSONL)，按需生成 {"id", "lat", "lon"}"""
+    with open(path, newline='', encoding='utf-8') as file:
+        if path.endswith(('.jsonl', '.ndjson')):
+            rows = (json.loads(line) for line in file if line.strip())
+        else:
+            rows = csv.DictReader(file)
+        for index, row in enumerate(rows):
+            try:
+                lat = float(row.get('lat', row.get('latitude')))
+                lon = float(row.get('lon', row.get('longitude')))
+            except (TypeError, ValueError):
+                print(f"跳过坐标无效的第 {index + 1} 条记录", file=sys.stderr)
+                continue
+            yield {"id": row.get('id', index), "lat": lat, "lon": lon}
+
+def create_session(pool_size, metrics=None, registry=None):
+    """创建保持长连接的会话，连接池大小与工作线程数一致
+
+    提供 metrics (api_metrics.ApiMetrics) 时返回记录分阶段耗时的会话；
+    提供 registry (resilience.BreakerRegistry) 时再加上断路器和GET请求对冲。
+    """
+    if metrics is not None:
+        session = metrics.session(len(ENDPOINT_URLS), pool_size)
+    else:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(ENDPOINT_URLS), pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+    if registry is not None:
+        return resilience.ResilientSession(session, registry)
+    return session
+
+def fetch_endpoint(session, endpoint, api_key, location, cache=None, fetcher=None):
+    """请求单个位置的单个端点，返回一条可序列化的结果记录
+
+    提供 fetcher (BucketedFetcher) 时，同一空间桶内的位置共享一次上游请求。
+    """
+    record = {"id": location["id"], "lat": location["lat"], "lon": location["lon"], "endpoint": endpoint}
+    start = time.perf_counter()
+    try:
+        if fetcher is not None:
+            record["bucket"] = fetcher.bucketer.key(location["lat"], location["lon"])
+            (record["data"], status), shared = fetcher.get_shared(location["lat"], location["lon"], endpoint)
+            if shared:
+                # 复用同桶其他位置的结果，本位置没有发出请求
+                record["shared"] = True
+                status = None
+        else:
+            record["data"], status = request_json(
+                endpoint, api_key, location["lat"], location["lon"], session, cache, timeout=10
+            )
+        record["status"] = 200 if status is None else status
+        record["cached"] = status is None
+    except requests.exceptions.HTTPError as http_err:
+        record["status"] = http_err.response.status_code
+        record["error"] = http_err.response.text[:200]
+    except (requests.exceptions.RequestException, ValueError) as err:
+        record["status"] = None
+        record["error"] = str(err)
+    record["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return record
+
+def run_batch(api_key, path, endpoints, workers=8, output=sys.stdout, cache=None, bucketer=None, metrics=None,
+              registry=None):
+    """批量模式: 用有界线程池并发请求所有位置，每完成一个请求输出一行JSON"""
+    max_pending = workers * 2  # 限制在途任务数量，避免一次性读入上千个坐标
+    completed = failed = 0
+    start = time.perf_counter()
+
+    def emit(future):
+        nonlocal completed, failed
+        record = future.result()
+        completed += 1
+        if record["status"] != 200:
+            failed += 1
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        output.flush()
+
+    with create_session(workers, metrics, registry) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        fetcher = None
+        if bucketer is not None:
+            fetcher = BucketedFetcher(bucketer, lambda lat, lon, endpoint: request_json(
+                endpoint, api_key, lat, lon, session, cache, timeout=10
+            ))
+        pending = set()
+        for location in read_locations(path):
+            for endpoint in endpoints:
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        emit(future)
+                pending.add(executor.submit(fetch_endpoint, session, endpoint, api_key, location, cache, fetcher))
+        for future in wait(pending).done:
+            emit(future)
+
+    elapsed = time.perf_counter() - start
+    rate = completed / elapsed if elapsed > 0 else 0.0
+    print(f"批量完成: {completed} 个请求, {failed} 个失败, 耗时 {elapsed:.2f} 秒 ({rate:.1f} 请求/秒)", file=sys.stderr)
+    if fetcher is not None:
+        print(f"空间分桶统计: {json.dumps(fetcher.stats(), ensure_ascii=False)}", file=sys.stderr)
+
 def main():
     parser = argparse.ArgumentParser(description='测试OpenWeather API响应')
     parser.add_argument('api_key', help='OpenWeather API密钥')
@@ -144,22 +277,70 @@ def main():
     parser.add_argument('--weather', action='store_true', help='测试天气API')
     parser.add_argument('--geocoding', action='store_true', help='测试地理编码API')
     parser.add_argument('--forecast', action='store_true', help='测试天气预报API')
+    parser.add_argument('--base-url', help='替代 api.openweathermap.org 的基础URL (例如本地模拟服务器)')
+    parser.add_argument('--batch', metavar='FILE', help='批量模式: 从CSV或JSONL文件读取坐标 (需要lat/lon列)')
+    parser.add_argument('--workers', type=int, default=8, help='批量模式的并发线程数 (默认: 8)')
+    parser.add_argument('--output', metavar='FILE', help='批量模式的JSONL输出文件 (默认: 标准输出)')
+    parser.add_argument('--bucket', choices=SpatialBucketer.SCHEMES, help='批量模式: 按geohash或地图瓦片分桶，每桶只请求一次')
+    parser.add_argument('--bucket-precision', type=int,
+                        help='geohash字符数或瓦片缩放级别 (默认: geohash 6位，瓦片14级，均约1~2公里)')
+    parser.add_argument('--cache', action='store_true', help='启用内存响应缓存')
+    parser.add_argument('--cache-db', metavar='FILE', help='SQLite缓存文件，可跨运行复用 (隐含 --cache)')
+    parser.add_argument('--cache-size', type=int, default=1024, help='内存缓存最大条目数 (默认: 1024)')
+    parser.add_argument('--cache-precision', type=int, default=2, help='缓存键的坐标小数位数 (默认: 2，约1公里)')
+    api_metrics.add_arguments(parser)
+    resilience.add_arguments(parser)
     
     args = parser.parse_args()
     
+    if args.base_url:
+        global OPENWEATHER_BASE_URL
+        OPENWEATHER_BASE_URL = args.base_url
+    
     # 如果没有指定具体API，或者指定了--all，则测试所有API
     test_all = args.all or not (args.weather or args.geocoding or args.forecast)
     
-    print(f"使用坐标: 纬度 {args.lat}, 经度 {args.lon}")
-    
-    if test_all or args.weather:
-        test_weather_api(args.api_key, args.lat, args.lon)
+    cache = None
+    if args.cache or args.cache_db:
+        cache = ResponseCache(max_entries=args.cache_size, db_path=args.cache_db, precision=args.cache_precision)
+    metrics = api_metrics.from_args(args)
+    # 批量模式请求密集，默认的30秒窗口、至少10次调用即可；单次探测只有3个请求，断路器基本不会打开。
+    # OpenWeather 通常在1秒内返回，超时为10秒，超过3秒计为慢请求
+    registry = resilience.registry_from_args(args, metrics, slow_call_seconds=3.0)
     
-    if test_all or args.geocoding:
-        test_geocoding_api(args.api_key, args.lat, args.lon)
-    
-    if test_all or args.forecast:
-        test_forecast_api(args.api_key, args.lat, args.lon)
+    try:
+        if args.batch:
+            endpoints = [name for name in ENDPOINT_URLS if test_all or getattr(args, name)]
+            bucketer = SpatialBucketer(args.bucket, args.bucket_precision) if args.bucket else None
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8') as output:
+                    run_batch(args.api_key, args.batch, endpoints, args.workers, output, cache, bucketer, metrics,
+                              registry)
+            else:
+                run_batch(args.api_key, args.batch, endpoints, args.workers, cache=cache, bucketer=bucketer,
+                          metrics=metrics, registry=registry)
+            return
+        
+        print(f"使用坐标: 纬度 {args.lat}, 经度 {args.lon}")
+        session = create_session(1, metrics, registry) if metrics is not None or registry is not None else None
+        
+        if test_all or args.weather:
+            test_weather_api(args.api_key, args.lat, args.lon, session, cache)
+        
+        if test_all or args.geocoding:
+            test_geocoding_api(args.api_key, args.lat, args.lon, session, cache)
+        
+        if test_all or args.forecast:
+            test_forecast_api(args.api_key, args.lat, args.lon, session, cache)
+    finally:
+        if registry is not None:
+            print(f"断路器状态: {json.dumps(registry.states(), ensure_ascii=False)}", file=sys.stderr)
+        if metrics is not None:
+            metrics.print_summary()
+            metrics.close()
+        if cache is not None:
+            print(f"缓存统计: {json.dumps(cache.stats(), ensure_ascii=False)}", file=sys.stderr)
+            cache.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# weather_models.py - 天气/预报/位置的紧凑记录类型，各脚本共用
+#
+# 响应直接从JSON字节解析为带 __slots__ 的记录 (安装 orjson 时用 orjson 解析)，
+# 不再到处用 data["current"]["temp_c"] 或 .get 链取值。单位统一为 °C、m/s、hPa。
+# 大量记录 (例如缓存的十万条当前天气) 用 WeatherTable 按列保存在 array 中，
+# 每条约100字节，字符串 (地名、天气状况) 只保存一份。
+# 本模块只依赖标准库，numpy 只在 to_numpy() 中按需导入。
+#   python weather_models.py --records 100000   # 对比字典、记录和列表三种形式的内存和解析耗时
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from array import array
+
+try:
+    import orjson
+except ImportError:  # 没有 orjson 时退回标准库
+    orjson = None
+
+MISSING = -1  # 整数列中表示缺失值
+
+MOCK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_responses")
+
+
+def loads(data):
+    """解析JSON (bytes 或 str)，安装了 orjson 时使用 orjson"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _first(items):
+    return items[0] if items else {}
+
+
+def _text(value):
+    """地名、天气状况等在大量记录中反复出现的字符串只保留一份"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Record:
+    """基于 __slots__ 的记录基类：按字段名初始化，未提供的字段为 None"""
+
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.pop(name, None))
+        if fields:
+            raise TypeError(f"{type(self).__name__} 没有字段: {', '.join(fields)}")
+
+    def to_dict(self):
+        return {name: value.to_dict() if isinstance(value, Record) else value
+                for name, value in ((name, getattr(self, name)) for name in self.__slots__)}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__
+                           if getattr(self, name) is not None)
+        return f"{type(self).__name__}({fields})"
+
+
+class Location(Record):
+    """位置：地名、国家、州/省和坐标"""
+
+    __slots__ = ("name", "country", "region", "lat", "lon")
+
+    @classmethod
+    def from_weatherapi(cls, data):
+        """WeatherAPI 响应中的 location 对象"""
+        return cls(name=_text(data.get("name")), country=_text(data.get("country")),
+                   region=_text(data.get("region")), lat=data.get("lat"), lon=data.get("lon"))
+
+    @classmethod
+    def from_openweather(cls, data):
+        """OpenWeather 反向地理编码结果中的一项，或预报响应中的 city 对象"""
+        coord = data.get("coord") or data
+        return cls(name=_text(data.get("name")), country=_text(data.get("country")),
+                   region=_text(data.get("state")), lat=coord.get("lat"), lon=coord.get("lon"))
+
+
+class CurrentWeather(Record):
+    """当前天气 (温度 °C、风速 m/s、气压 hPa，时间为Unix时间戳)"""
+
+    __slots__ = ("location", "observed", "temp", "feels_like", "humidity", "pressure", "wind_speed",
+                 "wind_deg", "condition", "description", "condition_code", "icon", "co", "sunrise", "sunset")
+
+    @property
+    def wind_kph(self):
+        return None if self.wind_speed is None else round(self.wind_speed * 3.6, 1)
+
+    @classmethod
+    def from_weatherapi(cls, data):
+        """WeatherAPI /v1/current.json 响应 (已解析的字典或原始JSON字节)"""
+        if isinstance(data, (bytes, str)):
+            data = loads(data)
+        current = data["current"]
+        condition = current.get("condition") or {}
+        wind_kph = current.get("wind_kph")
+        return cls(
+            location=Location.from_weatherapi(data.get("location") or {}),
+            observed=current.get("last_updated_epoch"),
+            temp=current.get("temp_c"),
+            feels_like=current.get("feelslike_c"),
+            humidity=current.get("humidity"),
+            pressure=current.get("pressure_mb"),
+            wind_speed=None if wind_kph is None else wind_kph / 3.6,
+            wind_deg=current.get("wind_degree"),
+            condition=_text(condition.get("text")),
+            description=_text(condition.get("text")),
+            condition_code=condition.get("code"),
+            icon=_text(condition.get("icon")),
+            co=(current.get("air_quality") or {}).get("co"),
+        )
+
+    @classmethod
+    def from_openweather(cls, data):
+        """OpenWeather /data/2.5/weather 响应 (units=metric)"""
+        if isinstance(data, (bytes, str)):
+            data = loads(data)
+        main = data.get("main") or {}
+        weather = _first(data.get("weather"))
+        wind = data.get("wind") or {}
+        sys_info = data.get("sys") or {}
+        coord = data.get("coord") or {}
+        return cls(
+            location=Location(name=_text(data.get("name")), country=_text(sys_info.get("country")),
+                              lat=coord.get("lat"), lon=coord.get("lon")),
+            observed=data.get("dt"),
+            temp=main.get("temp"),
+            feels_like=main.get("feels_like"),
+            humidity=main.get("humidity"),
+            pressure=main.get("pressure"),
+            wind_speed=wind.get("speed"),
+            wind_deg=wind.get("deg"),
+            condition=_text(weather.get("main")),
+            description=_text(weather.get("description")),
+            condition_code=weather.get("id"),
+            icon=_text(weather.get("icon")),
+            sunrise=sys_info.get("sunrise"),
+            sunset=sys_info.get("sunset"),
+        )
+
+    def prompt_fields(self):
+        """music_mapping / build_music_messages 使用的天气字典"""
+        return {"description": self.description or self.condition, "temperature": self.temp,
+                "humidity": self.humidity, "wind_speed": self.wind_speed,
+                "city": self.location.name if self.location is not None else None}
+
+
+class ForecastPoint(Record):
+    """预报序列中的一个时间点"""
+
+    __slots__ = ("dt", "temp", "humidity", "wind_speed", "pressure", "condition_code")
+
+
+class ForecastSeries:
+    """一个位置的预报，每个字段是一个 array (8字节时间戳，其余为 float32/int16)
+
+    缺失的数值为 NaN，缺失的状况代码为 MISSING。
+    """
+
+    __slots__ = ("location", "dt", "temp", "humidity", "wind_speed", "pressure", "condition_code")
+
+    def __init__(self, location=None):
+        self.location = location
+        self.dt = array("q")
+        self.temp = array("f")
+        self.humidity = array("f")
+        self.wind_speed = array("f")
+        self.pressure = array("f")
+        self.condition_code = array("h")
+
+    @classmethod
+    def from_openweather(cls, data):
+        """OpenWeather /data/2.5/forecast 响应 (units=metric)"""
+        if isinstance(data, (bytes, str)):
+            data = loads(data)
+        city = data.get("city")
+        series = cls(Location.from_openweather(city) if city else None)
+        nan = math.nan
+        for item in data.get("list") or []:
+            main = item.get("main") or {}
+            series.dt.append(item["dt"])
+            series.temp.append(main.get("temp", nan))
+            series.humidity.append(main.get("humidity", nan))
+            series.wind_speed.append((item.get("wind") or {}).get("speed", nan))
+            series.pressure.append(main.get("pressure", nan))
+            series.condition_code.append(_first(item.get("weather")).get("id", MISSING))
+        return series
+
+    def __len__(self):
+        return len(self.dt)
+
+    def __getitem__(self, index):
+        return ForecastPoint(dt=self.dt[index], temp=self.temp[index], humidity=self.humidity[index],
+                             wind_speed=self.wind_speed[index], pressure=self.pressure[index],
+                             condition_code=self.condition_code[index])
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def to_numpy(self):
+        """按列返回 NumPy 数组 (与 array 共享内存，不复制)"""
+        import numpy as np
+
+        return {name: np.frombuffer(getattr(self, name), dtype=getattr(self, name).typecode)
+                for name in self.__slots__ if name != "location"}
+
+
+class WeatherTable:
+    """按列保存大量 CurrentWeather
+
+    数值列是 array (坐标 float64，测量值 float32，湿度和风向 int16，时间戳 int64)，缺失值为 NaN 或 MISSING；
+    字符串列保存在去重后的字符串表中，每条记录只存4字节下标。
+    table[i] 按需还原为 CurrentWeather：湿度和风向按整数取回 (非整数输入四舍五入)，
+    气压统一为 float (WeatherAPI 的 pressure_mb 带小数，OpenWeather 的整数 1012 取回为 1012.0)。
+    """
+
+    FLOAT_COLUMNS = ("temp", "feels_like", "pressure", "wind_speed", "co")
+    SMALL_INT_COLUMNS = ("humidity", "wind_deg")
+    INT_COLUMNS = ("observed", "sunrise", "sunset")
+    STRING_COLUMNS = ("name", "country", "region", "condition", "description", "icon")
+
+    def __init__(self):
+        self.lat = array("d")
+        self.lon = array("d")
+        self.condition_code = array("h")
+        self.columns = {name: array("f") for name in self.FLOAT_COLUMNS}
+        self.columns.update((name, array("h")) for name in self.SMALL_INT_COLUMNS)
+        self.columns.update((name, array("q")) for name in self.INT_COLUMNS)
+        self.columns.update((name, array("i")) for name in self.STRING_COLUMNS)
+        self._strings = [None]
+        self._string_ids = {None: 0}
+
+    def _intern(self, text):
+        index = self._string_ids.get(text)
+        if index is None:
+            index = self._string_ids[text] = len(self._strings)
+            self._strings.append(text)
+        return index
+
+    def append(self, weather):
+        """追加一条 CurrentWeather，返回其下标"""
+        location = weather.location or Location()
+        nan = math.nan
+        self.lat.append(nan if location.lat is None else location.lat)
+        self.lon.append(nan if location.lon is None else location.lon)
+        self.condition_code.append(MISSING if weather.condition_code is None else weather.condition_code)
+        for name in self.FLOAT_COLUMNS:
+            value = getattr(weather, name)
+            self.columns[name].append(nan if value is None else value)
+        for name in self.SMALL_INT_COLUMNS:
+            value = getattr(weather, name)
+            self.columns[name].append(MISSING if value is None else round(value))
+        for name in self.INT_COLUMNS:
+            value = getattr(weather, name)
+            self.columns[name].append(MISSING if value is None else value)
+        for name in ("name", "country", "region"):
+            self.columns[name].append(self._intern(getattr(location, name)))
+        for name in ("condition", "description", "icon"):
+            self.columns[name].append(self._intern(getattr(weather, name)))
+        return len(self.lat) - 1
+
+    def extend(self, records):
+        for weather in records:
+            self.append(weather)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def __getitem__(self, index):
+        def number(column):
+            value = column[index]
+            if value != value:  # NaN 表示缺失
+                return None
+            return float(f"{value:.7g}") if column.typecode == "f" else value  # 去掉 float32 的尾数噪声
+
+        def integer(column):
+            value = column[index]
+            return None if value == MISSING else value
+
+        strings = {name: self._strings[self.columns[name][index]] for name in self.STRING_COLUMNS}
+        location = Location(name=strings["name"], country=strings["country"], region=strings["region"],
+                            lat=number(self.lat), lon=number(self.lon))
+        return CurrentWeather(
+            location=location,
+            condition=strings["condition"], description=strings["description"], icon=strings["icon"],
+            condition_code=integer(self.condition_code),
+            **{name: number(self.columns[name]) for name in self.FLOAT_COLUMNS},
+            **{name: integer(self.columns[name]) for name in self.SMALL_INT_COLUMNS + self.INT_COLUMNS},
+        )
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def nbytes(self):
+        """数值和下标列占用的字节数 (不含字符串表)"""
+        columns = [self.lat, self.lon, self.condition_code, *self.columns.values()]
+        return sum(column.itemsize * len(column) for column in columns)
+
+
+def _measure(build):
+    """返回 (结果, 新分配的内存字节数, 耗时秒)"""
+    import tracemalloc  # 只有对比演示需要，避免拖慢导入
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对比天气记录的三种内存形式 (嵌套字典、__slots__ 记录、按列表格)')
+    parser.add_argument('--records', type=int, default=100000, help='记录条数 (默认: 100000)')
+    parser.add_argument('--source', default='openweather', choices=('openweather', 'weatherapi'),
+                        help='样例响应的来源 (默认: openweather)')
+    args = parser.parse_args()
+
+    filename = "openweather_weather.json" if args.source == "openweather" else "weatherapi_current.json"
+    with open(os.path.join(MOCK_DIR, filename), 'rb') as file:
+        payload = file.read()
+    parse = CurrentWeather.from_openweather if args.source == "openweather" else CurrentWeather.from_weatherapi
+    # 每条记录的坐标和温度不同，避免所有记录共享同一批浮点对象
+    sample = loads(payload)
+    payloads = []
+    for index in range(args.records):
+        if args.source == "openweather":
+            sample["coord"]["lat"], sample["main"]["temp"] = index * 1e-4, index % 400 / 10
+        else:
+            sample["location"]["lat"], sample["current"]["temp_c"] = index * 1e-4, index % 400 / 10
+        payloads.append(json.dumps(sample).encode())
+
+    print(f"{args.records} 条记录, JSON解析器: {'orjson' if orjson is not None else 'json'}")
+    dicts, dict_bytes, dict_time = _measure(lambda: [loads(raw) for raw in payloads])
+    print(f"  嵌套字典:     {dict_bytes / 2 ** 20:8.1f} MB, {dict_time:6.2f}秒")
+    del dicts
+    records, record_bytes, record_time = _measure(lambda: [parse(raw) for raw in payloads])
+    print(f"  __slots__记录: {record_bytes / 2 ** 20:8.1f} MB, {record_time:6.2f}秒")
+
+    def build_table():
+        table = WeatherTable()
+        table.extend(records)
+        return table
+
+    table, table_bytes, table_time = _measure(build_table)
+    print(f"  按列表格:     {table_bytes / 2 ** 20:8.1f} MB, {table_time:6.2f}秒 (由记录转换, "
+          f"每条 {table.nbytes() / max(len(table), 1):.0f} 字节)")
+    print(f"  最后一条: {table[len(table) - 1]!r}")
+
+
+if __name__ == "__main__":
+    main()
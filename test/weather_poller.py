@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# weather_poller.py - 常驻轮询 WeatherAPI，只在影响音乐的天气特征变化时输出事件
+#
+# 每个位置有自己的轮询间隔，用最小堆按到期时间调度，所有请求共享一个长连接会话。
+# 请求带上次响应的 ETag / Last-Modified，服务器返回304时直接跳过；
+# 只有天气状况、温度区间、风力区间或空气质量指数变化时才输出一行JSON事件，
+# 下游不会因为无实质变化的更新而重新生成音乐。
+#   python weather_poller.py locations.csv --interval 600 --output events.jsonl
+#
+# 位置文件为CSV或JSONL，每行需要 q (城市名) 或 lat/lon，可选 id 和 interval (秒)。
+
+import argparse
+import csv
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from urllib.parse import quote
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib", "utils"))
+
+import api_metrics
+import resilience
+from api_test import API_KEY, BASE_URL
+from prompt_cache import condition_group, temperature_band, wind_band
+from stability_audio import parse_retry_after
+from test_weather import create_session
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 900  # WeatherAPI 当前天气大约每15分钟更新一次
+STATE_FLUSH_INTERVAL = 30.0  # ETag 等状态变化最多这么久写一次盘
+MAX_BACKOFF = 3600
+FEATURES = ("condition", "temperature", "wind", "aqi")
+
+# 区间滞回：数值需要越过边界这么多才切换区间，避免在边界附近来回抖动
+TEMPERATURE_MARGIN = 0.5  # °C
+WIND_MARGIN = 0.5  # m/s
+
+
+def load_locations(path, default_interval=DEFAULT_INTERVAL):
+    """读取位置文件，返回 [{"id", "q", "interval"}]"""
+    locations = []
+    with open(path, newline='', encoding='utf-8') as file:
+        if path.endswith(('.jsonl', '.ndjson')):
+            rows = (json.loads(line) for line in file if line.strip())
+        else:
+            rows = csv.DictReader(file)
+        for index, row in enumerate(rows):
+            query = row.get('q') or row.get('city')
+            if not query and row.get('lat') not in (None, '') and row.get('lon') not in (None, ''):
+                query = f"{row['lat']},{row['lon']}"
+            if not query:
+                print(f"跳过缺少 q 或 lat/lon 的第 {index + 1} 条记录", file=sys.stderr)
+                continue
+            locations.append({
+                "id": str(row.get('id') or query),
+                "q": str(query),
+                "interval": float(row.get('interval') or default_interval),
+            })
+    return locations
+
+
+class PollerState:
+    """每个位置的上次特征和 ETag，在内存中更新并批量原子写回磁盘
+
+    轮询几百个位置时每次响应都重写整个文件代价太高，因此只在距上次写盘超过
+    flush_interval 秒时写出；输出事件后应立即调用 flush()，保证重启后不会重复输出。
+    """
+
+    def __init__(self, path, flush_interval=STATE_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._flushed = time.monotonic()
+        self.locations = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                self.locations = json.load(file).get("locations", {})
+
+    def get(self, location_id):
+        with self._lock:
+            return dict(self.locations.get(location_id, {}))
+
+    def update(self, location_id, **fields):
+        with self._lock:
+            self.locations.setdefault(location_id, {}).update(fields)
+            self._dirty = True
+        if time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump({"locations": self.locations}, file, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+            self._dirty = False
+            self._flushed = time.monotonic()
+
+
+# WeatherAPI 状况代码 (https://www.weatherapi.com/docs/weather_conditions.json) 的分组，
+# 分组名与 prompt_cache.condition_group 一致；雨夹雪、冻毛毛雨和冰粒归入 snow
+WEATHERAPI_CONDITIONS = [
+    ((1000, 1000), "clear"),
+    ((1003, 1009), "clouds"),
+    ((1030, 1030), "fog"), ((1135, 1135), "fog"), ((1147, 1147), "fog"),
+    ((1087, 1087), "storm"), ((1273, 1282), "storm"),
+    ((1063, 1063), "rain"), ((1150, 1201), "rain"), ((1240, 1246), "rain"),
+    ((1066, 1066), "snow"), ((1114, 1117), "snow"), ((1210, 1225), "snow"), ((1255, 1258), "snow"),
+    ((1069, 1072), "snow"), ((1204, 1207), "snow"), ((1237, 1237), "snow"), ((1249, 1252), "snow"),
+    ((1261, 1264), "snow"),
+]
+
+
+def weatherapi_condition_group(condition):
+    """按 WeatherAPI 的 condition.code 分组，未知代码时退回按描述文字分组"""
+    code = condition.get("code")
+    if code is not None:
+        code = int(code)
+        for (low, high), group in WEATHERAPI_CONDITIONS:
+            if low <= code <= high:
+                return group
+    return condition_group(condition.get("text"))
+
+
+def stable_band(value, band, previous, margin):
+    """带滞回的区间：只有 value±margin 都落在新区间时才离开 previous"""
+    current = band(value)
+    if previous is None or current == previous:
+        return current
+    if band(value - margin) != previous and band(value + margin) != previous:
+        return current
+    return previous
+
+
+def music_features(current, previous=None):
+    """从 WeatherAPI 的 current 字段提取影响音乐的特征
+
+    区间划分复用 prompt_cache (与提示词缓存和 Dart 端一致)；
+    WeatherAPI 的状况代码与 OpenWeather 不同，按 WEATHERAPI_CONDITIONS 分组。
+    """
+    previous = previous or {}
+    return {
+        "condition": weatherapi_condition_group(current.get("condition") or {}),
+        "temperature": stable_band(current["temp_c"], temperature_band, previous.get("temperature"),
+                                   TEMPERATURE_MARGIN),
+        "wind": stable_band(current["wind_kph"] / 3.6, wind_band, previous.get("wind"), WIND_MARGIN),
+        "aqi": current.get("air_quality", {}).get("us-epa-index"),
+    }
+
+
+class WeatherPoller:
+    """按位置各自的间隔轮询，变化时输出事件
+
+    HTTP请求在线程池中并发执行，调度、变化检测和输出都在调用 run() 的线程中完成。
+    """
+
+    def __init__(self, locations, state, api_key=API_KEY, base_url=BASE_URL, session=None,
+                 output=sys.stdout, workers=4, timeout=10, max_backoff=MAX_BACKOFF, stagger=5.0):
+        self.locations = {location["id"]: location for location in locations}
+        self.state = state
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.session = session or create_session(workers)
+        self.output = output
+        self.workers = workers
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.counts = Counter()
+        self._failures = Counter()
+        self._sequence = itertools.count()
+        self._heap = []
+        now = time.monotonic()
+        for location_id in self.locations:
+            # 首轮在 stagger 秒内错开，避免所有位置同时请求
+            self._schedule(location_id, now + random.uniform(0, stagger))
+
+    def _schedule(self, location_id, due):
+        heapq.heappush(self._heap, (due, next(self._sequence), location_id))
+
+    def fetch(self, location):
+        """发送 (条件) 请求，在工作线程中执行"""
+        record = self.state.get(location["id"])
+        headers = {}
+        if record.get("etag"):
+            headers["If-None-Match"] = record["etag"]
+        if record.get("last_modified"):
+            headers["If-Modified-Since"] = record["last_modified"]
+        url = f"{self.base_url}/v1/current.json?key={self.api_key}&q={quote(location['q'])}&aqi=yes"
+        return self.session.get(url, headers=headers, timeout=self.timeout)
+
+    def handle(self, location, response):
+        """处理响应，返回 (是否成功, 服务器建议的重试等待秒数)"""
+        self.counts["polls"] += 1
+        if response.status_code == 304:
+            self.counts["not_modified"] += 1
+            return True, None
+        if response.status_code != 200:
+            self.counts["errors"] += 1
+            try:
+                message = response.json()["error"]["message"]
+            except (ValueError, KeyError, TypeError):
+                message = response.text[:200]
+            logger.warning(f"[{location['id']}] HTTP {response.status_code}: {message}")
+            return False, parse_retry_after(response.headers.get("Retry-After"))
+
+        current = response.json()["current"]
+        record = self.state.get(location["id"])
+        validators = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+        if record.get("last_updated") == current.get("last_updated_epoch"):
+            # 服务器没有新的观测数据
+            self.counts["unchanged"] += 1
+            if validators != {key: record.get(key) for key in validators}:
+                self.state.update(location["id"], **validators)
+            return True, None
+
+        previous = record.get("features")
+        features = music_features(current, previous)
+        changed = [name for name in FEATURES if previous is None or previous.get(name) != features[name]]
+        self.state.update(location["id"], features=features, last_updated=current.get("last_updated_epoch"),
+                          **validators)
+        if not changed:
+            self.counts["unchanged"] += 1
+            return True, None
+
+        self.counts["events"] += 1
+        self._emit({
+            "id": location["id"],
+            "q": location["q"],
+            "time": datetime.now().isoformat(timespec='seconds'),
+            "changed": changed,
+            "features": features,
+            "previous": previous,
+            "weather": {
+                "condition": current.get("condition", {}).get("text"),
+                "temp_c": current.get("temp_c"),
+                "wind_kph": current.get("wind_kph"),
+                "humidity": current.get("humidity"),
+                "co": current.get("air_quality", {}).get("co"),
+            },
+        })
+        self.state.flush()
+        return True, None
+
+    def _emit(self, event):
+        self.output.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self.output.flush()
+
+    def next_delay(self, location, ok, retry_after=None):
+        """成功时按位置间隔；失败时指数退避 (加抖动)，并遵守 Retry-After"""
+        if ok:
+            self._failures[location["id"]] = 0
+            return location["interval"]
+        self._failures[location["id"]] += 1
+        delay = min(location["interval"] * 2 ** (self._failures[location["id"]] - 1), self.max_backoff)
+        delay = random.uniform(delay / 2, delay)
+        return max(delay, retry_after or 0.0)
+
+    def run(self, rounds=None):
+        """持续轮询；rounds 不为 None 时每个位置轮询 rounds 次后返回"""
+        remaining = Counter({location_id: rounds for location_id in self.locations}) if rounds else None
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                self._loop(executor, remaining)
+            finally:
+                self.state.flush()
+
+    def _loop(self, executor, remaining):
+        pending = {}
+        while self._heap or pending:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, location_id = heapq.heappop(self._heap)
+                pending[executor.submit(self.fetch, self.locations[location_id])] = location_id
+
+            timeout = max(self._heap[0][0] - now, 0.0) if self._heap else None
+            if not pending:
+                time.sleep(timeout)
+                continue
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                location = self.locations[pending.pop(future)]
+                try:
+                    ok, retry_after = self.handle(location, future.result())
+                except resilience.CircuitOpenError as err:
+                    # 请求没有发出：不计入失败次数，冷却结束后再轮询
+                    self.counts["rejected"] += 1
+                    logger.warning(f"[{location['id']}] {err}")
+                    self._schedule(location["id"], time.monotonic() + err.retry_after)
+                    continue
+                except (requests.exceptions.RequestException, ValueError, KeyError) as err:
+                    self.counts["polls"] += 1
+                    self.counts["errors"] += 1
+                    logger.warning(f"[{location['id']}] 请求失败: {err}")
+                    ok, retry_after = False, None
+
+                if remaining is not None:
+                    remaining[location["id"]] -= 1
+                    if remaining[location["id"]] <= 0:
+                        continue
+                self._schedule(location["id"], time.monotonic() + self.next_delay(location, ok, retry_after))
+
+    def stats(self):
+        return {name: self.counts[name]
+                for name in ("polls", "not_modified", "unchanged", "events", "errors", "rejected")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='常驻轮询WeatherAPI，天气特征变化时输出事件')
+    parser.add_argument('locations', help='位置文件 (CSV或JSONL，需要 q 或 lat/lon 列，可选 id、interval)')
+    parser.add_argument('--api-key', default=API_KEY, help='WeatherAPI API密钥')
+    parser.add_argument('--base-url', default=BASE_URL, help='WeatherAPI 基础URL (例如本地模拟服务器)')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help=f'默认轮询间隔 (秒，默认: {DEFAULT_INTERVAL})')
+    parser.add_argument('--workers', type=int, default=4, help='并发请求数 (默认: 4)')
+    parser.add_argument('--state', default='weather_poller.state.json', help='保存上次特征和ETag的状态文件，重启后不会重复输出事件')
+    parser.add_argument('--output', help='事件JSONL输出文件 (默认: 标准输出)')
+    parser.add_argument('--once', action='store_true', help='每个位置只轮询一次后退出')
+    parser.add_argument('--metrics-port', type=int, help='在此端口提供Prometheus /metrics 端点')
+    api_metrics.add_arguments(parser)
+    resilience.add_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    # 把 SIGTERM 当作正常退出，保证统计信息和指标文件被写出
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    locations = load_locations(args.locations, args.interval)
+    metrics = api_metrics.from_args(args)
+    if args.metrics_port and metrics is None:
+        metrics = api_metrics.ApiMetrics()
+    if args.metrics_port:
+        api_metrics.start_metrics_server(metrics, args.metrics_port)
+    # 每个位置十几分钟才轮询一次，用10分钟窗口、至少5次调用判断上游是否故障；
+    # 请求超时为10秒，超过5秒计为慢请求
+    registry = resilience.registry_from_args(args, metrics, window=600.0, min_calls=5, slow_call_seconds=5.0)
+    session = create_session(args.workers, metrics, registry)
+    output = open(args.output, 'a', encoding='utf-8') if args.output else sys.stdout
+
+    poller = WeatherPoller(locations, PollerState(args.state), args.api_key, args.base_url, session, output,
+                           args.workers, stagger=0.0 if args.once else 5.0)
+    logger.info(f"开始轮询 {len(locations)} 个位置")
+    try:
+        poller.run(rounds=1 if args.once else None)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info(f"轮询统计: {json.dumps(poller.stats(), ensure_ascii=False)}")
+        if metrics is not None:
+            metrics.print_summary()
+            metrics.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()